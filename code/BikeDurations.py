@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import logging
+import os
+
+import numpy as np
+
+
+class BikeDurations(object):
+    """
+    Dense matrix with the approximate bike durations between all the pairs
+    of stations. min, value and max are (N, N) arrays in seconds, indexed by
+    the dense index of the stations (self.index). The pairs without a
+    duration are NaN, so any comparison with them is False.
+
+    The matrix is symmetric, the duration of a pair is calculated once from
+    the station added later to the station added before. It is saved in
+    durations_file, so it is only calculated again for new stations or
+    stations that changed their coordinates.
+    """
+    fields = ('min', 'value', 'max')
+
+    def __init__(self, wtime, durations_file=None):
+        self.wtime = wtime
+        self.durations_file = durations_file
+        self.ids = []
+        self.index = {}
+        self.lat = np.zeros(0)
+        self.lon = np.zeros(0)
+        self.min = np.zeros((0, 0))
+        self.value = np.zeros((0, 0))
+        self.max = np.zeros((0, 0))
+
+        if durations_file:
+            try:
+                self._load(durations_file)
+            except IOError:
+                logging.info("Durations file %s not found" % durations_file)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load(self, durations_file):
+        with open(durations_file, 'rb') as f:
+            saved = np.load(f)
+            self.ids = saved['ids'].tolist()
+            self.lat = saved['lat']
+            self.lon = saved['lon']
+            self.min = saved['min']
+            self.value = saved['value']
+            self.max = saved['max']
+        self.index = dict((station_id, i) for i, station_id in enumerate(self.ids))
+        logging.info("Durations of %d stations read from %s" % (len(self.ids), durations_file))
+
+    def save(self):
+        if not self.durations_file:
+            return
+        tmp_file = self.durations_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, ids=np.array(self.ids, dtype=np.int64), lat=self.lat, lon=self.lon,
+                     min=self.min, value=self.value, max=self.max)
+        os.rename(tmp_file, self.durations_file)
+
+    def add_stations(self, stations):
+        """
+        Add the stations to the matrix and calculate the durations of the new
+        pairs. stations is a list of (id, lat, lon). The durations of all the
+        pairs are calculated in one call, so the requests to the api are
+        shared between the stations.
+        """
+        new_stations = []
+        moved = []
+        for station_id, lat, lon in stations:
+            i = self.index.get(station_id)
+            if i is None:
+                new_stations.append((station_id, lat, lon))
+            elif self.lat[i] != lat or self.lon[i] != lon:
+                # the station moved so its durations are not valid
+                logging.info("Station %d changed its coordinates" % station_id)
+                moved.append(i)
+                self.lat[i] = lat
+                self.lon[i] = lon
+                for field in self.fields:
+                    getattr(self, field)[i, :] = np.nan
+                    getattr(self, field)[:, i] = np.nan
+
+        # the pair of two moved stations is calculated once
+        pairs = []
+        moved_indexes = set(moved)
+        for i in moved:
+            pairs.extend((i, j) for j in xrange(len(self.ids)) if j != i and (j not in moved_indexes or j < i))
+
+        if new_stations:
+            first_new = len(self.ids)
+            size = first_new + len(new_stations)
+            for field in self.fields:
+                matrix = np.empty((size, size))
+                matrix.fill(np.nan)
+                matrix[:first_new, :first_new] = getattr(self, field)
+                setattr(self, field, matrix)
+
+            for station_id, lat, lon in new_stations:
+                self.index[station_id] = len(self.ids)
+                self.ids.append(station_id)
+            self.lat = np.append(self.lat, [lat for station_id, lat, lon in new_stations])
+            self.lon = np.append(self.lon, [lon for station_id, lat, lon in new_stations])
+
+            logging.info("Calculating durations of %d new stations" % len(new_stations))
+            for i in xrange(first_new, size):
+                pairs.extend((i, j) for j in xrange(i))
+
+        self._calculate(pairs)
+        if new_stations or moved:
+            self.save()
+
+    def _calculate(self, pairs):
+        if not pairs:
+            return
+        origins = [{'lat': float(self.lat[i]), 'lon': float(self.lon[i])} for i, j in pairs]
+        destinations = [{'lat': float(self.lat[j]), 'lon': float(self.lon[j])} for i, j in pairs]
+        durations = self.wtime.calculate_bike_many(origins, destinations)
+        rows, columns = [np.array(indexes, dtype=np.int64) for indexes in zip(*pairs)]
+        for field, duration in zip(self.fields, durations):
+            matrix = getattr(self, field)
+            matrix[rows, columns] = duration
+            matrix[columns, rows] = duration
+
+    def indexes(self, station_ids):
+        return np.array([self.index[station_id] for station_id in station_ids], dtype=np.int64)
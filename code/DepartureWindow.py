@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import logging
+from collections import deque
+
+import numpy as np
+
+
+class DepartureWindow(object):
+    """
+    Departures of bikes of the last max_time seconds, indexed to find the
+    posible origins of an arrival without scanning the whole window.
+
+    The departures are saved in a deque by time, to remove the old ones, and
+    in a ring buffer by origin station, the rows of self.times indexed like
+    durations (BikeDurations). The oldest and the newest departure of every
+    station are kept apart, so the departures of an origin are only checked
+    if some of them could be in the interval [min, max] of bike durations to
+    the destination. All the arrivals of a timestamp are matched at once.
+    """
+    def __init__(self, durations, max_time=35 * 60, slots=8):
+        self.durations = durations
+        self.max_time = max_time
+        self.departures = deque()  # (timestamp, station index) sorted by time
+        self.times = np.zeros((0, slots))
+        self.head = np.zeros(0, dtype=np.int64)
+        self.size = np.zeros(0, dtype=np.int64)
+        self.oldest = np.zeros(0)
+        self.newest = np.zeros(0)
+
+    def __len__(self):
+        return len(self.departures)
+
+    def __getstate__(self):
+        # the durations are not saved with the window (see
+        # StationsNetworks._save_checkpoint), they should be set again
+        state = self.__dict__.copy()
+        state['durations'] = None
+        return state
+
+    def durations_changed(self):
+        """
+        It should be called when durations are calculated for new stations.
+        """
+        num_new = len(self.durations) - len(self.oldest)
+        if num_new > 0:
+            empty = np.empty((num_new, self.times.shape[1]))
+            empty.fill(np.nan)
+            self.times = np.vstack((self.times, empty))
+            self.head = np.append(self.head, np.zeros(num_new, dtype=np.int64))
+            self.size = np.append(self.size, np.zeros(num_new, dtype=np.int64))
+            self.oldest = np.append(self.oldest, empty[:, 0])
+            self.newest = np.append(self.newest, empty[:, 0])
+
+    def _grow(self):
+        # the rings are unrolled to the beginning of the new rows
+        slots = self.times.shape[1]
+        times = np.empty((len(self.times), slots * 2))
+        times.fill(np.nan)
+        for i in np.flatnonzero(self.size):
+            order = (self.head[i] + np.arange(self.size[i])) % slots
+            times[i, :self.size[i]] = self.times[i, order]
+        self.times = times
+        self.head[:] = 0
+
+    def add(self, timestamp, station_id):
+        i = self.durations.index[station_id]
+        if len(self.oldest) <= i:
+            self.durations_changed()
+        if self.size[i] == self.times.shape[1]:
+            self._grow()
+        self.departures.append((timestamp, i))
+        self.times[i, (self.head[i] + self.size[i]) % self.times.shape[1]] = timestamp
+        if not self.size[i]:
+            self.oldest[i] = timestamp
+        self.size[i] += 1
+        self.newest[i] = timestamp
+
+    def expire(self, timestamp):
+        """
+        Remove the departures with max_time seconds or more.
+        """
+        slots = self.times.shape[1]
+        while self.departures and timestamp - self.departures[0][0] >= self.max_time:
+            departure_timestamp, i = self.departures.popleft()
+            self.times[i, self.head[i]] = np.nan
+            self.head[i] = (self.head[i] + 1) % slots
+            self.size[i] -= 1
+            if self.size[i]:
+                self.oldest[i] = self.times[i, self.head[i]]
+            else:
+                self.oldest[i] = np.nan
+                self.newest[i] = np.nan
+
+    def origins(self, station_ids, timestamp):
+        """
+        Find the stations with a departure that could be the origin of a bike
+        that arrives to every station of station_ids at timestamp. It
+        returns a list with the origins of every station.
+        """
+        if not self.departures or not len(station_ids):
+            return [[] for station_id in station_ids]
+        destinations = self.durations.indexes(station_ids)
+        min_durations = self.durations.min[destinations]
+        max_durations = self.durations.max[destinations]
+        not_destination = np.ones(min_durations.shape, dtype=bool)
+        not_destination[np.arange(len(destinations)), destinations] = False
+
+        with np.errstate(invalid='ignore'):
+            # the stations without departures are NaN. Only the origins whose
+            # oldest and newest departures are around [min, max] are checked
+            is_candidate = (not_destination & (min_durations <= timestamp - self.oldest) &
+                            (max_durations >= timestamp - self.newest))
+            rows, origins = np.nonzero(is_candidate)
+
+            # some departure of every origin should be in [min, max]
+            posible_durations = timestamp - self.times[origins]
+            is_origin = ((posible_durations >= min_durations[rows, origins, np.newaxis]) &
+                         (posible_durations <= max_durations[rows, origins, np.newaxis])).any(axis=1)
+
+        missing = not_destination & (self.size > 0) & np.isnan(min_durations)
+        for row in np.flatnonzero(missing.any(axis=1)):
+            logging.error("Duration not found in nodes (%d, %s)" % (
+                station_ids[row], [self.durations.ids[i] for i in np.flatnonzero(missing[row])]))
+
+        # the origins are sorted by row, they are split by destination
+        rows = rows[is_origin]
+        origins_ids = np.asarray(self.durations.ids)[origins[is_origin]]
+        splits = np.searchsorted(rows, np.arange(1, len(station_ids)))
+        return [found.tolist() for found in np.split(origins_ids, splits)]
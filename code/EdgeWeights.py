@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+from collections import deque, namedtuple
+
+
+# Edges changed by one update. The edges are (u, v) tuples with u <= v
+EdgesChanges = namedtuple('EdgesChanges', ['added', 'updated', 'removed'])
+
+
+class EdgeWeights(object):
+    """
+    Number of times every edge was found in the last ticks, for several
+    windows of ticks. The weight 'weight_5' of an edge is the number of
+    ticks of the last 5 when the edge was found.
+
+    The counts are updated when an edge is found and when that tick leaves
+    a window, using the edges found in the last max(windows) + 1 ticks,
+    so every update only visits the edges found now and the edges found
+    max(windows) + 1 ticks ago. An edge is removed when it isn't found
+    during max(windows) + 1 ticks, after having all the weights 0 for
+    one tick.
+
+    The graph is not directed, so (u, v) and (v, u) are the same edge.
+    """
+    def __init__(self, windows=(1, 5, 15)):
+        self.windows = tuple(sorted(windows))
+        self.keys = ['weight_%d' % window for window in self.windows]
+        self.counts = {}  # edge -> list of counts of every window
+        self.last_found = {}  # edge -> last tick when it was found
+        self.found = deque(maxlen=self.windows[-1] + 2)  # sets of edges of the last ticks
+        self.tick = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, edge):
+        return self._key(edge) in self.counts
+
+    def _key(self, edge):
+        u, v = edge
+        return (u, v) if u <= v else (v, u)
+
+    def weights(self, edge):
+        """
+        Dict with the weights of the edge, {'weight_1': , 'weight_5': , ...}
+        """
+        return dict(zip(self.keys, self.counts[self._key(edge)]))
+
+    def update(self, found_edges):
+        """
+        Count the edges found in a new tick. It returns the EdgesChanges
+        with the edges created, the edges with new weights and the edges
+        removed.
+        """
+        self.tick += 1
+        found_edges = set(self._key(edge) for edge in found_edges)
+        self.found.append(found_edges)
+
+        added = set()
+        updated = set()
+        for edge in found_edges:
+            counts = self.counts.get(edge)
+            if counts is None:
+                self.counts[edge] = [1] * len(self.windows)
+                added.add(edge)
+            else:
+                for k in xrange(len(counts)):
+                    counts[k] += 1
+                updated.add(edge)
+            self.last_found[edge] = self.tick
+
+        # the edges found window ticks ago leave the window
+        for k, window in enumerate(self.windows):
+            if len(self.found) > window:
+                for edge in self.found[-window - 1]:
+                    self.counts[edge][k] -= 1
+                    updated.add(edge)
+
+        # the edges not found in all the windows and the last tick are removed
+        removed = set()
+        if len(self.found) == self.found.maxlen:
+            expired_tick = self.tick - self.found.maxlen + 1
+            for edge in self.found[0]:
+                if self.last_found[edge] == expired_tick:
+                    del self.counts[edge]
+                    del self.last_found[edge]
+                    removed.add(edge)
+
+        updated -= added | removed
+        return EdgesChanges(added, updated, removed)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+from os.path import join
+
+from TimeSeries import TimeSeries
+
+
+class FrameFeed(TimeSeries):
+    """
+    The changes of the graph in a newline delimited json file, drawn by
+    the frontend in a canvas instead of the png files. The first line is
+    the header, {"version": "1.0", "weight_keys": [...], "axis": [...],
+    "keyframe_every": N}, and then there is a line for every timestamp:
+
+    {"t": timestamp,
+     "s": [[id, lon, lat], ...],           new stations
+     "n": [[id, color, size, bikes], ...], stations changed
+     "e": [[u, v, weight, ...], ...],      edges new or with new weights
+     "r": [[u, v], ...]}                   edges removed
+
+    the weights of the edges are in the order of weight_keys and the empty
+    lists are not written. Every keyframe_every timestamps the line is a
+    keyframe, "k": 1 with all the stations, nodes and edges, so the
+    frontend can go to any timestamp applying the changes after the
+    keyframe before it.
+
+    The first line written after discard_after is always a keyframe, so
+    the lines appended to a resumed feed don't depend on the lines written
+    by other runs.
+    """
+    format = 'feed'
+    version = "1.0"
+
+    def __init__(self, output_dir=join("public", "feed"), weight_keys=('weight_1', ), axis=None, keyframe_every=360):
+        self.output_dir = output_dir
+        self.weight_keys = list(weight_keys)
+        self.axis = axis
+        self.keyframe_every = keyframe_every
+        super(FrameFeed, self).__init__(join(output_dir, 'feed.jsonl'), {
+            "version": self.version,
+            "weight_keys": self.weight_keys,
+            "axis": self.axis,
+            "keyframe_every": self.keyframe_every
+            })
+        self.keyframe_next = True
+
+    def discard_after(self, timestamp):
+        self.keyframe_next = True
+        super(FrameFeed, self).discard_after(timestamp)
+
+    def _node(self, G, node_id):
+        node = G.node[node_id]
+        return [node_id, node['color'], round(node['size'], 2), node['bikes']]
+
+    def _edge(self, G, edge):
+        weights = G[edge[0]][edge[1]]
+        return list(edge) + [weights[weight_key] for weight_key in self.weight_keys]
+
+    def add(self, timestamp, G, changes):
+        """
+        Write the line of the timestamp with the GraphChanges of the graph G
+        """
+        line = {"t": timestamp}
+        if self.keyframe_next or self.num_lines % self.keyframe_every == 0:
+            self.keyframe_next = False
+            line["k"] = 1
+            new_nodes = sorted(G.nodes())
+            changed_nodes = new_nodes
+            edges = sorted((min(u, v), max(u, v)) for u, v in G.edges())
+            removed = []
+        else:
+            new_nodes = changes.new_nodes
+            changed_nodes = changes.changed_nodes
+            edges = sorted(changes.edges.added | changes.edges.updated)
+            removed = sorted(changes.edges.removed)
+
+        if new_nodes:
+            line["s"] = [[node_id, G.node[node_id]['lon'], G.node[node_id]['lat']] for node_id in new_nodes]
+        if changed_nodes:
+            line["n"] = [self._node(G, node_id) for node_id in changed_nodes]
+        if edges:
+            line["e"] = [self._edge(G, edge) for edge in edges]
+        if removed:
+            line["r"] = [list(edge) for edge in removed]
+        self.write(line)
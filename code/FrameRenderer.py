@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+from collections import deque, namedtuple
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from os.path import isdir, join
+
+import numpy as np
+
+from FrameWriters import SpriteSheetWriter, VideoWriter
+from Metrics import metrics
+
+
+# Everything needed to draw the graph of one timestamp, without the graph.
+# positions is a (nodes, 2) array of (lon, lat), sizes and colors are the
+# properties of the nodes in the same order, segments is a (edges, 2, 2)
+# array with the positions of the nodes of every edge and widths is a dict
+# with the widths of the edges for every weight key, {'weight_1': , ...}
+Frame = namedtuple('Frame', ['timestamp', 'positions', 'sizes', 'colors', 'segments', 'widths'])
+
+# limits of the map of Barcelona (lon min, lon max, lat min, lat max), the
+# default map of the frames
+AXIS = (2.10, 2.23, 41.35, 41.46)
+
+
+def frame_filename(output_dir, weight_key, timestamp):
+    # the frames are named by their timestamp, so the frames of new data
+    # don't change the names of the old ones
+    return join(output_dir, weight_key, "map_bicing_%d.png" % timestamp)
+
+
+def frame_title(frame):
+    return datetime.fromtimestamp(frame.timestamp).strftime('%d-%m-%y %H:%M:%S')
+
+
+def frame_figure():
+    """
+    A figure and its canvas with the resolution and the colors of
+    plt.savefig, so canvas.print_png writes the same png of plt.savefig with
+    any version of matplotlib (before 2.0 the figures are drawn with 80 dpi
+    and a gray background and print_png doesn't use the savefig settings)
+    """
+    # matplotlib is imported when a frame is drawn, so the feed and the
+    # analytics are written without loading it
+    from matplotlib import rcParams
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    dpi = rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = rcParams['figure.dpi']
+    figure = Figure(dpi=dpi, facecolor=rcParams['savefig.facecolor'], edgecolor=rcParams['savefig.edgecolor'])
+    return figure, FigureCanvasAgg(figure)
+
+
+def frame_image(canvas, drawn=False):
+    """
+    Draw the figure of the canvas and return it as a (height, width, 3)
+    array of the pixels. With drawn the figure was just drawn by print_png
+    and the pixels of its renderer are used without drawing it again.
+    """
+    if not drawn:
+        canvas.draw()
+    width, height = canvas.get_width_height()
+    image = np.frombuffer(canvas.buffer_rgba(), dtype=np.uint8).reshape(height, width, 4)
+    return image[:, :, :3].copy()
+
+
+def draw_frame(frame, output_dir, png=True, raster=False, axis=AXIS):
+    """
+    Draw the png files of a frame, one for every weight key. It uses its
+    own figure, so it can be called from several processes at the same
+    time. The nodes and the edges are drawn like networkx draw_networkx_nodes
+    and draw_networkx_edges.
+
+    It returns the timestamp and, with raster, a dict with the pixels of the
+    image of every weight key, that are written by FrameRenderer in the
+    sprite sheets and the videos.
+    """
+    from matplotlib.collections import LineCollection
+
+    title = frame_title(frame)
+    images = {}
+    for weight_key, widths in sorted(frame.widths.iteritems()):
+        figure, canvas = frame_figure()
+        ax = figure.add_subplot(111)
+
+        # We set the default settings of the graph
+        ax.axis(axis)
+        ax.axis('off')
+        ax.set_title(title)
+
+        if len(frame.segments):
+            edges = LineCollection(frame.segments, colors='g', linewidths=widths, antialiaseds=(1, ))
+            edges.set_zorder(1)  # edges go behind nodes
+            ax.add_collection(edges)
+        if len(frame.positions):
+            nodes = ax.scatter(frame.positions[:, 0], frame.positions[:, 1], s=frame.sizes, c=frame.colors, marker='o')
+            nodes.set_zorder(2)
+
+        if png:
+            canvas.print_png(frame_filename(output_dir, weight_key, frame.timestamp))
+        if raster:
+            images[weight_key] = frame_image(canvas, png)
+    return frame.timestamp, images
+
+
+class FrameDrawer(object):
+    """
+    A figure that is reused to draw many frames. The axes, the title, the
+    nodes and the edges are created once, and for every frame only their
+    data is changed before the figure is drawn, so the result is the same
+    of draw_frame. All the weight keys of a frame are drawn changing only
+    the widths of the edges.
+    """
+    def __init__(self, axis=AXIS):
+        from matplotlib.collections import LineCollection
+
+        self.axis = axis
+        self.figure, self.canvas = frame_figure()
+        self.ax = self.figure.add_subplot(111)
+        self.ax.axis(axis)
+        self.ax.axis('off')
+        self.title = self.ax.set_title('')
+
+        self.edges = LineCollection([], colors='g', antialiaseds=(1, ))
+        self.edges.set_zorder(1)  # edges go behind nodes
+        self.ax.add_collection(self.edges)
+        # the nodes are created with the first frame with nodes
+        self.nodes = None
+
+    def draw(self, frame, output_dir, png=True, raster=False):
+        self.title.set_text(frame_title(frame))
+
+        if len(frame.positions):
+            if self.nodes is None:
+                self.nodes = self.ax.scatter(frame.positions[:, 0], frame.positions[:, 1], s=frame.sizes,
+                                             c=frame.colors, marker='o')
+                self.nodes.set_zorder(2)
+            else:
+                self.nodes.set_offsets(frame.positions)
+                self.nodes.set_sizes(frame.sizes)
+                self.nodes.set_facecolor(frame.colors)
+        if self.nodes is not None:
+            self.nodes.set_visible(len(frame.positions) > 0)
+
+        self.edges.set_segments(frame.segments)
+        self.edges.set_visible(len(frame.segments) > 0)
+        images = {}
+        for weight_key, widths in sorted(frame.widths.iteritems()):
+            if len(frame.segments):
+                self.edges.set_linewidths(widths)
+            if png:
+                self.canvas.print_png(frame_filename(output_dir, weight_key, frame.timestamp))
+            if raster:
+                images[weight_key] = frame_image(self.canvas, png)
+        return frame.timestamp, images
+
+
+# the figure of every process of the pool
+_drawer = None
+
+
+def draw_frame_reusing(frame, output_dir, png=True, raster=False, axis=AXIS):
+    global _drawer
+    if _drawer is None or _drawer.axis != axis:
+        _drawer = FrameDrawer(axis)
+    return _drawer.draw(frame, output_dir, png, raster)
+
+
+class FrameRenderer(object):
+    """
+    Draw the frames in a pool of processes while they are built. Only
+    max_pending frames are sent to the pool without being drawn, so the
+    graph is not built faster than the frames are drawn and the frames are
+    not kept in memory. With one worker the frames are drawn in this
+    process.
+
+    With reuse_figure every process draws all its frames in the same figure
+    (FrameDrawer), otherwise a new figure is created for every png file.
+    axis are the limits of the map, (lon min, lon max, lat min, lat max).
+
+    outputs are the formats written: 'png' a file for every frame and
+    weight key, 'sprites' sprite sheets (SpriteSheetWriter) and 'videos'
+    video segments encoded with ffmpeg (VideoWriter). The png files are
+    written by the workers, the pixels of the sprites and the videos are
+    sent back and written here in the order of the frames.
+
+    The timestamps of the frames drawn are saved in the manifest
+    <output_dir>/frames.json, used by the frontend to find the images,
+    {"version": "1.0", "frames": [timestamp, ...],
+     "sprites": {weight_key: [sheet entry, ...]},
+     "videos": {weight_key: [segment entry, ...]}}
+    It is only saved when all the frames sent to the pool are drawn. The
+    sprite sheet not full is saved then and continued with the next frames,
+    or when the drawing is resumed, and its entry is replaced when it is
+    saved again. The video segments are finished, so with the checkpoints
+    of Networks every segment has at most checkpoint_every frames.
+    """
+    manifest_version = "1.0"
+    formats = ('png', SpriteSheetWriter.format, VideoWriter.format)
+
+    def __init__(self, output_dir=join("public", "images"), workers=None, max_pending=None, reuse_figure=True,
+                 outputs=('png', ), sprites_options=None, videos_options=None, axis=AXIS):
+        self.output_dir = output_dir
+        self.axis = tuple(axis)
+        self.manifest_file = join(output_dir, 'frames.json')
+        self.workers = workers or cpu_count()
+        self.max_pending = max_pending or 2 * self.workers
+        self.draw = draw_frame_reusing if reuse_figure else draw_frame
+        self.weight_keys = set()
+
+        outputs = set(outputs)
+        for output in outputs - set(self.formats):
+            logging.error("Unknown output %s" % output)
+        self.writers_options = {
+            SpriteSheetWriter.format: (SpriteSheetWriter, sprites_options or {}),
+            VideoWriter.format: (VideoWriter, videos_options or {})
+            }
+        ffmpeg = self.writers_options[VideoWriter.format][1].get('ffmpeg', 'ffmpeg')
+        if VideoWriter.format in outputs and not VideoWriter.available(ffmpeg):
+            logging.error("ffmpeg not found, the videos are not written")
+            outputs.remove(VideoWriter.format)
+        self.png = 'png' in outputs
+        self.raster = [output for output in self.formats[1:] if output in outputs]
+        self.writers = {}  # (format, weight_key) -> writer
+
+        self.frames = []
+        self.segments = dict((output, {}) for output in self.formats[1:])
+        self._read_manifest()
+        self.pool = None
+        self.pending = deque()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest['version'] == self.manifest_version:
+                self.frames = manifest['frames']
+                for output in self.segments:
+                    self.segments[output] = manifest.get(output, {})
+            else:
+                logging.error("Version error in %s" % self.manifest_file)
+        except IOError:
+            pass
+
+    def save_manifest(self):
+        self.drain()
+        self._save_writers()
+        if not isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        manifest = {"version": self.manifest_version, "frames": self.frames}
+        for output, segments in self.segments.iteritems():
+            if segments:
+                manifest[output] = segments
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_file, self.manifest_file)
+
+    def discard_after(self, timestamp):
+        """
+        Forget the frames newer than timestamp, they are going to be drawn
+        again. With None all the frames are forgotten.
+        """
+        self.frames = [t for t in self.frames if timestamp is not None and t <= timestamp]
+        for output, segments in self.segments.iteritems():
+            for weight_key in segments:
+                entries = []
+                for entry in segments[weight_key]:
+                    if timestamp is None or entry['frames'][0] > timestamp:
+                        continue
+                    if entry['frames'][-1] > timestamp:
+                        if output != SpriteSheetWriter.format:
+                            continue
+                        # the frames of the sheet after timestamp are drawn
+                        # again in the same sheet
+                        frames = [t for t in entry['frames'] if t <= timestamp]
+                        entry = dict(entry, frames=frames, rows=(len(frames) - 1) // entry['columns'] + 1)
+                    entries.append(entry)
+                segments[weight_key] = entries
+
+    def _make_dirs(self, frame):
+        for weight_key in frame.widths:
+            if weight_key not in self.weight_keys:
+                self.weight_keys.add(weight_key)
+                directory = join(self.output_dir, weight_key)
+                if self.png and not isdir(directory):
+                    os.makedirs(directory)
+
+    def _add_entry(self, output, weight_key, entry):
+        if entry is None:
+            return
+        entries = self.segments[output].setdefault(weight_key, [])
+        if entries and entries[-1]['file'] == entry['file']:
+            # a sheet saved before and continued
+            entries[-1] = entry
+        else:
+            entries.append(entry)
+
+    def _write(self, result):
+        # the frames drawn are written in the sprite sheets and the videos
+        timestamp, images = result
+        for weight_key, image in sorted(images.iteritems()):
+            for output in self.raster:
+                writer = self.writers.get((output, weight_key))
+                if writer is None:
+                    writer_class, options = self.writers_options[output]
+                    writer = self.writers[(output, weight_key)] = writer_class(self.output_dir, weight_key,
+                                                                               **options)
+                    entries = self.segments[output].get(weight_key)
+                    if entries and hasattr(writer, 'resume'):
+                        writer.resume(entries[-1])
+                with metrics.timer(output):
+                    entry = writer.add(timestamp, image)
+                self._add_entry(output, weight_key, entry)
+
+    def _save_writers(self):
+        for (output, weight_key), writer in sorted(self.writers.iteritems()):
+            self._add_entry(output, weight_key, writer.save())
+
+    def drain(self):
+        """
+        Wait until all the frames sent to the pool are drawn
+        """
+        while self.pending:
+            self._wait()
+
+    def _wait(self):
+        # with the pool the time to draw is the time the main process waits
+        with metrics.timer('render_wait'):
+            result = self.pending.popleft().get()
+        self._write(result)
+
+    def render(self, frames):
+        """
+        Draw all the frames of the iterator frames. It returns the number of
+        frames drawn.
+        """
+        num_frames = 0
+        raster = bool(self.raster)
+        if self.workers == 1:
+            for frame in frames:
+                self._make_dirs(frame)
+                logging.info("Drawing frame %d", frame.timestamp)
+                with metrics.timer('render'):
+                    result = self.draw(frame, self.output_dir, self.png, raster, self.axis)
+                self._write(result)
+                self.frames.append(frame.timestamp)
+                num_frames += 1
+            return num_frames
+
+        self.pool = Pool(self.workers)
+        try:
+            for frame in frames:
+                self._make_dirs(frame)
+                if len(self.pending) >= self.max_pending:
+                    self._wait()
+                logging.info("Drawing frame %d", frame.timestamp)
+                self.pending.append(self.pool.apply_async(self.draw, (frame, self.output_dir, self.png, raster,
+                                                                   self.axis)))
+                self.frames.append(frame.timestamp)
+                num_frames += 1
+            self.drain()
+        except:
+            self.pool.terminate()
+            self.pending.clear()
+            raise
+        else:
+            self.pool.close()
+        finally:
+            self.pool.join()
+            self.pool = None
+        return num_frames
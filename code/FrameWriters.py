@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import subprocess
+from distutils.spawn import find_executable
+from os.path import isdir, join
+
+import numpy as np
+
+
+class SpriteSheetWriter(object):
+    """
+    Join the frames of one weight key in sprite sheets, png files with
+    columns x rows frames, so the frontend loads one file for many frames.
+    The frames are placed by rows in the order they are added. The sheet is
+    written when it is full or when close is called, and save writes the
+    sheet not full without finishing it (at the checkpoints), so it is
+    continued with the next frames or with resume when the drawing is
+    resumed.
+
+    The sheets are saved in <output_dir>/sprites/<weight_key>/ and named by
+    the timestamp of their first frame.
+    """
+    format = 'sprites'
+
+    def __init__(self, output_dir, weight_key, columns=8, rows=8):
+        self.output_dir = output_dir
+        self.directory = join('sprites', weight_key)
+        self.columns = columns
+        self.rows = rows
+        self.sheet = None
+        self.timestamps = []
+
+    def add(self, timestamp, image):
+        """
+        Add a frame, image is a (height, width, 3) array. It returns the
+        entry of the sheet if it was written.
+        """
+        height, width = image.shape[:2]
+        if self.sheet is not None and self.sheet.shape[:2] != (self.rows * height, self.columns * width):
+            # the sheet resumed has frames of another size, it is left as it
+            # was saved and a new sheet is started
+            self.sheet = None
+            self.timestamps = []
+        if self.sheet is None:
+            # white, like the background of the frames
+            self.sheet = np.empty((self.rows * height, self.columns * width, 3), dtype=np.uint8)
+            self.sheet.fill(255)
+        row, column = divmod(len(self.timestamps), self.columns)
+        self.sheet[row * height:(row + 1) * height, column * width:(column + 1) * width] = image[:, :, :3]
+        self.timestamps.append(timestamp)
+        if len(self.timestamps) == self.columns * self.rows:
+            return self.close()
+
+    def resume(self, entry):
+        """
+        Continue the sheet of the manifest entry if it is not full
+        """
+        if entry['columns'] != self.columns or len(entry['frames']) >= self.columns * self.rows:
+            return
+        from matplotlib.image import imread
+        try:
+            image = imread(join(self.output_dir, entry['file']))
+        except IOError:
+            logging.error("The sheet %s can't be continued" % entry['file'])
+            return
+        height, width = entry['height'], entry['width']
+        used = min(image.shape[0], entry['rows'] * height)
+        self.sheet = np.empty((self.rows * height, self.columns * width, 3), dtype=np.uint8)
+        self.sheet.fill(255)
+        # the png is read with values from 0 to 1
+        self.sheet[:used] = np.round(image[:used, :, :3] * 255)
+        self.timestamps = list(entry['frames'])
+
+    def save(self):
+        """
+        Write the sheet with the frames added without finishing it. It
+        returns the entry of the sheet for the manifest.
+        """
+        if not self.timestamps:
+            return None
+        rows = (len(self.timestamps) - 1) // self.columns + 1
+        height = self.sheet.shape[0] // self.rows
+        width = self.sheet.shape[1] // self.columns
+        filename = join(self.directory, 'sheet_%d.png' % self.timestamps[0])
+        if not isdir(join(self.output_dir, self.directory)):
+            os.makedirs(join(self.output_dir, self.directory))
+        from matplotlib.image import imsave
+        imsave(join(self.output_dir, filename), self.sheet[:rows * height])
+
+        entry = {
+            'file': filename,
+            'frames': list(self.timestamps),
+            'columns': self.columns,
+            'rows': rows,
+            'width': width,
+            'height': height
+            }
+        return entry
+
+    def close(self):
+        """
+        Write the sheet with the frames added, only the rows used are
+        saved. It returns the entry of the sheet for the manifest.
+        """
+        entry = self.save()
+        self.sheet = None
+        self.timestamps = []
+        return entry
+
+
+class VideoWriter(object):
+    """
+    Encode the frames of one weight key in video segments with ffmpeg.
+    The frames are sent raw through a pipe, so ffmpeg encodes them while
+    the next frames are drawn. A segment is finished when it has
+    max_frames frames or when close or save is called (ffmpeg can't
+    continue a finished segment, so the segments end at every checkpoint
+    and have at most the frames between two checkpoints), and every frame lasts
+    1 / fps seconds, so the frontend finds the frame i of a segment at the
+    time (i + 0.5) / fps.
+
+    The segments are saved in <output_dir>/videos/<weight_key>/ and named by
+    the timestamp of their first frame. With extension 'mp4' they are
+    encoded in h264 and with 'webm' in vp9.
+    """
+    format = 'videos'
+    codecs = {
+        'mp4': ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-movflags', '+faststart'],
+        'webm': ['-c:v', 'libvpx-vp9', '-b:v', '0', '-crf', '33']
+        }
+
+    def __init__(self, output_dir, weight_key, fps=10, max_frames=600, extension='mp4', ffmpeg='ffmpeg'):
+        self.output_dir = output_dir
+        self.directory = join('videos', weight_key)
+        self.fps = fps
+        self.max_frames = max_frames
+        self.extension = extension
+        self.ffmpeg = ffmpeg
+        self.process = None
+        self.filename = None
+        self.timestamps = []
+
+    @staticmethod
+    def available(ffmpeg='ffmpeg'):
+        return find_executable(ffmpeg) is not None
+
+    def _start(self, timestamp, width, height):
+        self.filename = join(self.directory, 'segment_%d.%s' % (timestamp, self.extension))
+        if not isdir(join(self.output_dir, self.directory)):
+            os.makedirs(join(self.output_dir, self.directory))
+        # yuv420p needs an even size
+        command = [self.ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height),
+                   '-r', str(self.fps), '-i', '-',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:0:0:white', '-pix_fmt', 'yuv420p']
+        command += self.codecs[self.extension]
+        command.append(join(self.output_dir, self.filename))
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def add(self, timestamp, image):
+        """
+        Add a frame, image is a (height, width, 3) array. It returns the
+        entry of the segment if it was finished.
+        """
+        if self.process is None:
+            self._start(timestamp, image.shape[1], image.shape[0])
+        self.process.stdin.write(np.ascontiguousarray(image[:, :, :3]).tostring())
+        self.timestamps.append(timestamp)
+        if len(self.timestamps) == self.max_frames:
+            return self.close()
+
+    def save(self):
+        # the segment can't be continued, it is finished
+        return self.close()
+
+    def close(self):
+        """
+        Wait until ffmpeg finishes the segment. It returns the entry of the
+        segment for the manifest, None if it failed.
+        """
+        if self.process is None:
+            return None
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.process = None
+        timestamps, self.timestamps = self.timestamps, []
+        if returncode != 0:
+            logging.error("ffmpeg failed encoding %s" % self.filename)
+            return None
+
+        entry = {
+            'file': self.filename,
+            'frames': timestamps,
+            'fps': self.fps
+            }
+        return entry
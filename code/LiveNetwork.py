@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from cStringIO import StringIO
+from os import listdir
+from os.path import getmtime, isdir, isfile, join
+
+import numpy as np
+import requests
+from matplotlib.image import imsave
+
+from FrameRenderer import FrameDrawer
+from Metrics import metrics
+from Networks import StationsNetworks
+from Snapshots import Snapshots
+from Stations import Stations, parse_file
+
+
+class DirectorySource(object):
+    """
+    The new xml files of a directory, like the data_day directories of
+    Stations.py. The files modified in the last settle seconds are not read
+    yet, they may be being written. Only the names of the files in the
+    directory are remembered, so the memory doesn't grow when the old files
+    are removed.
+    """
+    def __init__(self, data_dir, settle=2):
+        self.data_dir = data_dir
+        self.settle = settle
+        self.seen = set()
+
+    def poll(self):
+        """
+        Return the new snapshots, [(timestamp, stations), ...]
+        """
+        names = set(listdir(self.data_dir))
+        self.seen &= names
+        snapshots = []
+        now = time.time()
+        for name in sorted(names - self.seen):
+            file_path = join(self.data_dir, name)
+            if not isfile(file_path) or now - getmtime(file_path) < self.settle:
+                continue
+            self.seen.add(name)
+            with metrics.timer('xml_parse'):
+                file_path, timestamp, result = parse_file(file_path)
+            if timestamp is None:
+                logging.error("Error in file %s: %s" % (file_path, result))
+            else:
+                snapshots.append((timestamp, result))
+        return snapshots
+
+
+class HttpSource(object):
+    """
+    The xml of the stations served by url, the bicing service or a local
+    stand-in. Only one snapshot is returned every time, if its updatetime
+    is new.
+    """
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.timestamp = None
+
+    def poll(self):
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            with metrics.timer('xml_parse'):
+                stations = Stations(StringIO(response.content))
+                stations.run()
+        except (requests.exceptions.RequestException, ValueError, SyntaxError) as e:
+            logging.error("Error reading %s: %s" % (self.url, e))
+            return []
+        if stations.time == self.timestamp:
+            return []
+        self.timestamp = stations.time
+        return [(stations.time, stations.stations)]
+
+
+class LiveNetwork(StationsNetworks):
+    """
+    Keep the graph of the stations updated with the snapshots of a source
+    while they arrive. Every snapshot is applied to the graph with
+    _build_from_data, like the snapshots of a dataset, and then the state of
+    the graph is published in <output_dir>/state.json and the frame in
+    <output_dir>/<weight_key>.png (with draw). Both files are replaced at
+    once, so they can be served while they are written.
+
+    The memory used doesn't grow with the time: the departures and the
+    edges older than the windows are removed from the state, and only the
+    last latency_samples latencies are kept for the report. The state is
+    saved in <name>_checkpoint.pkl every checkpoint_every snapshots, so the
+    service continues from it when it is started again, and the snapshots
+    can be appended to a dataset (archive) to draw them later with
+    Networks.py.
+    """
+    latency_samples = 1000
+    report_every = 60  # snapshots
+
+    def __init__(self, source, output_dir=join("public", "live"), name='live', archive=None, draw=True,
+                 windows=None, resume=True, poll_interval=30):
+        self._setup(name, windows, 1, resume, (), output_dir)
+        self.source = source
+        self.archive = Snapshots(archive) if archive else None
+        self.drawer = FrameDrawer(self.axis) if draw else None
+        self.poll_interval = poll_interval
+        self.latencies = deque(maxlen=self.latency_samples)  # seconds processing every snapshot
+        self.delays = deque(maxlen=self.latency_samples)  # seconds from the snapshot to its publication
+        self.num_snapshots = 0
+
+    def run(self, max_polls=None):
+        """
+        Poll the source every poll_interval seconds and apply its new
+        snapshots, until max_polls (forever with None) or ctrl-c
+        """
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                start = time.time()
+                for snapshot in sorted(self.source.poll()):
+                    self.process(snapshot)
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(max(0, self.poll_interval - (time.time() - start)))
+        except KeyboardInterrupt:
+            logging.info("Stopping")
+        finally:
+            if self.timestamp is not None:
+                self._save_checkpoint()
+            if self.archive is not None:
+                self.archive.close()
+
+    def process(self, snapshot):
+        """
+        Apply one snapshot (timestamp, stations) to the graph and publish
+        it. The snapshots older than the state are ignored.
+        """
+        start = time.time()
+        if self.timestamp is not None and snapshot[0] <= self.timestamp:
+            logging.info("Snapshot %d is older than the state %d" % (snapshot[0], self.timestamp))
+            return
+        if self.archive is not None:
+            self.archive.append(*snapshot)
+            self.archive.flush()
+
+        for timestamp in self._build_from_data([snapshot]):
+            self._publish(timestamp)
+        self.latencies.append(time.time() - start)
+        self.delays.append(time.time() - snapshot[0])
+        self.num_snapshots += 1
+
+        if self.num_snapshots % self.checkpoint_every == 0:
+            self._save_checkpoint()
+        if self.num_snapshots % self.report_every == 0:
+            logging.info(self.report())
+            logging.debug("Metrics:\n%s", metrics.summary())
+
+    def latency(self):
+        """
+        Percentiles of the latencies of the last snapshots, in seconds
+        """
+        if not self.latencies:
+            return {}
+        latencies = np.array(self.latencies)
+        return {
+            'snapshots': self.num_snapshots,
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max()),
+            'delay': float(self.delays[-1])
+            }
+
+    def report(self):
+        latency = self.latency()
+        return ("%(snapshots)d snapshots, latency p50 %(p50).3f s, p95 %(p95).3f s, max %(max).3f s, "
+                "last delay %(delay).1f s" % latency)
+
+    def _replace(self, file_path, write):
+        # the file is written with another name and renamed
+        tmp_file = file_path + '.tmp'
+        write(tmp_file)
+        os.rename(tmp_file, file_path)
+
+    def _publish(self, timestamp):
+        if not isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        frame = self._get_frame(timestamp)
+        frames = {}
+        if self.drawer is not None:
+            with metrics.timer('render'):
+                timestamp, images = self.drawer.draw(frame, self.output_dir, png=False, raster=True)
+            for weight_key, image in images.iteritems():
+                frames[weight_key] = weight_key + '.png'
+                self._replace(join(self.output_dir, frames[weight_key]),
+                              lambda tmp_file: imsave(tmp_file, image, format='png'))
+
+        nodes = sorted(self.G.nodes())
+        edges = sorted((min(u, v), max(u, v)) for u, v in self.G.edges())
+        state = {
+            'timestamp': timestamp,
+            'weight_keys': self._weight_keys(),
+            'nodes': [[node_id, self.G.node[node_id]['lon'], self.G.node[node_id]['lat'],
+                       self.G.node[node_id]['color'], self.G.node[node_id]['size'], self.G.node[node_id]['bikes']]
+                      for node_id in nodes],
+            'edges': [[u, v] + [self.G[u][v][weight_key] for weight_key in self._weight_keys()] for u, v in edges],
+            'frames': frames,
+            'latency': self.latency(),
+            'metrics': metrics.as_dict()
+            }
+
+        def write_state(tmp_file):
+            with open(tmp_file, 'w') as f:
+                json.dump(state, f, separators=(',', ':'))
+        self._replace(join(self.output_dir, 'state.json'), write_state)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update the network of bikes while the snapshots arrive")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--data-dir', help="directory where the xml files of the snapshots are saved")
+    group.add_argument('--url', help="url of the xml of the stations")
+    parser.add_argument('--interval', type=float, default=30, help="seconds between polls")
+    parser.add_argument('--archive', default=None, help="dataset where the snapshots are appended")
+    parser.add_argument('--output-dir', default=join("public", "live"))
+    parser.add_argument('--no-draw', action='store_true', help="only publish the state, without the frames")
+    parser.add_argument('--no-resume', action='store_true', help="ignore the checkpoint")
+    parser.add_argument('--log-level', default='INFO', help="DEBUG logs every station, INFO by default")
+    args = parser.parse_args()
+
+    # the service runs forever, the debug messages would fill network.log
+    logging.getLogger('').setLevel(args.log_level)
+    source = DirectorySource(args.data_dir) if args.data_dir else HttpSource(args.url)
+    LiveNetwork(source, args.output_dir, archive=args.archive, draw=not args.no_draw,
+                resume=not args.no_resume, poll_interval=args.interval).run()
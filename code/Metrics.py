@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import signal
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os.path import basename
+
+
+class Metrics(object):
+    """
+    Timers and counters of the stages of the pipeline. A timer keeps the
+    number of calls, the seconds and the longest call of a stage, a counter
+    is a number of things (snapshots, cache hits...). The stages are timed
+    once for every snapshot or batch, never for every station, so the
+    metrics don't slow down the hot loops.
+
+    with metrics.timer('origin_matching'):
+        ...
+    metrics.count('walking_cache_hits', hits)
+    """
+    def __init__(self):
+        self.timers = {}  # name -> [calls, seconds, max seconds]
+        self.counters = Counter()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = Counter()
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def timed(self, name, iterator):
+        """
+        Yield the items of iterator, timing how long it takes to get them
+        """
+        iterator = iter(iterator)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.time() - start)
+                return
+            self.add_time(name, time.time() - start)
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def as_dict(self):
+        return {
+            'timers': dict((name, {'calls': calls, 'seconds': seconds, 'max': max_seconds})
+                           for name, (calls, seconds, max_seconds) in self.timers.iteritems()),
+            'counters': dict(self.counters)
+            }
+
+    def summary(self):
+        """
+        The timers sorted by their time and the counters, as text
+        """
+        lines = ["%-20s %10s %10s %10s %10s" % ('stage', 'calls', 'seconds', 'ms/call', 'max ms')]
+        for name, (calls, seconds, max_seconds) in sorted(self.timers.iteritems(), key=lambda item: -item[1][1]):
+            lines.append("%-20s %10d %10.3f %10.3f %10.3f" % (name, calls, seconds, seconds * 1000 / calls,
+                                                              max_seconds * 1000))
+        for name, value in sorted(self.counters.iteritems()):
+            lines.append("%-20s %10d" % (name, value))
+        return '\n'.join(lines)
+
+
+# the metrics of this process, shared by all the modules
+metrics = Metrics()
+
+
+class SamplingProfiler(object):
+    """
+    Sample the stack of the main thread every interval seconds of cpu time
+    with SIGPROF. The samples are dumped in the collapsed format of
+    flamegraph.pl and speedscope, one line "module:function;...;module:function
+    samples" for every stack. It only samples this process, not the
+    processes of the pools, and it only works on unix.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.num_samples = 0
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        # the system calls interrupted by the samples are restarted
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s" % (basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+        self.num_samples += 1
+
+    def top(self, n=20):
+        """
+        The functions with more samples where they were running, [(function, samples), ...]
+        """
+        functions = Counter()
+        for stack, samples in self.stacks.iteritems():
+            functions[stack.rsplit(';', 1)[-1]] += samples
+        return functions.most_common(n)
+
+    def dump(self, profile_file):
+        with open(profile_file, 'w') as f:
+            for stack, samples in sorted(self.stacks.iteritems()):
+                f.write("%s %d\n" % (stack, samples))
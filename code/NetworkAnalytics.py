@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+import heapq
+from collections import Counter, defaultdict, deque
+from os.path import join
+
+from TimeSeries import TimeSeries
+
+
+class WindowAnalytics(object):
+    """
+    Analytics of the graph with the weights of one window, updated with
+    the edges that change in every timestamp instead of visiting all the
+    graph. Only the edges with weight and their nodes are kept.
+
+    - degrees and strengths: number of nodes with every degree and with
+      every strength, the strengths in bins of powers of 2 ([1, 2), [2, 4)...)
+    - the top corridors: the weights are counts of ticks, so the edges are
+      kept in a set for every weight and the heaviest are found from the
+      highest weight
+    - communities: label propagation continued from the labels of the last
+      timestamp, only the nodes of the edges changed and the nodes whose
+      neighbors changed their label are visited. The weights inside the
+      communities and the strengths of the communities are kept, so the
+      modularity is updated when an edge or a label changes. The labels
+      kept grow in big communities with the time, so NetworkAnalytics
+      starts them again from time to time with reset_communities.
+    """
+    max_visits = 5  # visits of the label propagation for every node of the graph
+
+    def __init__(self, top=10):
+        self.top = top
+        self.adj = {}  # node -> {neighbor: weight}
+        self.strength = {}  # node -> sum of the weights of its edges
+        self.by_weight = defaultdict(set)  # weight -> edges
+        self.degrees = Counter()  # degree -> nodes
+        self.strengths = Counter()  # bin of the strength -> nodes
+        self.total = 0  # sum of the weights of all the edges
+        self.num_edges = 0
+
+        self.labels = {}  # node -> community
+        self.next_label = 0  # every new node starts in a new community
+        self.sizes = Counter()  # community -> nodes
+        self.inside = Counter()  # community -> weight of the edges inside it
+        self.totals = Counter()  # community -> strength of its nodes
+        self.sum_inside = 0
+        self.sum_totals2 = 0  # sum of the squares of totals
+        self.dirty = set()  # nodes to visit by the label propagation
+
+    def _move(self, counter, old, new):
+        if old is not None:
+            counter[old] -= 1
+            if not counter[old]:
+                del counter[old]
+        if new is not None:
+            counter[new] += 1
+
+    def _add_total(self, community, delta):
+        total = self.totals[community]
+        self.sum_totals2 += (total + delta) ** 2 - total ** 2
+        self.totals[community] = total + delta
+
+    def _add_node(self, node):
+        self.adj[node] = {}
+        self.strength[node] = 0
+        self.labels[node] = self.next_label
+        self.sizes[self.next_label] += 1
+        self.next_label += 1
+
+    def _remove_node(self, node):
+        # the node has no edges, so its strength is 0
+        community = self.labels.pop(node)
+        self._move(self.sizes, community, None)
+        if not self.sizes[community]:
+            del self.sizes[community]
+            self.inside.pop(community, None)
+            self.totals.pop(community, None)
+        del self.adj[node]
+        del self.strength[node]
+        self.dirty.discard(node)
+
+    def set_weight(self, u, v, weight):
+        """
+        Change the weight of the edge (u, v), with 0 the edge is removed
+        """
+        old = self.adj[u].get(v, 0) if u in self.adj else 0
+        if weight == old:
+            return
+        delta = weight - old
+        edge = (u, v) if u <= v else (v, u)
+        for node in (u, v):
+            if node not in self.adj:
+                self._add_node(node)
+
+        if old:
+            self.by_weight[old].discard(edge)
+            if not self.by_weight[old]:
+                del self.by_weight[old]
+        if weight:
+            self.by_weight[weight].add(edge)
+
+        # the counters are updated here instead of with _move, this is the
+        # hot loop of the analytics
+        degrees = self.degrees
+        strengths = self.strengths
+        for node, neighbor in ((u, v), (v, u)):
+            neighbors = self.adj[node]
+            degree = len(neighbors)
+            if not old:
+                if degree:
+                    degrees[degree] -= 1
+                    if not degrees[degree]:
+                        del degrees[degree]
+                degrees[degree + 1] += 1
+                neighbors[neighbor] = weight
+            elif not weight:
+                degrees[degree] -= 1
+                if not degrees[degree]:
+                    del degrees[degree]
+                if degree > 1:
+                    degrees[degree - 1] += 1
+                del neighbors[neighbor]
+            else:
+                neighbors[neighbor] = weight
+            strength = self.strength[node]
+            old_bin = strength.bit_length() - 1 if strength else None
+            strength += delta
+            new_bin = strength.bit_length() - 1 if strength else None
+            if old_bin != new_bin:
+                if old_bin is not None:
+                    strengths[old_bin] -= 1
+                    if not strengths[old_bin]:
+                        del strengths[old_bin]
+                if new_bin is not None:
+                    strengths[new_bin] += 1
+            self.strength[node] = strength
+            self._add_total(self.labels[node], delta)
+
+        if self.labels[u] == self.labels[v]:
+            self.inside[self.labels[u]] += delta
+            self.sum_inside += delta
+        self.total += delta
+        self.num_edges += (1 if weight else 0) - (1 if old else 0)
+
+        for node in (u, v):
+            if self.adj[node]:
+                self.dirty.add(node)
+            else:
+                self._remove_node(node)
+
+    def reset_communities(self):
+        """
+        Put every node in its own community, the next propagate visits all
+        the nodes
+        """
+        self.labels = {}
+        self.sizes = Counter()
+        self.inside = Counter()
+        self.totals = Counter()
+        self.sum_inside = 0
+        self.sum_totals2 = 0
+        for node in self.adj:
+            self.labels[node] = self.next_label
+            self.sizes[self.next_label] = 1
+            self._add_total(self.next_label, self.strength[node])
+            self.next_label += 1
+        self.dirty = set(self.adj)
+
+    def propagate(self):
+        """
+        Move the nodes changed to the community with more weight among their
+        neighbors, until no node moves or the visits are exhausted
+        """
+        queue = deque(sorted(self.dirty))
+        visits = self.max_visits * len(self.adj)
+        while queue and visits:
+            visits -= 1
+            node = queue.popleft()
+            self.dirty.discard(node)
+            weights = defaultdict(int)
+            for neighbor, weight in self.adj[node].iteritems():
+                weights[self.labels[neighbor]] += weight
+            current = self.labels[node]
+            best_weight = max(weights.itervalues())
+            if weights.get(current) == best_weight:
+                continue
+            new = min(label for label, weight in weights.iteritems() if weight == best_weight)
+
+            # the edges to the old community aren't inside it anymore
+            self.inside[current] -= weights.get(current, 0)
+            self.inside[new] += weights[new]
+            self.sum_inside += weights[new] - weights.get(current, 0)
+            self._add_total(current, -self.strength[node])
+            self._add_total(new, self.strength[node])
+            self._move(self.sizes, current, new)
+            if not self.sizes[current]:
+                del self.sizes[current]
+                self.inside.pop(current, None)
+                self.totals.pop(current, None)
+            self.labels[node] = new
+            for neighbor in self.adj[node]:
+                if neighbor not in self.dirty:
+                    self.dirty.add(neighbor)
+                    queue.append(neighbor)
+        self.dirty.clear()
+
+    def modularity(self):
+        if not self.total:
+            return 0.0
+        return float(self.sum_inside) / self.total - float(self.sum_totals2) / (4 * self.total ** 2)
+
+    def top_edges(self):
+        """
+        The top heaviest edges, [[u, v, weight], ...]
+        """
+        edges = []
+        for weight in sorted(self.by_weight, reverse=True):
+            needed = self.top - len(edges)
+            if needed <= 0:
+                break
+            edges.extend([u, v, weight] for u, v in heapq.nsmallest(needed, self.by_weight[weight]))
+        return edges
+
+    def summary(self, num_nodes):
+        """
+        The analytics as a compact dict. d is the number of nodes with every
+        degree (of num_nodes, the stations) and s the nodes in every bin of
+        the strength.
+        """
+        max_degree = max(self.degrees) if self.degrees else 0
+        degrees = [num_nodes - len(self.adj)] + [self.degrees[d] for d in xrange(1, max_degree + 1)]
+        max_bin = max(self.strengths) if self.strengths else -1
+        return {
+            'n': len(self.adj),
+            'e': self.num_edges,
+            'w': self.total,
+            'd': degrees,
+            's': [self.strengths[b] for b in xrange(max_bin + 1)],
+            'top': self.top_edges(),
+            'c': sum(1 for size in self.sizes.itervalues() if size > 1),
+            'q': round(self.modularity(), 4)
+            }
+
+
+class NetworkAnalytics(object):
+    """
+    The analytics of the graph for every window of weights, updated with
+    the GraphChanges of every timestamp, and the imbalance of the stations:
+    the bikes that arrived minus the bikes that left in the last ticks of
+    the window. The stations with the highest imbalance are in the summary.
+    """
+    def __init__(self, windows=(1, 5, 15), top=10, reset_every=15):
+        self.windows = tuple(sorted(windows))
+        self.reset_every = reset_every  # ticks between resets of the communities
+        self.tick = 0
+        self.keys = ['weight_%d' % window for window in self.windows]
+        self.top = top
+        self.graphs = [WindowAnalytics(top) for window in self.windows]
+        self.bikes = deque(maxlen=self.windows[-1] + 1)  # changes of bikes of the last ticks
+        self.imbalance = [{} for window in self.windows]  # station -> bikes
+        self.num_nodes = 0
+
+    def load_graph(self, G):
+        """
+        Start from the weights of the graph G, without the imbalance
+        """
+        for u, v, weights in G.edges(data=True):
+            for key, graph in zip(self.keys, self.graphs):
+                graph.set_weight(u, v, weights[key])
+        for graph in self.graphs:
+            graph.propagate()
+        self.num_nodes = G.number_of_nodes()
+
+    def update(self, G, changes):
+        for u, v in changes.edges.added | changes.edges.updated:
+            weights = G[u][v]
+            for key, graph in zip(self.keys, self.graphs):
+                graph.set_weight(u, v, weights[key])
+        for u, v in changes.edges.removed:
+            for graph in self.graphs:
+                graph.set_weight(u, v, 0)
+        self.tick += 1
+        for graph in self.graphs:
+            if self.reset_every and self.tick % self.reset_every == 0:
+                graph.reset_communities()
+            graph.propagate()
+        self.num_nodes = G.number_of_nodes()
+
+        # the changes of bikes leave the window after window ticks
+        self.bikes.append(changes.bikes)
+        for window, imbalance in zip(self.windows, self.imbalance):
+            self._add_bikes(imbalance, changes.bikes, 1)
+            if len(self.bikes) > window:
+                self._add_bikes(imbalance, self.bikes[-window - 1], -1)
+
+    def _add_bikes(self, imbalance, bikes, sign):
+        for station, delta in bikes.iteritems():
+            total = imbalance.get(station, 0) + sign * delta
+            if total:
+                imbalance[station] = total
+            else:
+                imbalance.pop(station, None)
+
+    def summary(self):
+        """
+        Dict with the summary of every window, i has the stations with more
+        imbalance, [[station, bikes], ...]
+        """
+        summary = {}
+        for key, graph, imbalance in zip(self.keys, self.graphs, self.imbalance):
+            summary[key] = graph.summary(self.num_nodes)
+            summary[key]['i'] = [[station, bikes] for station, bikes in
+                                 heapq.nlargest(self.top, sorted(imbalance.iteritems()), key=lambda item: abs(item[1]))]
+        return summary
+
+
+class AnalyticsSeries(TimeSeries):
+    """
+    The summary of NetworkAnalytics of every timestamp in
+    <output_dir>/analytics.jsonl, with the header {"version": "1.0",
+    "weight_keys": [...], "top": N} and the lines {"t": timestamp,
+    "weight_1": summary, ...}. The summary of a window is:
+
+    n: nodes with edges, e: edges, w: sum of the weights,
+    d: nodes with every degree (from 0), s: nodes with a strength in
+    [2^i, 2^(i+1)), top: the heaviest edges [[u, v, weight], ...],
+    c: communities with more than one node, q: modularity of the
+    communities, i: the stations with more imbalance [[station, bikes], ...]
+    """
+    format = 'analytics'
+    version = "1.0"
+
+    def __init__(self, analytics, output_dir=join("public", "analytics")):
+        self.analytics = analytics
+        super(AnalyticsSeries, self).__init__(join(output_dir, 'analytics.jsonl'), {
+            "version": self.version,
+            "weight_keys": analytics.keys,
+            "top": analytics.top
+            })
+
+    def add(self, timestamp, G, changes):
+        self.analytics.update(G, changes)
+        line = self.analytics.summary()
+        line["t"] = timestamp
+        self.write(line)
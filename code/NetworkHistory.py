@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import sqlite3
+from os.path import dirname, isdir, isfile, join
+
+
+class NetworkHistory(object):
+    """
+    The graph of every timestamp saved in a sqlite database, to query the
+    network of any time without building it again from the data. Like the
+    feed (FrameFeed) every timestamp has the changes of the graph and every
+    keyframe_every timestamps there is a keyframe with the whole graph:
+
+    snapshots (t, keyframe)
+    nodes (t, id, lon, lat, color, size, bikes)   stations new or changed
+    edges (t, u, v, w0, w1, ...)                  edges new or with new weights,
+                                                  the weights NULL if removed
+    found (origin, destination, t)                edges found, with the direction
+                                                  of the bikes
+
+    The tables are indexed by time, so the graph of a time is read from the
+    keyframe before it and the changes until it, and by the pair of
+    stations in found, for the flows between two stations. The columns of
+    the weights are in the order of weight_keys. Most of the edges change
+    their weights in every timestamp while they are in the windows, so the
+    keyframes don't add many rows and they are frequent.
+
+    It is written with the graph like the feed, the rows are committed in
+    save at the checkpoints and the rows newer than the checkpoint are
+    removed by discard_after. The database uses WAL mode, so the queries
+    can be done by other processes while it is written.
+    """
+    format = 'history'
+    version = "1.0"
+
+    def __init__(self, history_file=join("public", "history.db"), weight_keys=None, keyframe_every=15):
+        self.history_file = history_file
+        self.weight_keys = list(weight_keys) if weight_keys is not None else None
+        self.keyframe_every = keyframe_every
+        self.keyframe_next = True
+        self.since_keyframe = 0
+
+        if self.weight_keys is None and not isfile(history_file):
+            raise IOError("History %s not found" % history_file)
+        directory = dirname(history_file)
+        if directory and not isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(history_file, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+
+        metadata = self._metadata()
+        if self.weight_keys is None:
+            # opened only to query it
+            if metadata.get('version') != self.version:
+                raise ValueError("Version error in history %s" % history_file)
+            self.weight_keys = json.loads(metadata['weight_keys'])
+        self.header = {'version': self.version, 'weight_keys': json.dumps(self.weight_keys)}
+        self.weight_columns = ', '.join('w%d' % k for k in xrange(len(self.weight_keys)))
+        if metadata == self.header:
+            self._create_tables()
+
+    def _metadata(self):
+        return dict(self.connection.execute("SELECT name, value FROM metadata"))
+
+    def _create_tables(self):
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS snapshots (t INTEGER PRIMARY KEY, keyframe INTEGER)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS nodes ("
+                                    "t INTEGER, id INTEGER, lon REAL, lat REAL, color TEXT, size REAL, "
+                                    "bikes INTEGER, PRIMARY KEY (t, id)) WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS edges (t INTEGER, u INTEGER, v INTEGER, %s, "
+                                    "PRIMARY KEY (t, u, v)) WITHOUT ROWID" % ', '.join(
+                                        'w%d INTEGER' % k for k in xrange(len(self.weight_keys))))
+            self.connection.execute("CREATE TABLE IF NOT EXISTS found ("
+                                    "origin INTEGER, destination INTEGER, t INTEGER, "
+                                    "PRIMARY KEY (origin, destination, t)) WITHOUT ROWID")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS found_time ON found (t)")
+
+    def discard_after(self, timestamp):
+        """
+        Remove the timestamps newer than timestamp, they are written again.
+        With None, or if the weight keys are different, all of them are
+        removed.
+        """
+        tables = ('snapshots', 'nodes', 'edges', 'found')
+        with self.connection:
+            if timestamp is None or self._metadata() != self.header:
+                logging.info("Writing %s from the start" % self.history_file)
+                # the columns of the weights can change
+                for table in tables:
+                    self.connection.execute("DROP TABLE IF EXISTS %s" % table)
+                self.connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", self.header.items())
+        self._create_tables()
+        if timestamp is not None:
+            with self.connection:
+                for table in tables:
+                    self.connection.execute("DELETE FROM %s WHERE t > ?" % table, (timestamp, ))
+        self.keyframe_next = True
+
+    def add(self, timestamp, G, changes):
+        """
+        Insert the GraphChanges of the timestamp of the graph G, and the
+        edges found with the direction of the bikes
+        """
+        if self.keyframe_next or self.since_keyframe >= self.keyframe_every:
+            self.keyframe_next = False
+            self.since_keyframe = 0
+            keyframe = 1
+            nodes = G.nodes()
+            edges = [(min(u, v), max(u, v)) for u, v in G.edges()]
+            removed = []
+        else:
+            keyframe = 0
+            nodes = set(changes.new_nodes) | set(changes.changed_nodes)
+            edges = changes.edges.added | changes.edges.updated
+            removed = changes.edges.removed
+        self.since_keyframe += 1
+
+        execute = self.connection.execute
+        executemany = self.connection.executemany
+        execute("INSERT INTO snapshots VALUES (?, ?)", (timestamp, keyframe))
+        executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((timestamp, node_id, G.node[node_id]['lon'], G.node[node_id]['lat'], G.node[node_id]['color'],
+                      G.node[node_id]['size'], G.node[node_id]['bikes']) for node_id in nodes))
+        weight_keys = self.weight_keys
+        values = ', '.join('?' * (3 + len(weight_keys)))
+        executemany("INSERT INTO edges VALUES (%s)" % values,
+                    ((timestamp, u, v) + tuple(G[u][v][weight_key] for weight_key in weight_keys) for u, v in edges))
+        executemany("INSERT INTO edges (t, u, v) VALUES (?, ?, ?)", ((timestamp, u, v) for u, v in removed))
+        executemany("INSERT INTO found VALUES (?, ?, ?)",
+                    ((origin, destination, timestamp) for origin, destination in changes.found))
+
+    def save(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def timestamps(self, start=None, end=None):
+        """
+        The timestamps saved in [start, end]
+        """
+        return [t for t, in self.connection.execute(
+            "SELECT t FROM snapshots WHERE t >= ? AND t <= ? ORDER BY t", self._interval(start, end))]
+
+    def _interval(self, start, end):
+        # sqlite integers have 64 bits
+        return (start if start is not None else -2 ** 63, end if end is not None else 2 ** 63 - 1)
+
+    def state(self, timestamp):
+        """
+        The graph of the last timestamp saved before or at timestamp, from
+        the keyframe before it and the changes after the keyframe:
+
+        {"t": timestamp, "weight_keys": [...],
+         "nodes": [[id, lon, lat, color, size, bikes], ...],
+         "edges": [[u, v, weight, ...], ...]}
+
+        It returns None if there is no timestamp before.
+        """
+        t, = self.connection.execute("SELECT MAX(t) FROM snapshots WHERE t <= ?", (timestamp, )).fetchone()
+        if t is None:
+            return None
+        keyframe, = self.connection.execute("SELECT MAX(t) FROM snapshots WHERE t <= ? AND keyframe = 1",
+                                            (t, )).fetchone()
+
+        nodes = {}
+        for row in self.connection.execute("SELECT id, lon, lat, color, size, bikes FROM nodes "
+                                           "WHERE t >= ? AND t <= ? ORDER BY t", (keyframe, t)):
+            nodes[row[0]] = list(row)
+        edges = {}
+        for row in self.connection.execute("SELECT u, v, %s FROM edges WHERE t >= ? AND t <= ? ORDER BY t" %
+                                           self.weight_columns, (keyframe, t)):
+            if row[2] is not None:
+                edges[row[:2]] = list(row)
+            else:
+                edges.pop(row[:2], None)
+        return {
+            't': t,
+            'weight_keys': self.weight_keys,
+            'nodes': [nodes[node_id] for node_id in sorted(nodes)],
+            'edges': [edges[edge] for edge in sorted(edges)]
+            }
+
+    def flows(self, a, b, start=None, end=None):
+        """
+        The timestamps in [start, end] when the edge between the stations a
+        and b was found, in every direction, {"a_to_b": [...], "b_to_a": [...]}
+        """
+        interval = self._interval(start, end)
+        query = "SELECT t FROM found WHERE origin = ? AND destination = ? AND t >= ? AND t <= ? ORDER BY t"
+        return {
+            'a_to_b': [t for t, in self.connection.execute(query, (a, b) + interval)],
+            'b_to_a': [t for t, in self.connection.execute(query, (b, a) + interval)]
+            }
+
+    def busiest_edges(self, start=None, end=None, top=10):
+        """
+        The edges found more times in [start, end], in any direction,
+        [[u, v, times], ...] with u < v
+        """
+        return [list(row) for row in self.connection.execute(
+            "SELECT MIN(origin, destination) AS u, MAX(origin, destination) AS v, COUNT(*) AS times FROM found "
+            "WHERE t >= ? AND t <= ? GROUP BY u, v ORDER BY times DESC, u, v LIMIT ?",
+            self._interval(start, end) + (top, ))]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the history of the network")
+    parser.add_argument('--history', default=join("public", "history.db"))
+    subparsers = parser.add_subparsers(dest='query')
+    state_parser = subparsers.add_parser('state', help="the graph at a time")
+    state_parser.add_argument('time', type=int)
+    flows_parser = subparsers.add_parser('flows', help="the times when an edge was found")
+    flows_parser.add_argument('a', type=int)
+    flows_parser.add_argument('b', type=int)
+    flows_parser.add_argument('start', type=int, nargs='?')
+    flows_parser.add_argument('end', type=int, nargs='?')
+    busiest_parser = subparsers.add_parser('busiest', help="the edges found more times")
+    busiest_parser.add_argument('start', type=int, nargs='?')
+    busiest_parser.add_argument('end', type=int, nargs='?')
+    busiest_parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    history = NetworkHistory(args.history)
+    if args.query == 'state':
+        result = history.state(args.time)
+    elif args.query == 'flows':
+        result = history.flows(args.a, args.b, args.start, args.end)
+    else:
+        result = history.busiest_edges(args.start, args.end, args.top)
+    print json.dumps(result)
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 
 import networkx as nx
+import numpy as np
 import logging
 import json
-from datetime import datetime
-from os.path import join
+import os
+import cPickle as pickle
+from collections import namedtuple
+from os.path import basename, isdir, join, splitext
 from WalkingTimes import WalkingTimes
-
-# draw graphs without X11 in linux
-import matplotlib
-matplotlib.use('Agg')  # Must be before importing matplotlib.pyplot or pylab!
-import matplotlib.pyplot as plt
+from BikeDurations import BikeDurations
+from DepartureWindow import DepartureWindow
+from EdgeWeights import EdgeWeights
+from FrameFeed import FrameFeed
+from NetworkAnalytics import AnalyticsSeries, NetworkAnalytics
+from NetworkHistory import NetworkHistory
+from FrameRenderer import AXIS, Frame, FrameRenderer
+from Metrics import SamplingProfiler, metrics
+from Snapshots import Snapshots
+from StationsStore import StationsStore
+from StationsDiff import StationsDiff
 
 # set up logging to file
 logging.basicConfig(level=logging.DEBUG,
@@ -28,111 +37,261 @@ console.setFormatter(formatter)
 # add the handler to the root logger
 logging.getLogger('').addHandler(console)
 
+# The changes of the graph in the last timestamp: the ids of the nodes added
+# and of the nodes with new properties, the EdgesChanges, the bikes that
+# arrived (positive) or left (negative) every station, {node_id: bikes}, and
+# the edges found, {(origin, destination), ...}
+GraphChanges = namedtuple('GraphChanges', ['new_nodes', 'changed_nodes', 'edges', 'bikes', 'found'])
+
+
+def state_files(data_file, state_dir=None):
+    """
+    The (checkpoint, durations) files of a dataset. They are next to the
+    data, or in state_dir when the same data is drawn in several output dirs.
+    """
+    state_file = splitext(data_file.rstrip('/'))[0]
+    if state_dir is not None:
+        state_file = join(state_dir, basename(state_file))
+    return state_file + '_checkpoint.pkl', state_file + '_durations.npz'
+
 
 class StationsNetworks(object):
-    def __init__(self):
-        self.data_file = 'data.json'
-        self.G = nx.Graph()
-        self.wtime = WalkingTimes()
+    # the weight_N of an edge is the number of times the edge was found in
+    # the last N timestamps
+    windows = (1, 5, 15)
+
+    # Remove bikes with more than 35 mins. According with wikipedia
+    # More than 95% of rides in the system are shorter than 30 minutes.
+    # https://en.wikipedia.org/wiki/Bicing
+    # We improve the accuracy and reduce times doing this.
+    max_cut_time = 35 * 60  # (35 mins) time in seconds
+
+    checkpoint_version = 1
+    checkpoint_every = 60  # timestamps between checkpoints
+
+    # the outputs written with the graph instead of drawn
+    series_formats = (FrameFeed.format, AnalyticsSeries.format, NetworkHistory.format)
+
+    def __init__(self, data_file='data.jsonl', windows=None, workers=None, resume=True, outputs=('png', ),
+                 output_dir='public', axis=AXIS, cache_file=None, state_dir=None):
+        self._setup(data_file, windows, workers, resume, outputs, output_dir, axis, cache_file, state_dir)
 
         logging.info("Reading data")
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
+            data = self._read_data(self.data_file, self.timestamp)
             logging.info("Data was read")
-        except IOError:
+        except (IOError, OSError):
             logging.error("The file %s don't exist" % self.data_file)
 
         # start the process of drawing the timeseries in png files
         self._draw_timeseries(data)
 
+    def _setup(self, data_file, windows, workers, resume, outputs, output_dir='public', axis=AXIS, cache_file=None,
+               state_dir=None):
+        self.data_file = data_file
+        if windows:
+            self.windows = tuple(windows)
+        # number of processes drawing the frames, by default one per cpu
+        self.workers = workers
+        # formats of the frames, png files, sprite sheets and videos
+        self.outputs = outputs
+        # the images, the feed and the analytics are written in output_dir
+        # and the frames show the map inside axis
+        self.output_dir = output_dir
+        self.axis = tuple(axis)
+        self.wtime = WalkingTimes(cache_file=cache_file)
+        self.checkpoint_file, durations_file = state_files(data_file, state_dir)
+        self.durations = BikeDurations(self.wtime, durations_file)
+        self._reset_state()
+
+        # the snapshots before the checkpoint are not processed again
+        if resume:
+            self._load_checkpoint()
+
+    def _reset_state(self):
+        """
+        The state of the graph after processing the data until
+        self.timestamp, it is saved in the checkpoints
+        """
+        self.G = nx.Graph()
+        self.diff = StationsDiff()
+        self.departures = DepartureWindow(self.durations, self.max_cut_time)
+        self.edge_weights = EdgeWeights(self.windows)
+        self.timestamp = None
+        self.changes = None
+        # the analytics are updated with the graph when they are written
+        self.analytics = NetworkAnalytics(self.windows) if AnalyticsSeries.format in self.outputs else None
+
+    def _save_checkpoint(self):
+        # the durations are saved in their own file
+        state = {
+            'version': self.checkpoint_version,
+            'windows': self.windows,
+            'axis': self.axis,
+            'timestamp': self.timestamp,
+            'G': self.G,
+            'diff': self.diff,
+            'departures': self.departures,
+            'edge_weights': self.edge_weights,
+            'analytics': self.analytics
+            }
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, self.checkpoint_file)
+        logging.info("Checkpoint saved at %d" % self.timestamp)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, 'rb') as f:
+                state = pickle.load(f)
+        except IOError:
+            logging.info("Checkpoint %s not found" % self.checkpoint_file)
+            return
+        # the axis is the map of the stations of a system or a shard, a
+        # checkpoint of other stations is not valid
+        if state['version'] != self.checkpoint_version or state['windows'] != self.windows or \
+                tuple(state.get('axis', AXIS)) != self.axis:
+            logging.info("The checkpoint %s is not valid, all the data is processed" % self.checkpoint_file)
+            return
+
+        self.timestamp = state['timestamp']
+        self.G = state['G']
+        self.diff = state['diff']
+        self.departures = state['departures']
+        self.departures.durations = self.durations
+        self.edge_weights = state['edge_weights']
+        if self.analytics is not None:
+            if state.get('analytics') is not None:
+                self.analytics = state['analytics']
+            else:
+                logging.info("The checkpoint has no analytics, they start from the graph")
+                self.analytics.load_graph(self.G)
+        logging.info("Resuming from the checkpoint at %d" % self.timestamp)
+
+    def _read_data(self, data_file, after=None):
+        """
+        Return the stations data sorted by time. The columnar stores
+        (directories) and the newline delimited files are streamed one snapshot
+        at a time. The old data.json files are a single json list so they have
+        to be loaded and sorted in memory. With after the snapshots of the
+        newline delimited files older than after are skipped using the index,
+        the rest are skipped by StationsDiff.
+        """
+        if isdir(data_file):
+            return StationsStore(data_file)
+
+        if data_file.endswith('.json'):
+            with open(data_file, 'r') as f:
+                data = json.load(f)
+            logging.info("Sorting data")
+            return iter(sorted(data, key=lambda timeserie: timeserie[0]))
+
+        snapshots = Snapshots(data_file)
+        snapshots.update_index()
+        return snapshots.after(after)
+
     def _draw_timeseries(self, data):
-        i = 0
-        for timestamp in self._build_from_data(data):
-            # we get all the properties from the graph
-            nodes_sizes = self._get_node_sizes()
-            nodes_colors = self._get_node_colors()
-            nodes_pos = self._get_positions()
-
-            # we set the title of the graph
-            datatime = datetime.fromtimestamp(timestamp)
-            title = datatime.strftime('%d-%m-%y %H:%M:%S')
-
-            for weight_key in ['weight_1', 'weight_5', 'weight_15']:
-                # We set the default settings of the graph
-                plt.axis((2.10, 2.23, 41.35, 41.46))
-                plt.axis('off')
-                plt.title(title)
-
-                edges_sizes = self._get_edge_sizes(weight_key)
-                filename_map = join("public", "images", weight_key, "map_bicing_%04d.png" % i)
-                logging.info("Drawing file %s" % filename_map)
-
-                # we draw the graph in a file
-                nx.draw_networkx_nodes(self.G, nodes_pos, node_size=nodes_sizes, node_color=nodes_colors, with_labels=False)
-                nx.draw_networkx_edges(self.G, nodes_pos, width=edges_sizes, edge_color='g')
-                plt.savefig(filename_map)
-                plt.close()
-
-            i += 1
-
-    def _get_edge_sizes(self, weight_key):
-        edges = []
-        edges_not_std = [sum(edge[2][weight_key]) for edge in self.G.edges(data=True)]
+        # the frames are drawn by other processes while the graph is built.
+        # The frames newer than the checkpoint are drawn again. The feed and
+        # the analytics are written with the graph, with only them nothing
+        # is drawn
+        outputs = [output for output in self.outputs if output not in self.series_formats]
+        renderer = None
+        if outputs:
+            renderer = FrameRenderer(join(self.output_dir, "images"), self.workers, outputs=outputs, axis=self.axis)
+            renderer.discard_after(self.timestamp)
+        series = []
+        if FrameFeed.format in self.outputs:
+            series.append(FrameFeed(join(self.output_dir, "feed"), self._weight_keys(), self.axis))
+        if AnalyticsSeries.format in self.outputs:
+            series.append(AnalyticsSeries(self.analytics, join(self.output_dir, "analytics")))
+        if NetworkHistory.format in self.outputs:
+            series.append(NetworkHistory(join(self.output_dir, "history.db"), self._weight_keys()))
+        for output in series:
+            output.discard_after(self.timestamp)
+
+        frames = self._iter_frames(data, renderer, series)
+        if renderer is not None:
+            renderer.render(frames)
+        else:
+            for frame in frames:
+                pass
+        self._checkpoint(renderer, series)
+        for output in series:
+            output.close()
+        logging.info("Metrics:\n%s", metrics.summary())
+
+    def _checkpoint(self, renderer, series):
+        # the outputs are saved before the checkpoint, so they are never
+        # behind it
+        if renderer is not None:
+            renderer.save_manifest()
+        for output in series:
+            output.save()
+        if self.timestamp is not None:
+            with metrics.timer('checkpoint'):
+                self._save_checkpoint()
+
+    def _iter_frames(self, data, renderer, series):
+        for i, timestamp in enumerate(self._build_from_data(data), 1):
+            for output in series:
+                with metrics.timer(output.format):
+                    output.add(timestamp, self.G, self.changes)
+            if renderer is not None:
+                with metrics.timer('frame'):
+                    frame = self._get_frame(timestamp)
+                yield frame
+            else:
+                yield None
+            if i % self.checkpoint_every == 0:
+                # the checkpoint is saved when all the frames until it are drawn
+                self._checkpoint(renderer, series)
+
+    def _get_frame(self, timestamp):
+        """
+        Copy the properties of the graph needed to draw it. The nodes and
+        the edges are sorted, so the frames don't depend on the order of
+        the graph, that changes when it is read from a checkpoint.
+        """
+        nodes = sorted(self.G.nodes())
+        edges = sorted((min(u, v), max(u, v)) for u, v in self.G.edges())
+        nodes_pos = self._get_positions()
+        positions = np.array([nodes_pos[node_id] for node_id in nodes], dtype=float).reshape(-1, 2)
+        segments = np.array([(nodes_pos[u], nodes_pos[v]) for u, v in edges], dtype=float).reshape(-1, 2, 2)
+        widths = dict((weight_key, self._get_edge_sizes(weight_key, edges)) for weight_key in self._weight_keys())
+        return Frame(timestamp, positions, self._get_node_sizes(nodes), self._get_node_colors(nodes), segments, widths)
+
+    def _weight_keys(self):
+        return ['weight_%d' % window for window in self.windows]
+
+    def _get_edge_sizes(self, weight_key, edges):
+        sizes = []
+        edges_not_std = [self.G[u][v][weight_key] for u, v in edges]
         if edges_not_std:
             max_edge_value = max(edges_not_std)
             if max_edge_value:
                 constant = float(1) / max_edge_value
             else:
                 constant = 0
-            edges = [edge * constant for edge in edges_not_std]
-        return edges
+            sizes = [edge * constant for edge in edges_not_std]
+        return sizes
 
-    def _get_node_property(self, prop):
-        return [self.G.node[node_id][prop] for node_id in self.G.nodes()]
+    def _get_node_property(self, prop, nodes):
+        return [self.G.node[node_id][prop] for node_id in nodes]
 
-    def _get_node_colors(self):
-        return self._get_node_property('color')
+    def _get_node_colors(self, nodes):
+        return self._get_node_property('color', nodes)
 
-    def _get_node_sizes(self):
-        return self._get_node_property('size')
+    def _get_node_sizes(self, nodes):
+        return self._get_node_property('size', nodes)
 
     def _get_positions(self):
         return {node_id: self.G.node[node_id]['pos'] for node_id in self.G.nodes()}
 
-    def _get_bike_durations(self, origin_position):
-        """
-        Get the duration of node_id against all the nodes present in self.G.nodes()
-        using WalkingTimes.calculate_bike. This get the approximate time spent to
-        go from one station to another in a bike
-        """
-
-        bike_durations = {}
-        for destination_node_id, destination_node_data in self.G.nodes(data=True):
-            bike_duration = self.wtime.calculate_bike(origin_position, destination_node_data)
-            if bike_duration:
-                bike_durations[destination_node_id] = bike_duration['duration']
-
-        return bike_durations
-
-    def _find_posible_origins(self, station_destination_id, station_less_bikes, timestamp):
-        posible_origins = []
-        for timestamp_origin, posible_origin_station_id in station_less_bikes:
-            if station_destination_id != posible_origin_station_id:
-                posible_duration = timestamp - timestamp_origin
-                try:
-                    max_duration = self.G.node[station_destination_id]['bike_durations'][posible_origin_station_id]['max']
-                    min_duration = self.G.node[station_destination_id]['bike_durations'][posible_origin_station_id]['min']
-                    if max_duration >= posible_duration and min_duration <= posible_duration:
-                        posible_origins.append(posible_origin_station_id)
-                except KeyError:
-                    logging.error("Key error in nodes (%d, %d)" % (station_destination_id, posible_origin_station_id))
-
-        return posible_origins
-
     def _build_from_data(self, data):
-        # data is a timeseries list of the form:
-        # [(time1, object), (time2, object), ...]
+        # data is a StationsStore or a timeseries iterator sorted by time of the form:
+        # (time1, object), (time2, object), ...
         # and object is a list of all stations and has the form:
         # [station1, station2, ...]
         # station is an object with the following properties:
@@ -148,166 +307,151 @@ class StationsNetworks(object):
         #   type: -> The type of the stations
         #   id: -> The id of the station }
 
-        max_cut_time = 35 * 60  # (35 mins) time in seconds
-
-        logging.info("Sorting data")
-        # the data should be sorted by time
-        data = sorted(data, key=lambda timeserie: timeserie[0])
-        logging.info("Data sorted")
-
         logging.info("Processing data")
-        station_less_bikes = []
-        for timestamp, stations in data:
-            station_more_bikes = []
-
-            for station in stations:
-                node_id = station['id']
-                bikes = station['bikes']
-                slots = station['slots']
-                status = station['status']
-
+        diff = self.diff
+        departures = self.departures
+        weights = self.edge_weights
+        logger = logging.getLogger('')
+        for timestamp, changes in diff.iter_snapshots(data, self.timestamp):
+            # the messages of every station are only built when they are
+            # logged, they are the slowest part of the loop at DEBUG level
+            debug = logger.isEnabledFor(logging.DEBUG)
+            info = logger.isEnabledFor(logging.INFO)
+            metrics.count('snapshots')
+
+            with metrics.timer('node_update'):
                 # if node don't exist create it
-                if node_id not in self.G.node:
-                    logging.debug("New node found: %d" % node_id)
+                new_stations = []
+                for i in changes.new:
+                    node_id = diff.ids[i]
+                    if debug:
+                        logging.debug("New node found: %d", node_id)
 
                     # The position of the node in the graph is proportional
                     # to the coordinates of the station in a map
-                    lat = station['lat']
-                    lon = station['long']
+                    lat = float(diff.lat[i])
+                    lon = float(diff.lon[i])
                     pos_y = lat
                     pos_x = lon
                     node_pos = [pos_x, pos_y]
 
-                    # We add the number of bikes in the station. We use this
-                    # to know if the number of bikes change in the next timestamp
+                    # The number of bikes, the color and the size are added
+                    # with the rest of the changed nodes
                     properties = {
                         'pos': node_pos,
-                        'bikes': bikes,
                         'lat': lat,
                         'lon': lon
                         }
 
-                    # We found the bike durations from the current node to all the
-                    # nodes
-                    bike_durations = self._get_bike_durations(properties)
-                    properties['bike_durations'] = bike_durations
-
-                    # We have to update the bike durations in all the nodes
-                    for remote_node_id in bike_durations:
-                        bike_duration_to_remote = bike_durations[remote_node_id]
-                        self.G.node[remote_node_id]['bike_durations'][node_id] = bike_duration_to_remote
-
-                    # We add the new node to the graph with the position and bikes property
+                    # We add the new node to the graph with the position property
                     self.G.add_node(node_id, properties)
-
-                # find color for node
-                # green = all ok, there are available bikes in the station
-                # yellow = station not operational
-                # blue = station not operational or with error (bikes = slots = 0)
-                # red = empty station. Station with 0 bikes
-                if status == "OPN":
-                    node_color = "g"
-                else:
-                    node_color = "y"
-
-                # node size start in 10 until 50
-                # if the station is not working the default size is 25
-                try:
-                    node_size = (float(bikes)/(bikes+slots)) * 40 + 10
-                    if not bikes and slots:
-                        node_color = "r"
-                except ZeroDivisionError:
-                    # this usually happen when status is CLS
-                    node_size = 25
-                    node_color = "b"
-
-                # We try to know if the station change from the previous status
-                # this mean if the number of bikes changes
-                previous_bikes = self.G.node[node_id]['bikes']
-                self.G.node[node_id]['bikes'] = bikes
-
+                    new_stations.append((node_id, lat, lon))
+
+                # The colors, sizes and bikes of all the stations are found at
+                # once by StationsDiff, we only update the nodes that changed
+                changed_nodes = []
+                for i in changes.changed:
+                    changed_nodes.append(diff.ids[i])
+                    node = self.G.node[diff.ids[i]]
+                    node['bikes'] = int(diff.bikes[i])
+                    node['color'] = diff.colors_map[diff.colors[i]]
+                    node['size'] = float(diff.sizes[i])
+
+            # We found the bike durations from the new nodes to all the nodes
+            if new_stations:
+                with metrics.timer('duration_lookup'):
+                    self.durations.add_stations(new_stations)
+                    departures.durations_changed()
+
+            with metrics.timer('origin_matching'):
                 # if the number of bikes is lower than before at least one bike is
                 # on road so we add this node to find the destination later (new edge).
                 # if the number of bikes is greater than before at least one bike
                 # arrive to the station. We can set the edge with the origin node.
-                if bikes < previous_bikes:
-                    logging.debug("%d bikes part from station %d" % (previous_bikes - bikes, node_id))
-                    station_less_bikes.append((timestamp, node_id))
-                    node_color = "m"
-                elif bikes > previous_bikes:
-                    logging.debug("%d bikes arrived to station %d" % (bikes - previous_bikes, node_id))
+                bikes = {}
+                for i in changes.departures:
+                    node_id = diff.ids[i]
+                    if debug:
+                        logging.debug("%d bikes part from station %d", -changes.delta[i], node_id)
+                    departures.add(timestamp, node_id)
+                    bikes[node_id] = int(changes.delta[i])
+
+                station_more_bikes = []
+                for i in changes.arrivals:
+                    node_id = diff.ids[i]
+                    if debug:
+                        logging.debug("%d bikes arrived to station %d", changes.delta[i], node_id)
                     station_more_bikes.append(node_id)
-                    node_color = "c"
-
-                # We add the color and size properties to the node
-                self.G.node[node_id]['color'] = node_color
-                self.G.node[node_id]['size'] = node_size
-
-            # Remove bikes with more than 35 mins. According with wikipedia
-            # More than 95% of rides in the system are shorter than 30 minutes.
-            # https://en.wikipedia.org/wiki/Bicing
-            # We improve the accuracy and reduce times doing this.
-            break_i = 0
-            for processed_timestamp, processed_node_id in station_less_bikes:
-                deltatime = timestamp - processed_timestamp
-                if deltatime < max_cut_time:
-                    break
-                break_i += 1
-
-            station_less_bikes = station_less_bikes[break_i:]
-
-            # Find all the edges
-            found_edges = set()
-            for station_destination_id in station_more_bikes:
-                stations_origin_id = self._find_posible_origins(station_destination_id, station_less_bikes, timestamp)
-                logging.info("%d new edges to node %d" % (len(stations_origin_id), station_destination_id))
-                for station_origin_id in stations_origin_id:
-                    found_edges.add((station_origin_id, station_destination_id))
-
-            # Update edges
-            for edge in self.G.edges():
-                weight_1 = self.G[edge[0]][edge[1]]['weight_1']
-                weight_5 = self.G[edge[0]][edge[1]]['weight_5']
-                weight_15 = self.G[edge[0]][edge[1]]['weight_15']
-
-                was_removed = False
-                if edge in found_edges:
-                    # remove edge from set
-                    found_edges.remove(edge)
-
-                    # increment the weight of the edge
-                    weight_1.append(1)
-                    weight_5.append(1)
-                    weight_15.append(1)
-                else:
-                    if sum(weight_15) == 0:
-                        # remove edge
-                        self.G.remove_edge(edge[0], edge[1])
-                        was_removed = True
-                    else:
-                        weight_1.append(0)
-                        weight_5.append(0)
-                        weight_15.append(0)
-
-                # update weights from edge
-                if not was_removed:
-                    self.G[edge[0]][edge[1]]['weight_1'] = weight_1[-1:]
-                    self.G[edge[0]][edge[1]]['weight_5'] = weight_5[-5:]
-                    self.G[edge[0]][edge[1]]['weight_15'] = weight_15[-15:]
-
-            # Create the other edges
-            for edge in found_edges:
-                weights = {
-                    "weight_1": [1],
-                    "weight_5": [1],
-                    "weight_15": [1]
-                }
-                self.G.add_edge(edge[0], edge[1], weights)
+                    bikes[node_id] = int(changes.delta[i])
+
+                departures.expire(timestamp)
+
+                # Find all the edges
+                found_edges = set()
+                posible_origins = departures.origins(station_more_bikes, timestamp)
+                for station_destination_id, stations_origin_id in zip(station_more_bikes, posible_origins):
+                    if info:
+                        logging.info("%d new edges to node %d", len(stations_origin_id), station_destination_id)
+                    for station_origin_id in stations_origin_id:
+                        found_edges.add((station_origin_id, station_destination_id))
+            metrics.count('departures', len(changes.departures))
+            metrics.count('arrivals', len(changes.arrivals))
+            metrics.count('edges_found', len(found_edges))
+
+            with metrics.timer('edge_update'):
+                # Update the weights of the edges found now or some ticks ago,
+                # the edges not found in the last ticks are removed
+                edges_changes = weights.update(found_edges)
+                for edge in edges_changes.removed:
+                    self.G.remove_edge(*edge)
+                for edge in edges_changes.updated:
+                    self.G[edge[0]][edge[1]].update(weights.weights(edge))
+
+                # Create the other edges
+                for edge in edges_changes.added:
+                    self.G.add_edge(edge[0], edge[1], weights.weights(edge))
 
             # when we process all the stations in the timestamp we return
             # the timestamp
+            self.changes = GraphChanges([node_id for node_id, lat, lon in new_stations], changed_nodes,
+                                        edges_changes, bikes, found_edges)
+            self.timestamp = timestamp
             yield timestamp
 
 
 if __name__ == "__main__":
-    net = StationsNetworks()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Draw the networks of bikes of the dataset")
+    parser.add_argument('--data', default='data.jsonl', help="dataset file or store directory")
+    parser.add_argument('--workers', type=int, default=None, help="processes drawing the frames")
+    parser.add_argument('--no-resume', action='store_true', help="ignore the checkpoint and draw all the frames")
+    parser.add_argument('--output', action='append', choices=FrameRenderer.formats + StationsNetworks.series_formats,
+                        help="format of the frames, it can be repeated (png by default)")
+    parser.add_argument('--output-dir', default='public', help="directory of the images, the feed and the analytics")
+    parser.add_argument('--cache-file', default=None, help="walking cache (walking_cache.db by default)")
+    parser.add_argument('--state-dir', default=None, help="directory of the checkpoint (next to the data by default)")
+    parser.add_argument('--log-level', default='DEBUG', help="INFO or WARNING don't log every station")
+    parser.add_argument('--metrics', default=None, help="json file where the timers and counters are saved")
+    parser.add_argument('--profile', default=None, help="file where the samples of the stacks are saved")
+    args = parser.parse_args()
+
+    logging.getLogger('').setLevel(args.log_level)
+    profiler = None
+    if args.profile:
+        profiler = SamplingProfiler()
+        profiler.start()
+    try:
+        net = StationsNetworks(args.data, workers=args.workers, resume=not args.no_resume,
+                               outputs=args.output or ('png', ), output_dir=args.output_dir,
+                               cache_file=args.cache_file, state_dir=args.state_dir)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.dump(args.profile)
+            print "%d samples saved in %s, the functions with more samples:" % (profiler.num_samples, args.profile)
+            for function, samples in profiler.top(10):
+                print "%6d %s" % (samples, function)
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                json.dump(metrics.as_dict(), f, indent=2)
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from email.utils import mktime_tz, parsedate_tz
+from os.path import dirname, getmtime, isdir, isfile, join, relpath, splitext
+
+from FrameRenderer import frame_filename
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the files with the hash of their content in the name, name.<hash>.ext
+HASHED = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+# the files sent compressed when the browser accepts it
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.jsonl', '.map', '.svg', '.txt')
+# (content encoding, extension) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def file_hash(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            md5.update(block)
+    return md5.hexdigest()[:12]
+
+
+class StaticSite(object):
+    """
+    Prepare the public directory to be served by StaticHandler:
+
+    - every frame of <images>/frames.json (the png files, the sprite sheets
+      and the video segments) gets a copy named with the hash of its
+      content, map_bicing_<timestamp>.<hash>.png, and the names are saved
+      in the manifest <images>/frames.hashed.json, used by main.js. These
+      files never change, so the browser keeps them without asking again.
+      They are copies and not links because the frames drawn again after
+      a checkpoint are written in the same files. The copies that are not
+      in the manifest anymore are removed.
+    - the text files (html, css, js, json...) are compressed in <file>.gz,
+      and in <file>.br if the brotli module is installed.
+
+    The hashes are saved in <images>/hashes.json with the size and the time
+    of the files, so only the frames drawn since the last time are read.
+    While the server runs, refresh hashes the frames again when frames.json
+    changes.
+    """
+    manifest_version = "1.0"
+
+    def __init__(self, root='public', images_dir='images'):
+        self.root = root
+        self.images_dir = join(root, images_dir)
+        self.hashes_file = join(self.images_dir, 'hashes.json')
+        self.hashes = {}  # file -> [size, mtime, hash]
+        self.frames_file = join(self.images_dir, 'frames.json')
+        self.hashed_file = join(self.images_dir, 'frames.hashed.json')
+        self.frames_mtime = None  # time of frames.json when it was hashed
+        self.lock = threading.Lock()
+
+    def prepare(self):
+        with self.lock:
+            if isfile(self.frames_file):
+                self.hash_frames()
+            self.compress()
+
+    def refresh(self):
+        """
+        Hash the frames again if frames.json changed since the last time, so
+        the frames drawn while the server runs are in frames.hashed.json
+        """
+        with self.lock:
+            if not isfile(self.frames_file) or getmtime(self.frames_file) == self.frames_mtime:
+                return
+            self.hash_frames()
+            for file_path in (self.hashed_file, self.hashes_file):
+                self.compress_file(file_path)
+
+    def _read_hashes(self):
+        try:
+            with open(self.hashes_file, 'r') as f:
+                self.hashes = json.load(f)
+        except (IOError, ValueError):
+            self.hashes = {}
+
+    def _hashed_file(self, name):
+        """
+        Copy the file name (relative to the images) to the name with its hash
+        and return the new name
+        """
+        file_path = join(self.images_dir, name)
+        stat = os.stat(file_path)
+        cached = self.hashes.get(name)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime]:
+            content_hash = cached[2]
+        else:
+            content_hash = file_hash(file_path)
+            self.hashes[name] = [stat.st_size, stat.st_mtime, content_hash]
+        base, extension = splitext(name)
+        hashed_name = '%s.%s%s' % (base, content_hash, extension)
+        if not isfile(join(self.images_dir, hashed_name)):
+            shutil.copyfile(file_path, join(self.images_dir, hashed_name))
+        return hashed_name
+
+    def hash_frames(self):
+        frames_mtime = getmtime(self.frames_file)
+        with open(self.frames_file, 'r') as f:
+            manifest = json.load(f)
+        self._read_hashes()
+        frames = manifest['frames']
+        hashed = {"version": self.manifest_version, "frames": frames}
+
+        # the png files of every weight key are in a directory
+        png = {}
+        if frames:
+            for weight_key in sorted(os.listdir(self.images_dir)):
+                if isfile(frame_filename(self.images_dir, weight_key, frames[0])):
+                    png[weight_key] = [self._hashed_file(relpath(frame_filename(self.images_dir, weight_key, timestamp),
+                                                                 self.images_dir))
+                                       for timestamp in frames]
+        if png:
+            hashed['png'] = png
+        for output in ('sprites', 'videos'):
+            if output in manifest:
+                hashed[output] = dict((weight_key, [dict(entry, file=self._hashed_file(entry['file']))
+                                                    for entry in entries])
+                                      for weight_key, entries in manifest[output].iteritems())
+
+        used = set(png_file for files in png.itervalues() for png_file in files)
+        for output in ('sprites', 'videos'):
+            used.update(entry['file'] for entries in hashed.get(output, {}).itervalues() for entry in entries)
+        removed = self._remove_unused(set(dirname(name) for name in used), used)
+        self.hashes = dict((name, value) for name, value in self.hashes.iteritems()
+                           if isfile(join(self.images_dir, name)))
+
+        for file_path, content in ((self.hashed_file, hashed),
+                                   (self.hashes_file, self.hashes)):
+            # the files not changed keep their time, they aren't compressed again
+            try:
+                with open(file_path, 'r') as f:
+                    if json.load(f) == content:
+                        continue
+            except (IOError, ValueError):
+                pass
+            tmp_file = file_path + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(content, f)
+            os.rename(tmp_file, file_path)
+        self.frames_mtime = frames_mtime
+        logging.info("%d frames with hashed files, %d old files removed" % (len(frames), removed))
+
+    def _remove_unused(self, directories, used):
+        removed = 0
+        for directory in directories:
+            for name in os.listdir(join(self.images_dir, directory)):
+                name = join(directory, name)
+                if HASHED.search(name) and name not in used:
+                    os.remove(join(self.images_dir, name))
+                    removed += 1
+        return removed
+
+    def compress(self):
+        """
+        Write the compressed files that don't exist or are older than their
+        file. The gzip files don't save the time, so they are the same for
+        the same file.
+        """
+        num_files = 0
+        for path, directories, names in os.walk(self.root):
+            for name in names:
+                if splitext(name)[1] in COMPRESSIBLE:
+                    num_files += self.compress_file(join(path, name))
+        logging.info("%d files compressed" % num_files)
+
+    def compress_file(self, file_path):
+        """
+        Compress a file in every encoding, it returns the number of
+        compressed files written
+        """
+        num_files = 0
+        for encoding, extension in ENCODINGS:
+            compressed_file = file_path + extension
+            if encoding == 'br' and brotli is None:
+                continue
+            if isfile(compressed_file) and getmtime(compressed_file) >= getmtime(file_path):
+                continue
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            tmp_file = compressed_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                if encoding == 'br':
+                    f.write(brotli.compress(content))
+                else:
+                    with gzip.GzipFile('', 'wb', 9, f, 0) as compressed:
+                        compressed.write(content)
+            os.rename(tmp_file, compressed_file)
+            num_files += 1
+        return num_files
+
+
+class StaticHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the files of root like SimpleHTTPRequestHandler, without listing
+    the directories, with:
+
+    - the compressed file (.br or .gz) when the browser accepts its encoding
+      and it is newer than the file
+    - Cache-Control immutable for one year for the files with a hash in the
+      name, the rest have to be validated with ETag or Last-Modified
+    - the ranges of bytes of the files, one range by request (the videos
+      are read with ranges)
+
+    frames.hashed.json is made again by site (a StaticSite) before it is
+    sent if frames.json changed.
+    """
+    root = 'public'
+    site = None
+    immutable_max_age = 365 * 24 * 3600
+
+    def translate_path(self, path):
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        return join(self.root, relpath(path, os.getcwd()))
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if self.site is not None and path == self.site.hashed_file:
+            try:
+                self.site.refresh()
+            except (IOError, OSError, ValueError):
+                # the manifest hashed before is sent
+                logging.exception("Error hashing the frames")
+        if isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                self.send_response(301)
+                self.send_header('Location', self.path.split('?', 1)[0] + '/')
+                self.end_headers()
+                return None
+            path = join(path, 'index.html')
+        if not isfile(path):
+            self.send_error(404, "File not found")
+            return None
+
+        stat = os.stat(path)
+        etag = '"%x-%x' % (stat.st_size, int(stat.st_mtime))
+        served_path = path
+        encoding = None
+        range_header = self.headers.getheader('Range')
+        if splitext(path)[1] in COMPRESSIBLE and range_header is None:
+            accepted = [value.split(';')[0].strip() for value in self.headers.getheader('Accept-Encoding', '').split(',')]
+            for name, extension in ENCODINGS:
+                if name in accepted and isfile(path + extension) and getmtime(path + extension) >= stat.st_mtime:
+                    encoding = name
+                    served_path = path + extension
+                    etag += '-' + name
+                    break
+        etag += '"'
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self._send_cache_headers(path, etag, stat.st_mtime)
+            self.end_headers()
+            return None
+
+        f = open(served_path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        byte_range = self._range(range_header, etag, size)
+        if byte_range == 'invalid':
+            f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.end_headers()
+            return None
+        if byte_range is not None:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if splitext(path)[1] in COMPRESSIBLE:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self._send_cache_headers(path, etag, stat.st_mtime)
+        self.end_headers()
+        f.seek(start)
+        self.remaining = end - start + 1
+        return f
+
+    def _send_cache_headers(self, path, etag, mtime):
+        if HASHED.search(path):
+            self.send_header('Cache-Control', 'public, max-age=%d, immutable' % self.immutable_max_age)
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(mtime))
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.getheader('If-None-Match')
+        if if_none_match is not None:
+            return etag in [value.strip() for value in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.getheader('If-Modified-Since')
+        if if_modified_since is not None:
+            date = parsedate_tz(if_modified_since)
+            return date is not None and int(mtime) <= mktime_tz(date)
+        return False
+
+    def _range(self, range_header, etag, size):
+        """
+        The (first byte, last byte) of the Range header, None to send all the
+        file or 'invalid' if the range is out of the file
+        """
+        if range_header is None:
+            return None
+        if_range = self.headers.getheader('If-Range')
+        if if_range is not None and if_range.strip() != etag:
+            return None
+        match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+        if not match or match.groups() == ('', ''):
+            # several ranges or a wrong header, all the file is sent
+            return None
+        first, last = match.groups()
+        if first == '':
+            # the last bytes of the file
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return 'invalid'
+        return start, end
+
+    def copyfile(self, source, outputfile):
+        # only the bytes of the range
+        while self.remaining > 0:
+            block = source.read(min(self.remaining, 1 << 16))
+            if not block:
+                break
+            outputfile.write(block)
+            self.remaining -= len(block)
+
+    def log_message(self, format, *args):
+        logging.debug("%s %s" % (self.address_string(), format % args))
+
+
+class StaticServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the frontend with compressed and cacheable files")
+    parser.add_argument('--root', default='public', help="directory served")
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--no-prepare', action='store_true', help="don't hash the frames and compress the files")
+    parser.add_argument('--prepare-only', action='store_true', help="hash the frames and compress the files, and exit")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)-8s %(message)s')
+    site = StaticSite(args.root)
+    if not args.no_prepare:
+        site.prepare()
+    if not args.prepare_only:
+        StaticHandler.root = args.root
+        StaticHandler.site = site
+        server = StaticServer((args.bind, args.port), StaticHandler)
+        logging.info("Serving %s in http://%s:%d/" % (args.root, args.bind, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
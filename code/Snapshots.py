@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+import json
+import heapq
+import logging
+import os
+import struct
+import tempfile
+
+
+class Snapshots(object):
+    """
+    Time series of stations stored as newline delimited json. Every line
+    of the data file is one snapshot with the form:
+    [timestamp, [station1, station2, ...]]
+
+    New snapshots are only appended at the end of the file, so they don't
+    need to arrive sorted. The order is given by a sorted index saved in
+    <data_file>.idx with (timestamp, offset) pairs packed as binary. When
+    the data file grows only the new lines are indexed and merged with the
+    old index, so the full data is never loaded in memory.
+
+    A last line without its end of line (a write that didn't finish) is not
+    indexed, and it is removed before the next snapshot is appended.
+    """
+    index_version = 1
+    header = struct.Struct('<qq')  # (index version, bytes of data indexed)
+    entry = struct.Struct('<qq')  # (timestamp, offset in the data file)
+    chunk_entries = 100000  # entries sorted in memory before merging runs
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.index_file = data_file + '.idx'
+        self._writer = None
+
+    def append(self, timestamp, stations):
+        if self._writer is None:
+            self._remove_partial_line()
+            self._writer = open(self.data_file, 'a')
+        self._writer.write(json.dumps([timestamp, stations]))
+        self._writer.write('\n')
+
+    def _complete_size(self):
+        """
+        Bytes of the data file until the end of its last complete line
+        """
+        with open(self.data_file, 'rb') as data:
+            data.seek(0, os.SEEK_END)
+            end = data.tell()
+            while end > 0:
+                start = max(end - 4096, 0)
+                data.seek(start)
+                block = data.read(end - start)
+                if '\n' in block:
+                    return start + block.rindex('\n') + 1
+                end = start
+        return 0
+
+    def _remove_partial_line(self):
+        if not os.path.isfile(self.data_file):
+            return
+        size = os.path.getsize(self.data_file)
+        complete_size = self._complete_size()
+        if complete_size < size:
+            logging.warning("Removing %d bytes of an incomplete line at the end of %s" % (
+                size - complete_size, self.data_file))
+            with open(self.data_file, 'r+b') as data:
+                data.truncate(complete_size)
+
+    def flush(self, sync=False):
+        """
+        Write the snapshots appended to the file, with sync they are in the
+        disk when it returns
+        """
+        if self._writer is not None:
+            self._writer.flush()
+            if sync:
+                os.fsync(self._writer.fileno())
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __iter__(self):
+        """
+        Yield (timestamp, stations) sorted by time, one at a time. If there
+        are repeated timestamps only the first one appended is returned.
+        """
+        return self.after(None)
+
+    def after(self, timestamp):
+        """
+        Like __iter__ but only the snapshots newer than timestamp. The first
+        one is found with a binary search in the index.
+        """
+        self.update_index()
+        start = self._find_entry(timestamp) if timestamp is not None else 0
+        previous_timestamp = None
+        with open(self.data_file, 'r') as data:
+            for entry_timestamp, offset in self._read_index(start):
+                if entry_timestamp == previous_timestamp:
+                    continue
+                previous_timestamp = entry_timestamp
+                data.seek(offset)
+                yield tuple(json.loads(data.readline()))
+
+    def timestamps(self):
+        self.update_index()
+        previous_timestamp = None
+        for timestamp, offset in self._read_index():
+            if timestamp != previous_timestamp:
+                previous_timestamp = timestamp
+                yield timestamp
+
+    def update_index(self):
+        """
+        Index the lines appended to the data file since the last update.
+        The common case is data appended in order, then the new entries are
+        just added to the end of the index. Otherwise the new entries are
+        sorted in chunks and merged with the old index (external merge sort).
+        """
+        self.close()
+        indexed_size = self._indexed_size()
+        data_size = os.path.getsize(self.data_file)
+        if indexed_size == data_size:
+            return
+        if indexed_size > data_size:
+            # the data file was rewritten, the old index is not valid
+            os.remove(self.index_file)
+            indexed_size = 0
+
+        logging.info("Indexing %s from byte %d" % (self.data_file, indexed_size))
+        last_timestamp = self._last_timestamp() if indexed_size else None
+        in_order = True
+        runs = []
+        chunk = []
+        with open(self.data_file, 'r') as data:
+            data.seek(indexed_size)
+            offset = indexed_size
+            for line in iter(data.readline, ''):
+                if not line.endswith('\n'):
+                    # the line is not complete yet, it is indexed when it is
+                    break
+                if line.strip():
+                    timestamp = self._line_timestamp(line)
+                    if last_timestamp is not None and timestamp < last_timestamp:
+                        in_order = False
+                    last_timestamp = timestamp
+                    chunk.append((timestamp, offset))
+                    if len(chunk) >= self.chunk_entries:
+                        runs.append(self._write_run(chunk))
+                        chunk = []
+                offset += len(line)
+
+        if in_order and not runs:
+            # the new entries are sorted after the old ones
+            mode = 'r+b' if indexed_size else 'wb'
+            with open(self.index_file, mode) as index:
+                if not indexed_size:
+                    index.write(self.header.pack(self.index_version, 0))
+                index.seek(0, os.SEEK_END)
+                for entry in chunk:
+                    index.write(self.entry.pack(*entry))
+                index.seek(0)
+                index.write(self.header.pack(self.index_version, offset))
+        else:
+            if chunk:
+                runs.append(self._write_run(chunk))
+            sources = [self._read_index()] + [self._read_entries(run) for run in runs]
+            index_tmp = self.index_file + '.tmp'
+            with open(index_tmp, 'wb') as index:
+                index.write(self.header.pack(self.index_version, offset))
+                # ties are sorted by offset so the first appended goes first
+                for entry in heapq.merge(*sources):
+                    index.write(self.entry.pack(*entry))
+            for run in runs:
+                os.remove(run)
+            os.rename(index_tmp, self.index_file)
+        logging.info("Index of %s updated" % self.data_file)
+
+    def _line_timestamp(self, line):
+        # lines are written as '[timestamp, [...]]' so we avoid to parse the
+        # whole line to know the time
+        try:
+            return int(line[1:line.index(',')])
+        except ValueError:
+            return int(json.loads(line)[0])
+
+    def _indexed_size(self):
+        try:
+            with open(self.index_file, 'rb') as index:
+                version, indexed_size = self.header.unpack(index.read(self.header.size))
+        except (IOError, struct.error):
+            return 0
+        if version != self.index_version:
+            logging.warning("Index version error, %s will be rebuilt" % self.index_file)
+            return 0
+        return indexed_size
+
+    def _last_timestamp(self):
+        try:
+            with open(self.index_file, 'rb') as index:
+                index.seek(0, os.SEEK_END)
+                if index.tell() <= self.header.size:
+                    return None
+                index.seek(-self.entry.size, os.SEEK_END)
+                return self.entry.unpack(index.read(self.entry.size))[0]
+        except IOError:
+            return None
+
+    def _read_index(self, start=0):
+        if self._indexed_size():
+            for entry in self._read_entries(self.index_file, self.header.size + start * self.entry.size):
+                yield entry
+
+    def _find_entry(self, timestamp):
+        """
+        Position in the index of the first entry newer than timestamp
+        """
+        if not self._indexed_size():
+            return 0
+        with open(self.index_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            low, high = 0, (f.tell() - self.header.size) // self.entry.size
+            while low < high:
+                middle = (low + high) // 2
+                f.seek(self.header.size + middle * self.entry.size)
+                if self.entry.unpack(f.read(self.entry.size))[0] <= timestamp:
+                    low = middle + 1
+                else:
+                    high = middle
+        return low
+
+    def _read_entries(self, file_path, start=0):
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            for packed in iter(lambda: f.read(self.entry.size), ''):
+                yield self.entry.unpack(packed)
+
+    def _write_run(self, chunk):
+        chunk.sort()
+        fd, run = tempfile.mkstemp(prefix='snapshots_run_', dir=os.path.dirname(self.index_file) or '.')
+        with os.fdopen(fd, 'wb') as f:
+            for entry in chunk:
+                f.write(self.entry.pack(*entry))
+        return run
+
+
+if __name__ == "__main__":
+    # convert the old data.json (a json list with all the snapshots) to the
+    # newline delimited format
+    import sys
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'data.json'
+    output_file = sys.argv[2] if len(sys.argv) > 2 else 'data.jsonl'
+
+    with open(input_file, 'r') as f:
+        time_series = json.load(f)
+
+    snapshots = Snapshots(output_file)
+    for timestamp, stations in time_series:
+        snapshots.append(timestamp, stations)
+    snapshots.update_index()
+    print "Created file %s with %d snapshots" % (output_file, len(time_series))
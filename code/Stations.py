@@ -1,73 +1,200 @@
 #!/usr/bin/env python
 
-import xml.etree.ElementTree as ET
+import json
+import time
+from multiprocessing import Pool
+from os import listdir
+from os.path import basename, isfile, join
+from Metrics import metrics
+from Snapshots import Snapshots
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 
 class Stations(object):
     def __init__(self, bicing_data_file):
-        xml_tree = ET.parse(bicing_data_file)
-        self.xml_root = xml_tree.getroot()
+        # The file is read with a streaming parser. Here we only advance
+        # until the updatetime is found, the stations are read in run()
+        self._events = ET.iterparse(bicing_data_file)
+        self.stations = []
 
         # getting the updatetime
-        self.time = int(self.xml_root.find('updatetime').text)
+        self.time = None
+        for event, element in self._events:
+            if element.tag == 'updatetime':
+                self.time = int(element.text)
+                break
+            elif element.tag == 'station':
+                self._add_station(element)
 
-        self.stations = []
+        if self.time is None:
+            raise ValueError("updatetime not found in %s" % bicing_data_file)
 
     def run(self):
-        for xml_stations in self.xml_root.findall('station'):
-            station = {}
-            station['id'] = int(xml_stations.find('id').text)
-            station['type'] = xml_stations.find('type').text
-            station['lat'] = float(xml_stations.find('lat').text)
-            station['long'] = float(xml_stations.find('long').text)
-            station['street'] = xml_stations.find('street').text
-            station['height'] = int(xml_stations.find('height').text)
-            try:
-                station['streetNumber'] = int(xml_stations.find('streetNumber').text)
-            except:
-                station['streetNumber'] = xml_stations.find('streetNumber').text
-            station['nearbyStationList'] = self._parse_string_list(xml_stations.find('nearbyStationList').text)
-            station['status'] = xml_stations.find('status').text
-            station['slots'] = int(xml_stations.find('slots').text)
-            station['bikes'] = int(xml_stations.find('bikes').text)
-            self.stations.append(station)
+        for event, element in self._events:
+            if element.tag == 'station':
+                self._add_station(element)
+
+    def _add_station(self, xml_station):
+        # we read all the fields of the station in one pass
+        fields = dict((child.tag, child.text) for child in xml_station)
+
+        station = {}
+        station['id'] = int(fields['id'])
+        station['type'] = fields['type']
+        station['lat'] = float(fields['lat'])
+        station['long'] = float(fields['long'])
+        station['street'] = fields['street']
+        station['height'] = int(fields['height'])
+        try:
+            station['streetNumber'] = int(fields['streetNumber'])
+        except:
+            station['streetNumber'] = fields['streetNumber']
+        station['nearbyStationList'] = self._parse_string_list(fields['nearbyStationList'])
+        station['status'] = fields['status']
+        station['slots'] = int(fields['slots'])
+        station['bikes'] = int(fields['bikes'])
+        self.stations.append(station)
+
+        # the element is not needed anymore
+        xml_station.clear()
 
     def _parse_string_list(self, string_list):
         num_list = [int(num_str) for num_str in string_list.split(',')]
         return num_list
 
 
-if __name__ == "__main__":
-    from os import listdir
-    from os.path import isfile, join
-    import json
-    output_file_data = 'data.json'
-
-    # this process build the data.json file only if don't exist
-    if not isfile(output_file_data):
-        data_dir = 'data_day'
-        i = 0
-        time_series = []
+def parse_file(file_path):
+    """
+    Parse one snapshot file. It is used by the workers of the process pool
+    so errors are returned instead of raised.
+    """
+    try:
+        stations = Stations(file_path)
+        stations.run()
+        return file_path, stations.time, stations.stations
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def parse_file_timed(file_path):
+    """
+    parse_file with the seconds it took, the workers return them so the
+    time of parsing is in the metrics of the main process
+    """
+    start = time.time()
+    return parse_file(file_path) + (time.time() - start, )
+
+
+class DatasetBuilder(object):
+    """
+    Build the dataset of snapshots from a directory of xml files. The names
+    of the files already ingested are saved in <output_file>.manifest so when
+    the builder runs again only the new files are parsed and appended. The
+    names are kept in memory and written after their snapshots are in the
+    disk, so a file in the manifest is always in the dataset.
+    """
+    report_every = 500  # files
+
+    def __init__(self, data_dir='data_day', output_file='data.jsonl', processes=None):
+        self.data_dir = data_dir
+        self.output_file = output_file
+        self.manifest_file = output_file + '.manifest'
+        self.processes = processes
+        self.snapshots = Snapshots(output_file)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file, 'r') as f:
+                return set(line.strip() for line in f if line.strip())
+        except IOError:
+            return set()
+
+    def _new_files(self):
+        ingested = self._read_manifest()
+        new_files = []
+        for f in sorted(listdir(self.data_dir)):
+            if f not in ingested and isfile(join(self.data_dir, f)):
+                new_files.append(join(self.data_dir, f))
+        return new_files
+
+    def _write_manifest(self, manifest, ingested):
+        # the data goes to disk before the manifest
+        self.snapshots.flush(sync=True)
+        manifest.write(''.join(name + '\n' for name in ingested))
+        manifest.flush()
+        del ingested[:]
+
+    def run(self):
+        new_files = self._new_files()
+        print "%d new files in %s" % (len(new_files), self.data_dir)
+        if not new_files:
+            return
+
         times = set()
-        for f in listdir(data_dir):
-            file_path = join(data_dir, f)
-            if isfile(file_path):
-                try:
-                    stations = Stations(file_path)
-                    if stations.time not in times:
-                        stations.run()
-                        time_series.append((stations.time, stations.stations))
-                        times.add(stations.time)
-                except:
-                    print "Error in file %s" % file_path
-                print "Checking file %d" % i
-                i += 1
-
-        print "Creating file %s" % output_file_data
+        if isfile(self.output_file):
+            times.update(self.snapshots.timestamps())
+
+        pool = Pool(self.processes)
+        start = time.time()
+        num_files = 0
+        num_appended = 0
+        ingested = []
         try:
-            with open(output_file_data, 'w') as f:
-                json.dump(time_series, f)
-        except:
-            print "The output file couldn't be build"
-    else:
-        print "The file %s already exist" % output_file_data
+            with open(self.manifest_file, 'a') as manifest:
+                for file_path, timestamp, result, seconds in pool.imap_unordered(parse_file_timed, new_files, 16):
+                    num_files += 1
+                    metrics.add_time('xml_parse', seconds)
+                    metrics.count('xml_files')
+                    if timestamp is None:
+                        # the file is not added to the manifest so it is
+                        # tried again in the next run
+                        print "Error in file %s: %s" % (file_path, result)
+                        metrics.count('xml_errors')
+                        continue
+
+                    if timestamp not in times:
+                        self.snapshots.append(timestamp, result)
+                        times.add(timestamp)
+                        num_appended += 1
+                    ingested.append(basename(file_path))
+
+                    if num_files % self.report_every == 0:
+                        self._write_manifest(manifest, ingested)
+                        elapsed = time.time() - start
+                        print "%d/%d files (%.1f files/s)" % (num_files, len(new_files), num_files / elapsed)
+                self._write_manifest(manifest, ingested)
+        finally:
+            pool.close()
+            pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        print "%d files parsed in %.1f s (%.1f files/s), %d new snapshots" % (
+            num_files, elapsed, num_files / elapsed, num_appended)
+
+        print "Updating index of file %s" % self.output_file
+        with metrics.timer('index'):
+            self.snapshots.update_index()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Append the new xml snapshots to the dataset")
+    parser.add_argument('--data-dir', default='data_day')
+    parser.add_argument('--output', default='data.jsonl')
+    parser.add_argument('--processes', type=int, default=None,
+                        help="number of parser processes (default: number of cpus)")
+    parser.add_argument('--metrics', default=None, help="json file where the timers and counters are saved")
+    args = parser.parse_args()
+
+    DatasetBuilder(args.data_dir, args.output, args.processes).run()
+    # xml_parse is the time of the workers, it can be more than the time
+    # elapsed with several processes
+    print metrics.summary()
+    if args.metrics:
+        with open(args.metrics, 'w') as f:
+            json.dump(metrics.as_dict(), f, indent=2)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+
+import numpy as np
+
+from Metrics import metrics
+from StationsStore import StationsStore
+
+
+# Result of comparing one snapshot with the previous state. All the fields
+# are arrays with dense indexes of stations
+StationsChanges = namedtuple('StationsChanges', ['new', 'departures', 'arrivals', 'changed', 'delta'])
+
+
+class StationsDiff(object):
+    """
+    Keep the last state of all the stations in arrays indexed by a dense
+    index and compare every new snapshot with it at once.
+
+    colors are saved as codes, the color of a code is colors_map[code]:
+    green = all ok, there are available bikes in the station
+    yellow = station not operational
+    blue = station not operational or with error (bikes = slots = 0)
+    red = empty station. Station with 0 bikes
+    magenta = at least one bike leave the station
+    cyan = at least one bike arrive to the station
+    """
+    colors_map = ('g', 'y', 'b', 'r', 'm', 'c')
+    GREEN, YELLOW, BLUE, RED, MAGENTA, CYAN = range(len(colors_map))
+
+    def __init__(self):
+        self.ids = []
+        self.index = {}
+        self.lat = np.zeros(0)
+        self.lon = np.zeros(0)
+        self.bikes = np.zeros(0, dtype=np.int64)
+        self.sizes = np.zeros(0)
+        self.colors = np.zeros(0, dtype=np.int8)
+        self.seen = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_stations(self, stations):
+        """
+        Give a dense index to new stations. The stations are objects with
+        at least the id, lat and long properties.
+        """
+        stations = [station for station in stations if station['id'] not in self.index]
+        if not stations:
+            return
+        for station in stations:
+            self.index[station['id']] = len(self.ids)
+            self.ids.append(station['id'])
+
+        num_new = len(stations)
+        self.lat = np.append(self.lat, [station['lat'] for station in stations])
+        self.lon = np.append(self.lon, [station['long'] for station in stations])
+        self.bikes = np.append(self.bikes, np.zeros(num_new, dtype=self.bikes.dtype))
+        self.sizes = np.append(self.sizes, np.zeros(num_new))
+        self.colors = np.append(self.colors, np.zeros(num_new, dtype=self.colors.dtype))
+        self.seen = np.append(self.seen, np.zeros(num_new, dtype=bool))
+
+    def iter_snapshots(self, data, after=None):
+        """
+        Compare every snapshot of data with the previous one and yield
+        (timestamp, StationsChanges). data is a StationsStore or an iterator
+        of (timestamp, stations) sorted by time. With after the snapshots
+        older than after or at after are skipped, they are already in the
+        state.
+        """
+        if isinstance(data, StationsStore):
+            self.add_stations(data.static)
+            columns = np.array([self.index[station_id] for station_id in data.ids], dtype=np.int64)
+            open_code = data.status_codes.index('OPN') if 'OPN' in data.status_codes else -1
+            for timestamp, bikes, slots, status in metrics.timed('ingest', data.rows(after)):
+                with metrics.timer('station_diff'):
+                    present = np.zeros(len(self), dtype=bool)
+                    present[columns] = status != StationsStore.missing_status
+                    changes = self.update(present, self._expand(bikes, columns), self._expand(slots, columns),
+                                          self._expand(status == open_code, columns))
+                yield timestamp, changes
+        else:
+            for timestamp, stations in metrics.timed('ingest', data):
+                if after is not None and timestamp <= after:
+                    continue
+                with metrics.timer('station_diff'):
+                    self.add_stations(stations)
+                    columns = [self.index[station['id']] for station in stations]
+                    present = np.zeros(len(self), dtype=bool)
+                    present[columns] = True
+                    bikes = self._expand([station['bikes'] for station in stations], columns)
+                    slots = self._expand([station['slots'] for station in stations], columns)
+                    is_open = self._expand([station['status'] == "OPN" for station in stations], columns)
+                    changes = self.update(present, bikes, slots, is_open)
+                yield timestamp, changes
+
+    def _expand(self, values, columns):
+        values = np.asarray(values)
+        expanded = np.zeros(len(self), dtype=values.dtype)
+        expanded[columns] = values
+        return expanded
+
+    def update(self, present, bikes, slots, is_open):
+        """
+        Update the state with the values of one snapshot. All the arguments
+        are arrays of len(self), the stations not present keep the
+        previous state.
+        """
+        bikes = bikes.astype(np.int64)
+        slots = slots.astype(np.int64)
+
+        # the first time a station is found its bikes don't change
+        new = present & ~self.seen
+        self.bikes[new] = bikes[new]
+        self.seen |= new
+
+        # node size start in 10 until 50
+        # if the station is not working the default size is 25
+        total = bikes + slots
+        has_slots = total != 0
+        sizes = np.empty(len(self))
+        sizes[has_slots] = (bikes[has_slots].astype(float) / total[has_slots]) * 40 + 10
+        sizes[~has_slots] = 25
+
+        colors = np.where(is_open, self.GREEN, self.YELLOW).astype(self.colors.dtype)
+        colors[has_slots & (bikes == 0)] = self.RED
+        # this usually happen when status is CLS
+        colors[~has_slots] = self.BLUE
+
+        # if the number of bikes is lower than before at least one bike is
+        # on road, if it is greater at least one bike arrive to the station
+        delta = bikes - self.bikes
+        departures = present & (delta < 0)
+        arrivals = present & (delta > 0)
+        colors[departures] = self.MAGENTA
+        colors[arrivals] = self.CYAN
+
+        changed = present & ((delta != 0) | (colors != self.colors) | (sizes != self.sizes))
+        changed |= new
+
+        self.bikes[present] = bikes[present]
+        self.sizes[present] = sizes[present]
+        self.colors[present] = colors[present]
+
+        return StationsChanges(np.flatnonzero(new), np.flatnonzero(departures),
+                               np.flatnonzero(arrivals), np.flatnonzero(changed), delta)
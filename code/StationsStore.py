@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import shutil
+from os.path import exists, join
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class StationsStore(object):
+    """
+    Columnar store of the snapshots. The static data of the stations
+    (street, lat, long, height, nearbyStationList, ...) is saved only once
+    in stations.json and every station gets a dense index. The values that
+    change in every snapshot are saved in (T, N) arrays memory-mapped from
+    disk, where T is the number of timestamps and N the number of stations:
+        timestamps.npy -> (T,) timestamps sorted
+        bikes.npy -> (T, N) number of bikes of every station
+        slots.npy -> (T, N) number of slots of every station
+        status.npy -> (T, N) code of the status. The code 0 means that the
+            station is not in the snapshot, the rest are the position in
+            status_codes
+    """
+    version = "1.0"
+    dynamic_fields = ('bikes', 'slots', 'status')
+    missing_status = 0
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(join(store_dir, 'stations.json'), 'r') as f:
+            metadata = json.load(f)
+        if metadata['version'] != self.version:
+            raise ValueError("Version error in store %s" % store_dir)
+
+        self.ids = metadata['ids']
+        self.static = metadata['static']
+        self.status_codes = metadata['status_codes']
+        self.index = dict((station_id, i) for i, station_id in enumerate(self.ids))
+
+        self.timestamps = np.load(join(store_dir, 'timestamps.npy'), mmap_mode='r')
+        self.bikes = np.load(join(store_dir, 'bikes.npy'), mmap_mode='r')
+        self.slots = np.load(join(store_dir, 'slots.npy'), mmap_mode='r')
+        self.status = np.load(join(store_dir, 'status.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def rows(self, after=None):
+        """
+        Yield (timestamp, bikes, slots, status) with one row of every array.
+        With after only the rows newer than after are returned.
+        """
+        start = int(np.searchsorted(self.timestamps, after, 'right')) if after is not None else 0
+        for t in xrange(start, len(self.timestamps)):
+            yield int(self.timestamps[t]), self.bikes[t], self.slots[t], self.status[t]
+
+    def __iter__(self):
+        """
+        Yield (timestamp, stations) with the same form of the snapshots
+        read by Stations, so the store can replace data.jsonl.
+        """
+        for timestamp, bikes, slots, status in self.rows():
+            present = np.flatnonzero(status != self.missing_status)
+            bikes = bikes[present].tolist()
+            slots = slots[present].tolist()
+            status = status[present].tolist()
+            stations = []
+            for j, i in enumerate(present.tolist()):
+                station = dict(self.static[i])
+                station['bikes'] = bikes[j]
+                station['slots'] = slots[j]
+                station['status'] = self.status_codes[status[j]]
+                stations.append(station)
+            yield timestamp, stations
+
+    @classmethod
+    def build(cls, snapshots, store_dir):
+        """
+        Build the store from an iterable of (timestamp, stations) sorted by
+        time, like Snapshots. It reads the snapshots twice: the first time
+        to know the stations and the second one to fill the arrays, so only
+        one snapshot is in memory at a time.
+
+        The store is written in a temporary directory that replaces store_dir
+        at the end, so a build that fails doesn't change the old store.
+        """
+        logging.info("Finding the stations of the store %s" % store_dir)
+        ids = []
+        static = {}
+        status_codes = [None]
+        num_timestamps = 0
+        for timestamp, stations in snapshots:
+            num_timestamps += 1
+            for station in stations:
+                if station['id'] not in static:
+                    ids.append(station['id'])
+                    static[station['id']] = dict((key, value) for key, value in station.iteritems()
+                                                 if key not in cls.dynamic_fields)
+                if station['status'] not in status_codes:
+                    status_codes.append(station['status'])
+
+        ids.sort()
+        index = dict((station_id, i) for i, station_id in enumerate(ids))
+        status_index = dict((status, code) for code, status in enumerate(status_codes))
+        shape = (num_timestamps, len(ids))
+
+        store_dir = store_dir.rstrip('/')
+        tmp_dir = store_dir + '.tmp'
+        if exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        logging.info("Filling the arrays of the store %s %s" % (store_dir, shape))
+        timestamps = open_memmap(join(tmp_dir, 'timestamps.npy'), mode='w+', dtype=np.int64, shape=shape[:1])
+        bikes = open_memmap(join(tmp_dir, 'bikes.npy'), mode='w+', dtype=np.int16, shape=shape)
+        slots = open_memmap(join(tmp_dir, 'slots.npy'), mode='w+', dtype=np.int16, shape=shape)
+        status = open_memmap(join(tmp_dir, 'status.npy'), mode='w+', dtype=np.int8, shape=shape)
+
+        t = -1
+        for t, (timestamp, stations) in enumerate(snapshots):
+            if t >= num_timestamps:
+                raise ValueError("The snapshots changed while building the store")
+            timestamps[t] = timestamp
+            for station in stations:
+                i = index[station['id']]
+                bikes[t, i] = station['bikes']
+                slots[t, i] = station['slots']
+                status[t, i] = status_index[station['status']]
+        if t + 1 != num_timestamps:
+            raise ValueError("The snapshots changed while building the store")
+
+        for array in (timestamps, bikes, slots, status):
+            array.flush()
+        del timestamps, bikes, slots, status
+
+        # the metadata is written at the end, a store without it is not valid
+        with open(join(tmp_dir, 'stations.json'), 'w') as f:
+            json.dump({
+                "version": cls.version,
+                "ids": ids,
+                "static": [static[station_id] for station_id in ids],
+                "status_codes": status_codes
+                }, f)
+
+        # a directory can't be renamed over another one with files, the old
+        # store is moved away first. The arrays mapped by the readers of the
+        # old store are still valid until they close them
+        old_dir = store_dir + '.old'
+        if exists(store_dir):
+            if exists(old_dir):
+                shutil.rmtree(old_dir)
+            os.rename(store_dir, old_dir)
+        os.rename(tmp_dir, store_dir)
+        if exists(old_dir):
+            shutil.rmtree(old_dir)
+
+        return cls(store_dir)
+
+
+if __name__ == "__main__":
+    # build the store from the newline delimited dataset
+    import sys
+    from Snapshots import Snapshots
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'data.jsonl'
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else 'data_store'
+
+    store = StationsStore.build(Snapshots(input_file), store_dir)
+    print "Created store %s with %d snapshots of %d stations" % (store_dir, len(store), len(store.ids))
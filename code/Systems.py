@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from multiprocessing import Pool
+from os.path import isdir, isfile, join
+
+import numpy as np
+
+from Metrics import metrics
+from Networks import StationsNetworks, state_files
+from Snapshots import Snapshots
+from StationsStore import StationsStore
+
+
+def bounding_box(lons, lats, margin=0.05, min_size=0.01):
+    """
+    Limits of the map (lon min, lon max, lat min, lat max) of the stations,
+    with a margin of the size of the box on every side
+    """
+    limits = []
+    for values in (lons, lats):
+        low, high = min(values), max(values)
+        pad = max(high - low, min_size) * margin
+        limits.extend([round(low - pad, 6), round(high + pad, 6)])
+    return tuple(limits)
+
+
+def read_snapshots(data_file, after=None):
+    """
+    The (timestamp, stations) of a dataset or a store newer than after
+    """
+    if isdir(data_file):
+        return ((timestamp, stations) for timestamp, stations in StationsStore(data_file)
+                if after is None or timestamp > after)
+    snapshots = Snapshots(data_file)
+    snapshots.update_index()
+    return snapshots.after(after)
+
+
+class SystemPlan(object):
+    """
+    The shards of a bike system, saved in <system_dir>/shards.json. The
+    stations are split in num_shards bands of the longitude or the latitude
+    (the longer side of the map) with the same number of stations, and
+    every shard has its own dataset with the stations of its band,
+    <system_dir>/shard_<k>/data.jsonl. With one shard the dataset of the
+    system is used as it is.
+
+    The coordinates of all the stations seen are kept, so when the dataset
+    grows only the new snapshots are read. The limits of the bands don't
+    change once they are found (the checkpoints of the shards depend on
+    them), the new stations go to the band of their coordinates. The map of
+    every shard is the bounding box of its stations.
+
+    The trips between two shards are lost, the bands should be big parts of
+    the system.
+    """
+    version = "1.0"
+
+    def __init__(self, system_dir, data_file, num_shards=1):
+        self.system_dir = system_dir
+        self.data_file = data_file
+        self.num_shards = num_shards
+        self.plan_file = join(system_dir, 'shards.json')
+        self.stations = {}  # id -> [lon, lat]
+        self.dimension = None  # 0 for longitude and 1 for latitude
+        self.limits = []  # coordinates where every band starts, from the second
+        self.timestamp = None  # last snapshot read
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self.plan_file, 'r') as f:
+                plan = json.load(f)
+        except (IOError, ValueError):
+            return
+        if plan['version'] != self.version or plan['shards'] != self.num_shards or plan['data'] != self.data_file:
+            logging.info("The shards of %s are not valid, they are made again" % self.system_dir)
+            return
+        self.stations = dict((int(station_id), coords) for station_id, coords in plan['stations'].iteritems())
+        self.dimension = plan['dimension']
+        self.limits = plan['limits']
+        self.timestamp = plan['timestamp']
+
+    def _save(self):
+        plan = {
+            'version': self.version,
+            'data': self.data_file,
+            'shards': self.num_shards,
+            'stations': self.stations,
+            'dimension': self.dimension,
+            'limits': self.limits,
+            'timestamp': self.timestamp
+            }
+        tmp_file = self.plan_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(plan, f)
+        os.rename(tmp_file, self.plan_file)
+
+    def shard_dir(self, k):
+        return join(self.system_dir, 'shard_%d' % k) if self.num_shards > 1 else self.system_dir
+
+    def shard_data(self, k):
+        return join(self.shard_dir(k), 'data.jsonl') if self.num_shards > 1 else self.data_file
+
+    def shard(self, station_id):
+        return bisect_right(self.limits, self.stations[station_id][self.dimension])
+
+    def _split(self, stations):
+        # the bands are found with the stations of the first snapshot
+        coords = np.array([(station['long'], station['lat']) for station in stations], dtype=float).reshape(-1, 2)
+        self.dimension = int(np.ptp(coords[:, 1]) > np.ptp(coords[:, 0])) if len(coords) else 0
+        quantiles = np.linspace(0, 100, self.num_shards + 1)[1:-1]
+        self.limits = np.percentile(coords[:, self.dimension], quantiles).tolist() if len(coords) else []
+
+    def update(self):
+        """
+        Read the snapshots newer than the last update, save the coordinates
+        of the new stations and, with several shards, append the stations of
+        every shard to its dataset. It returns the number of snapshots read.
+        """
+        if not isdir(self.system_dir):
+            os.makedirs(self.system_dir)
+        if self.timestamp is None:
+            # the shards are written from the start, and their checkpoints
+            # are of the stations of other bands
+            for k in xrange(self.num_shards):
+                files = state_files(self.shard_data(k), self.shard_dir(k))
+                if self.num_shards > 1:
+                    files += (self.shard_data(k), self.shard_data(k) + '.idx')
+                for file_path in files:
+                    if isfile(file_path):
+                        os.remove(file_path)
+
+        shards = []
+        if self.num_shards > 1:
+            for k in xrange(self.num_shards):
+                if not isdir(self.shard_dir(k)):
+                    os.makedirs(self.shard_dir(k))
+                shards.append(Snapshots(self.shard_data(k)))
+
+        num_snapshots = 0
+        for timestamp, stations in read_snapshots(self.data_file, self.timestamp):
+            if self.dimension is None:
+                self._split(stations)
+            for station in stations:
+                self.stations[station['id']] = [station['long'], station['lat']]
+            if shards:
+                shard_stations = [[] for shard in shards]
+                for station in stations:
+                    shard_stations[self.shard(station['id'])].append(station)
+                for shard, stations in zip(shards, shard_stations):
+                    shard.append(timestamp, stations)
+            self.timestamp = timestamp
+            num_snapshots += 1
+
+        # the datasets go to the disk before the plan
+        for shard in shards:
+            shard.close()
+            shard.update_index()
+        if num_snapshots:
+            self._save()
+        return num_snapshots
+
+    def axis(self, k):
+        """
+        The bounding box of the stations of the shard k
+        """
+        coords = [coords for station_id, coords in self.stations.iteritems()
+                  if self.num_shards == 1 or self.shard(station_id) == k]
+        if not coords:
+            return None
+        return bounding_box([lon for lon, lat in coords], [lat for lon, lat in coords])
+
+
+def plan_system(system):
+    """
+    Update the shards of a system and return the jobs of its shards
+    """
+    start = time.time()
+    plan = SystemPlan(system['dir'], system['data'], system.get('shards', 1))
+    num_snapshots = plan.update()
+    logging.info("%s: %d new snapshots split in %d shards in %.1f s" % (
+        system['name'], num_snapshots, plan.num_shards, time.time() - start))
+
+    jobs = []
+    for k in xrange(plan.num_shards):
+        axis = plan.axis(k)
+        if axis is None:
+            logging.error("%s: shard %d has no stations" % (system['name'], k))
+            continue
+        jobs.append({
+            'name': system['name'] if plan.num_shards == 1 else '%s/%d' % (system['name'], k),
+            'data': plan.shard_data(k),
+            'output_dir': plan.shard_dir(k),
+            # the walking cache and the checkpoint of every shard are in
+            # its directory, also with one shard that reads the data of the
+            # system
+            'cache_file': join(plan.shard_dir(k), 'walking_cache.db'),
+            'state_dir': plan.shard_dir(k),
+            'axis': axis,
+            'outputs': system.get('outputs', ['png']),
+            'windows': system.get('windows'),
+            'resume': system.get('resume', True)
+            })
+    return jobs
+
+
+def run_shard(job):
+    """
+    Build and draw the network of a shard. It returns the summary of the
+    shard, {name, snapshots, seconds, error}.
+    """
+    start = time.time()
+    # the metrics of the process are shared by the shards that it runs
+    first_snapshot = metrics.counters['snapshots']
+    try:
+        # the frames are drawn in the process of the shard, the processes
+        # of the pool can't have their own pools
+        StationsNetworks(job['data'], job['windows'], 1, job['resume'], job['outputs'],
+                         job['output_dir'], job['axis'], job['cache_file'], job['state_dir'])
+        error = None
+    except Exception as e:
+        logging.exception("Error in %s" % job['name'])
+        error = str(e)
+    num_snapshots = metrics.counters['snapshots'] - first_snapshot
+    return {'name': job['name'], 'snapshots': num_snapshots, 'seconds': time.time() - start, 'error': error}
+
+
+class SystemsRunner(object):
+    """
+    Draw the networks of several bike systems, or of the shards of a big
+    system, in a pool of processes, one system or shard in every process.
+    The systems are read from a json config:
+
+    {"output_dir": "public/systems",
+     "systems": [{"name": "bicing", "data": "data.jsonl", "shards": 4,
+                  "outputs": ["png", "feed"], "windows": [1, 5, 15]},
+                 ...]}
+
+    Only name and data are needed. Every system writes in
+    <output_dir>/<name> (or <output_dir>/<name>/shard_<k>) its images,
+    feed, analytics, walking cache and checkpoint, so the processes don't
+    share files. Every shard is drawn in one process.
+    """
+    def __init__(self, config, processes=None):
+        self.output_dir = config.get('output_dir', join('public', 'systems'))
+        self.systems = config['systems']
+        for system in self.systems:
+            system['dir'] = join(self.output_dir, system['name'])
+        self.processes = processes or config.get('processes')
+
+    def run(self):
+        """
+        Run all the shards and return their summaries
+        """
+        start = time.time()
+        pool = Pool(self.processes)
+        try:
+            jobs = [job for system_jobs in pool.imap(plan_system, self.systems) for job in system_jobs]
+            logging.info("%d shards of %d systems" % (len(jobs), len(self.systems)))
+            # the biggest datasets first, so the last processes don't run alone
+            jobs.sort(key=lambda job: -os.path.getsize(job['data']) if isfile(job['data']) else 0)
+            summaries = list(pool.imap_unordered(run_shard, jobs))
+        finally:
+            pool.close()
+            pool.join()
+        self.elapsed = time.time() - start
+        return sorted(summaries, key=lambda summary: summary['name'])
+
+    def report(self, summaries):
+        lines = ["%-24s %10s %10s %12s" % ('shard', 'snapshots', 'seconds', 'snapshots/s')]
+        for summary in summaries:
+            if summary['error']:
+                lines.append("%-24s error: %s" % (summary['name'], summary['error']))
+            else:
+                lines.append("%-24s %10d %10.1f %12.1f" % (summary['name'], summary['snapshots'], summary['seconds'],
+                                                          summary['snapshots'] / max(summary['seconds'], 1e-6)))
+        total = sum(summary['snapshots'] for summary in summaries)
+        lines.append("%d snapshots in %.1f s (%.1f snapshots/s)" % (total, self.elapsed,
+                                                                     total / max(self.elapsed, 1e-6)))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Draw the networks of several bike systems in parallel")
+    parser.add_argument('config', help="json file with the systems")
+    parser.add_argument('--processes', type=int, default=None, help="processes (default: number of cpus)")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    logging.getLogger('').setLevel(args.log_level)
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    runner = SystemsRunner(config, args.processes)
+    summaries = runner.run()
+    print runner.report(summaries)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from os.path import dirname, isdir
+
+
+class TimeSeries(object):
+    """
+    A newline delimited json file with a header line and then a line for
+    every timestamp, {"t": timestamp, ...}, written while the graph is
+    built. When the drawing is resumed the lines newer than the checkpoint
+    are removed with discard_after and the new lines are appended. If the
+    header of the file is different the file is written from the start.
+
+    The timestamp is written first in the lines, so discard_after reads it
+    without parsing the whole line.
+    """
+    def __init__(self, series_file, header):
+        self.series_file = series_file
+        # as it is read from the file, to compare them
+        self.header = json.loads(json.dumps(header))
+        self.num_lines = 0  # lines after the header
+        self.f = None
+
+    def discard_after(self, timestamp):
+        """
+        Remove the lines newer than timestamp, they are written again.
+        With None, or if the file is not valid, it is written from the start.
+        """
+        size = 0
+        self.num_lines = 0
+        try:
+            with open(self.series_file, 'rb') as f:
+                header = f.readline()
+                if timestamp is not None and header.endswith('\n') and json.loads(header) == self.header:
+                    size = len(header)
+                    for line in f:
+                        if not line.endswith('\n') or self._line_timestamp(line) > timestamp:
+                            break
+                        size += len(line)
+                        self.num_lines += 1
+        except (IOError, ValueError):
+            pass
+
+        directory = dirname(self.series_file)
+        if directory and not isdir(directory):
+            os.makedirs(directory)
+        if size:
+            self.f = open(self.series_file, 'r+b')
+            self.f.truncate(size)
+            self.f.seek(size)
+        else:
+            logging.info("Writing %s from the start" % self.series_file)
+            self.f = open(self.series_file, 'wb')
+            self._write(self.header)
+
+    def _line_timestamp(self, line):
+        # lines are written as '{"t":timestamp,...}', the files written before
+        # can have the timestamp in other place
+        if line.startswith('{"t":'):
+            end = line.find(',')
+            if end < 0:
+                end = line.rindex('}')
+            try:
+                return json.loads(line[5:end])
+            except ValueError:
+                pass
+        return json.loads(line)['t']
+
+    def _write(self, line):
+        self.f.write(json.dumps(line, separators=(',', ':')))
+        self.f.write('\n')
+
+    def write(self, line):
+        if self.f is None:
+            self.discard_after(None)
+        self._write(OrderedDict([('t', line['t'])] + [(key, value) for key, value in line.iteritems() if key != 't']))
+        self.num_lines += 1
+
+    def save(self):
+        # the lines are written to the disk at the checkpoints
+        if self.f is not None:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sqlite3
+
+# The keys of the cache are the coordinates of the origin and the destination
+# quantized to integers, (lat, lon, lat, lon) * 10^6 (see
+# WalkingTimes._cache_key), and the values are the pairs
+# (distance in meters, duration in seconds). The pairs without a route in the
+# google api are saved as NO_ROUTE.
+NO_ROUTE = (None, None)
+
+
+def key_from_string(key):
+    """
+    Convert a key of the version 1.0, '%f,%f_%f,%f', to a quantized key
+    """
+    return tuple(int(round(float(coord) * 1e6)) for coord in key.replace('_', ',').split(','))
+
+
+def value_from_element(element):
+    """
+    Convert a value of the version 1.0, the element of the google api, to
+    (distance, duration)
+    """
+    try:
+        return element["distance"]["value"], element["duration"]["value"]
+    except (KeyError, TypeError):
+        return NO_ROUTE
+
+
+class JsonCache(object):
+    """
+    The walking cache saved as a single json file with the form:
+    {"version": "2.0", "data": [[lat, lon, lat, lon, distance, duration], ...]}
+    All the data is loaded in memory and the whole file is written in
+    every flush. The files of the version 1.0, {key: element}, are converted
+    when they are read.
+    """
+    version = "2.0"
+
+    def __init__(self, cache_file='walking_cache.json'):
+        self.cache_file = cache_file
+        self.data = {}
+        self.modified = False
+
+        # try to open a file with the cache
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache_data = json.load(f)
+
+                # the data should be validated
+                try:
+                    if self.version == cache_data['version']:
+                        self.data = dict((tuple(row[:4]), tuple(row[4:])) for row in cache_data['data'])
+                    elif cache_data['version'] == "1.0":
+                        self.data = dict((key_from_string(key), value_from_element(element))
+                                         for key, element in cache_data['data'].iteritems())
+                        self.modified = True
+                    else:
+                        print "Version error load"
+                except:
+                    print "Invalid cache file"
+        except:
+            print "Cache not found"
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.data[key] = tuple(value)
+        self.modified = True
+
+    def __len__(self):
+        return len(self.data)
+
+    def iteritems(self):
+        return self.data.iteritems()
+
+    def flush(self):
+        if not self.modified:
+            return
+        print "saving cache"
+        try:
+            # the file is replaced at once so it is never half written
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({
+                    "version": self.version,
+                    "data": [key + value for key, value in self.data.iteritems()]
+                    }, f, separators=(',', ':'))
+            os.rename(tmp_file, self.cache_file)
+            self.modified = False
+        except:
+            print "It was imposible to save cache"
+
+    def close(self):
+        self.flush()
+
+
+class SqliteCache(object):
+    """
+    The walking cache saved in a sqlite database. Only the queried keys are
+    read, every insert is O(1) and they are committed in transactions of
+    commit_every inserts, so the cost doesn't depend on the size of the
+    cache. The database uses WAL mode, several processes can read it while
+    another one writes.
+
+    If the database is empty the old json cache is migrated. By default it
+    is the json file with the same name, walking_cache.json for
+    walking_cache.db. The databases of the version 1.0, with text keys and
+    json elements, are converted when they are opened.
+    """
+    version = "2.0"
+
+    def __init__(self, cache_file='walking_cache.db', json_file=None, commit_every=50):
+        self.cache_file = cache_file
+        self.commit_every = commit_every
+        self.pending = 0
+
+        self.connection = sqlite3.connect(cache_file, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("INSERT OR IGNORE INTO metadata VALUES ('version', ?)", (self.version, ))
+
+        version = self.connection.execute("SELECT value FROM metadata WHERE name = 'version'").fetchone()[0]
+        if version == "1.0":
+            self._migrate_v1()
+        elif version != self.version:
+            raise ValueError("Version error in cache %s" % cache_file)
+        self._create_table()
+
+        if json_file is None:
+            json_file = os.path.splitext(cache_file)[0] + '.json'
+        is_empty = self.connection.execute("SELECT 1 FROM walking LIMIT 1").fetchone() is None
+        if json_file and is_empty and os.path.isfile(json_file):
+            self.migrate_json(json_file)
+
+    def _create_table(self):
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS walking ("
+                                    "olat INTEGER, olon INTEGER, dlat INTEGER, dlon INTEGER, "
+                                    "distance INTEGER, duration INTEGER, "
+                                    "PRIMARY KEY (olat, olon, dlat, dlon)) WITHOUT ROWID")
+
+    def _migrate_v1(self):
+        print "Converting %s to the version %s" % (self.cache_file, self.version)
+        with self.connection:
+            self.connection.execute("ALTER TABLE walking RENAME TO walking_v1")
+        self._create_table()
+        with self.connection:
+            rows = self.connection.execute("SELECT key, value FROM walking_v1").fetchall()
+            self.connection.executemany("INSERT OR REPLACE INTO walking VALUES (?, ?, ?, ?, ?, ?)",
+                                        (key_from_string(key) + value_from_element(json.loads(value))
+                                         for key, value in rows))
+            self.connection.execute("DROP TABLE walking_v1")
+            self.connection.execute("UPDATE metadata SET value = ? WHERE name = 'version'", (self.version, ))
+
+    def migrate_json(self, json_file):
+        json_cache = JsonCache(json_file)
+        print "Migrating %d results from %s to %s" % (len(json_cache), json_file, self.cache_file)
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO walking VALUES (?, ?, ?, ?, ?, ?)",
+                                        (key + value for key, value in json_cache.iteritems()))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        row = self.connection.execute("SELECT distance, duration FROM walking "
+                                      "WHERE olat = ? AND olon = ? AND dlat = ? AND dlon = ?", key).fetchone()
+        if row is None:
+            return default
+        return row
+
+    def __setitem__(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO walking VALUES (?, ?, ?, ?, ?, ?)", key + tuple(value))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM walking").fetchone()[0]
+
+    def iteritems(self):
+        for row in self.connection.execute("SELECT * FROM walking"):
+            yield row[:4], row[4:]
+
+    def flush(self):
+        if self.pending:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def open_cache(backend='sqlite', cache_file=None):
+    if backend == 'json':
+        return JsonCache(cache_file or 'walking_cache.json')
+    elif backend == 'sqlite':
+        return SqliteCache(cache_file or 'walking_cache.db')
+    raise ValueError("Unknown cache backend %s" % backend)
+
+
+if __name__ == "__main__":
+    # migrate the json cache to sqlite
+    import sys
+    json_file = sys.argv[1] if len(sys.argv) > 1 else 'walking_cache.json'
+    cache_file = sys.argv[2] if len(sys.argv) > 2 else 'walking_cache.db'
+    cache = SqliteCache(cache_file, json_file='')
+    cache.migrate_json(json_file)
+    print "%s has %d results" % (cache_file, len(cache))
+    cache.close()
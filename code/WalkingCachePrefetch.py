@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import logging
+import random
+import threading
+import time
+from Queue import Queue
+from requests.exceptions import ConnectionError
+
+from WalkingTimes import OverQueryLimit
+
+
+class TokenBucket(object):
+    """
+    Rate limiter shared by threads. The bucket is filled with rate tokens
+    per second up to capacity, and consume blocks until there are enough.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WalkingCachePrefetch(object):
+    """
+    Fill the walking cache with all the pairs of a set of stations. The
+    pairs are requested in batches (see WalkingTimes._google_batches) by
+    several threads at the same time, with a token bucket of elements per
+    second tuned to the quota of the api. When the api answers
+    OVER_QUERY_LIMIT all the threads wait with exponential backoff and the
+    batch is tried again, WalkingTimes.use_google_api is not changed.
+    The cache is saved every checkpoint_every batches, so the progress is
+    not lost if the process is stopped.
+    """
+    def __init__(self, wtime, concurrency=8, rate=100, checkpoint_every=20,
+                 max_retries=8, backoff=1.0, max_backoff=64.0):
+        self.wtime = wtime
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, max(rate, wtime.max_elements))
+        self.checkpoint_every = checkpoint_every
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._pause_until = 0
+        self._pause_lock = threading.Lock()
+
+    def missing_pairs(self, stations, all_pairs=False):
+        """
+        stations is a list of coordinates {'lat': , 'lon': } in the order the
+        stations are found in the data. BikeDurations only needs the duration
+        from every station to the stations found before it, all_pairs gets
+        both directions. With wtime.symmetric a pair is not requested if the
+        other direction is in the cache or it is going to be requested.
+        """
+        pairs = []
+        scheduled = set()
+        for i, origin in enumerate(stations):
+            for j, destination in enumerate(stations):
+                if i == j or (j > i and not all_pairs):
+                    continue
+                key_cache = self.wtime._cache_key(origin, destination)
+                if self.wtime.symmetric:
+                    reverse_key = key_cache[2:] + key_cache[:2]
+                    if reverse_key in scheduled or reverse_key in self.wtime.cache_data:
+                        continue
+                if key_cache not in self.wtime.cache_data:
+                    pairs.append((origin, destination))
+                    scheduled.add(key_cache)
+        return pairs
+
+    def _wait_pause(self):
+        with self._pause_lock:
+            wait = self._pause_until - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _pause(self, attempt):
+        # exponential backoff with jitter, shared by all the threads
+        wait = min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+        with self._pause_lock:
+            self._pause_until = max(self._pause_until, time.time() + wait)
+        return wait
+
+    def _worker(self, batches, results):
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            origins, destinations, attempt = item
+            self._wait_pause()
+            self.bucket.consume(len(origins) * len(destinations))
+            try:
+                results.put((True, self.wtime._google_distancematrix_api_many(origins, destinations)))
+            except (OverQueryLimit, ConnectionError) as e:
+                if attempt >= self.max_retries:
+                    results.put((False, "%s after %d retries" % (e.__class__.__name__, attempt)))
+                else:
+                    wait = self._pause(attempt)
+                    logging.warning("%s, waiting %.1f s" % (e.__class__.__name__, wait))
+                    batches.put((origins, destinations, attempt + 1))
+            except Exception as e:
+                results.put((False, repr(e)))
+
+    def run(self, stations, all_pairs=False):
+        pairs = self.missing_pairs(stations, all_pairs)
+        batches = self.wtime._google_batches(pairs)
+        print "%d missing pairs in %d requests" % (len(pairs), len(batches))
+        if not batches:
+            return 0
+
+        batches_queue = Queue()
+        results = Queue()
+        for origins, destinations in batches:
+            batches_queue.put((origins, destinations, 0))
+
+        threads = []
+        for i in xrange(self.concurrency):
+            thread = threading.Thread(target=self._worker, args=(batches_queue, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # the cache is only modified from this thread
+        start = time.time()
+        num_elements = 0
+        num_errors = 0
+        try:
+            for done in xrange(1, len(batches) + 1):
+                ok, batch_results = results.get()
+                if ok:
+                    for key_cache, result in batch_results.iteritems():
+                        self.wtime.cache_data[key_cache] = result
+                    num_elements += len(batch_results)
+                    self.wtime.update_cache = True
+                else:
+                    num_errors += 1
+                    logging.error("Batch failed: %s" % batch_results)
+
+                if done % self.checkpoint_every == 0:
+                    self.wtime.save_cache()
+                    elapsed = time.time() - start
+                    print "%d/%d requests, %d elements (%.1f elements/s)" % (
+                        done, len(batches), num_elements, num_elements / elapsed)
+        finally:
+            for thread in threads:
+                batches_queue.put(None)
+            self.wtime.save_cache()
+
+        elapsed = max(time.time() - start, 1e-6)
+        print "%d elements in %.1f s (%.1f elements/s), %d failed requests" % (
+            num_elements, elapsed, num_elements / elapsed, num_errors)
+        return num_errors
+
+
+def read_stations(data_file):
+    """
+    Coordinates of the stations in the order they are found in the data,
+    the same order used by StationsDiff and BikeDurations.
+    """
+    from os.path import isdir
+    from Snapshots import Snapshots
+    from StationsStore import StationsStore
+
+    if isdir(data_file):
+        return [{'lat': station['lat'], 'lon': station['long']} for station in StationsStore(data_file).static]
+
+    stations = []
+    ids = set()
+    for timestamp, snapshot_stations in Snapshots(data_file):
+        for station in snapshot_stations:
+            if station['id'] not in ids:
+                ids.add(station['id'])
+                stations.append({'lat': station['lat'], 'lon': station['long']})
+    return stations
+
+
+if __name__ == "__main__":
+    import argparse
+    from WalkingTimes import WalkingTimes
+
+    parser = argparse.ArgumentParser(description="Fetch the missing pairs of stations of the walking cache")
+    parser.add_argument('--data', default='data.jsonl', help="dataset file or store directory")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=100, help="elements per second")
+    parser.add_argument('--all-pairs', action='store_true', help="fetch both directions of every pair")
+    parser.add_argument('--symmetric', action='store_true',
+                        help="use one direction of every pair for the other one")
+    parser.add_argument('--api-url', default=None)
+    args = parser.parse_args()
+
+    wtime = WalkingTimes(api_url=args.api_url, symmetric=args.symmetric)
+    prefetch = WalkingCachePrefetch(wtime, args.concurrency, args.rate)
+    prefetch.run(read_stations(args.data), args.all_pairs)
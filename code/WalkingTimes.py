@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
-import json
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
 import os
+from itertools import groupby
+import numpy as np
 from geopy.distance import vincenty
+from Metrics import metrics
+from WalkingCache import NO_ROUTE, open_cache
 
 
 class OverQueryLimit(Exception):
@@ -15,13 +19,102 @@ class OverQueryLimit(Exception):
         return repr(self.value)
 
 
+def vincenty_km(lat1, lon1, lat2, lon2, iterations=20, tolerance=10e-12):
+    """
+    Vectorized inverse Vincenty formula over the WGS-84 ellipsoid, the same
+    that is used by geopy.distance.vincenty. The coordinates are arrays in
+    degrees and the distances are returned in km.
+    """
+    major, minor, f = 6378.137, 6356.7523142, 1 / 298.257223563
+
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(coord, dtype=float)) for coord in (lat1, lon1, lat2, lon2)]
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(lat1, lon1, lat2, lon2)
+    # the coordinates are flattened, so single coordinates are arrays too
+    result_shape = lat1.shape
+    lat1, lon1, lat2, lon2 = [coord.ravel() for coord in (lat1, lon1, lat2, lon2)]
+    delta_lon = lon2 - lon1
+
+    reduced_lat1 = np.arctan((1 - f) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+
+    lambda_lon = delta_lon.copy()
+    shape = delta_lon.shape
+    sin_sigma = np.zeros(shape)
+    cos_sigma = np.zeros(shape)
+    sigma = np.zeros(shape)
+    cos_sq_alpha = np.zeros(shape)
+    cos2_sigma_m = np.zeros(shape)
+    # only the pairs that didn't converge are updated in every iteration
+    pending = np.ones(shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in xrange(iterations + 1):
+            if not pending.any():
+                break
+            sin_lambda, cos_lambda = np.sin(lambda_lon[pending]), np.cos(lambda_lon[pending])
+            s1, c1, s2, c2 = sin_reduced1[pending], cos_reduced1[pending], sin_reduced2[pending], cos_reduced2[pending]
+            sin_s = np.sqrt((c2 * sin_lambda) ** 2 + (c1 * s2 - s1 * c2 * cos_lambda) ** 2)
+            cos_s = s1 * s2 + c1 * c2 * cos_lambda
+            sig = np.arctan2(sin_s, cos_s)
+            sin_alpha = np.where(sin_s == 0, 0, c1 * c2 * sin_lambda / sin_s)
+            cos_sq = 1 - sin_alpha ** 2
+            # cos_sq = 0 is the equatorial line
+            cos2_sm = np.where(cos_sq == 0, 0, cos_s - 2 * (s1 * s2 / cos_sq))
+            C = f / 16. * cos_sq * (4 + f * (4 - 3 * cos_sq))
+            lambda_prime = lambda_lon[pending]
+            new_lambda = delta_lon[pending] + (1 - C) * f * sin_alpha * (
+                sig + C * sin_s * (cos2_sm + C * cos_s * (-1 + 2 * cos2_sm ** 2)))
+
+            sin_sigma[pending] = sin_s
+            cos_sigma[pending] = cos_s
+            sigma[pending] = sig
+            cos_sq_alpha[pending] = cos_sq
+            cos2_sigma_m[pending] = cos2_sm
+            lambda_lon[pending] = new_lambda
+            converged = (np.abs(new_lambda - lambda_prime) <= tolerance) | (sin_s == 0)
+            pending[np.flatnonzero(pending)[converged]] = False
+
+    if pending.any():
+        raise ValueError("Vincenty formula failed to converge!")
+
+    u_sq = cos_sq_alpha * (major ** 2 - minor ** 2) / minor ** 2
+    A = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos2_sigma_m + B / 4. * (
+        cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) -
+        B / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos2_sigma_m ** 2)))
+    distances = minor * A * (sigma - delta_sigma)
+    # coincident points
+    distances[sin_sigma == 0] = 0
+    return distances.reshape(result_shape)
+
+
 class WalkingTimes(object):
-    def __init__(self, use_cache=True, use_google_api=True):
+    def __init__(self, use_cache=True, use_google_api=True, api_url=None, cache_backend='sqlite', cache_file=None,
+                 symmetric=False, symmetric_factor=1.0):
         self.use_cache = use_cache
         self.use_google_api = use_google_api
+        # with symmetric the value of A->B is used for B->A when only one of
+        # the directions is in the cache, multiplied by symmetric_factor
+        self.symmetric = symmetric
+        self.symmetric_factor = symmetric_factor
         self.count_not_cache = 0
         self.max_count_not_cache = 50  # save cache every 50 queries
-        self.google_distancematrix_api_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+        # the url can be changed to use a local server with the same api
+        self.google_distancematrix_api_url = api_url or os.environ.get(
+            'DISTANCEMATRIX_API_URL', "https://maps.googleapis.com/maps/api/distancematrix/json")
+        # limits of elements (origins x destinations) and of origins or
+        # destinations in one request to the api
+        self.max_elements = 100
+        self.max_locations = 25
+
+        # the connections are reused between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         try:
             self.google_api_key = os.environ['GOOGLE_API_KEY']
@@ -33,42 +126,25 @@ class WalkingTimes(object):
         self.bike_scale_factor = 2.13
         self.bike_ci_percentage = 0.2
 
+        # we have to add a factor to compensate curves in the way.
+        # TODO improve the factor using the google results as test set
+        self.detour_factor = 1.22
+        # acording wikipedia: average human walking speed is about 5.0 kilometres per hour
+        # https://en.wikipedia.org/?title=Walking
+        self.average_walking_speed = 5
+
         if use_cache:
-            self.version = "1.0"
             self.update_cache = False
-            self.cache_file = 'walking_cache.json'
-            self.cache_data = {}
-
-            # try to open a file with the cache
-            try:
-                with open(self.cache_file, 'r') as f:
-                    cache_data = json.load(f)
-
-                    # the data should be validated
-                    try:
-                        if self.version == cache_data['version']:
-                            self.cache_data = cache_data['data']
-                        else:
-                            print "Version error load"
-                    except:
-                        print "Invalid cache file"
-            except:
-                print "Cache not found"
+            # the cache can be saved in a sqlite database ('sqlite') or in
+            # the old json file ('json')
+            self.cache_data = open_cache(cache_backend, cache_file)
 
     def __del__(self):
         self.save_cache()
 
     def save_cache(self):
         if self.use_cache and self.update_cache:
-            print "saving cache"
-            try:
-                with open(self.cache_file, 'w') as f:
-                    json.dump({
-                        "version": self.version,
-                        "data": self.cache_data
-                        }, f)
-            except:
-                print "It was imposible to save cache"
+            self.cache_data.flush()
 
     def calculate(self, origin, destination):
         """
@@ -78,15 +154,12 @@ class WalkingTimes(object):
         algorithm if it is not possible.
         https://developers.google.com/maps/documentation/distancematrix/?hl=es
         """
-        origin_str = self._coord_to_string(origin)
-        destination_str = self._coord_to_string(destination)
-        key_cache = "%s_%s" % (origin_str, destination_str)
-        result = {'result': None}
+        key_cache = self._cache_key(origin, destination)
 
         if self.use_cache:
-            if key_cache in self.cache_data:
-                result = {'result': self.cache_data[key_cache]}
-            else:
+            cached = self._get_cached(key_cache)
+            if cached is None:
+                metrics.count('walking_cache_misses')
                 try:
                     result = self._get_distance(origin, destination)
                 except:
@@ -97,20 +170,100 @@ class WalkingTimes(object):
                     raise
 
                 # we save in cache only the google results
-                if result and result['from_google']:
-                    self.count_not_cache += 1
-                    self.cache_data[key_cache] = result['result']
+                if result['from_google']:
+                    self._add_to_cache(key_cache, result['result'])
+                cached = result['result']
+            else:
+                metrics.count('walking_cache_hits')
+        else:
+            cached = self._get_distance(origin, destination)['result']
+        return self._to_result(cached)
 
-                    # save cache when max_count_not_cache is exceeded
-                    if self.count_not_cache > self.max_count_not_cache:
-                        self.save_cache()
-                        self.count_not_cache = 0
-                        self.update_cache = False
-                    else:
-                        self.update_cache = True
+    def _to_result(self, value):
+        """
+        Convert a (distance in meters, duration in seconds) pair to the form
+        of the google results. The pairs without route are an empty result.
+        """
+        distance, duration = value
+        if distance is None:
+            return {}
+        return {
+            "distance": {"value": distance},
+            "duration": {"value": duration}
+            }
+
+    def _get_cached(self, key_cache):
+        cached = self.cache_data.get(key_cache)
+        if cached is None and self.symmetric:
+            # we use the other direction of the pair if it was requested
+            cached = self.cache_data.get(key_cache[2:] + key_cache[:2])
+            if cached is not None and cached[0] is not None:
+                cached = (cached[0] * self.symmetric_factor, cached[1] * self.symmetric_factor)
+        return cached
+
+    def _add_to_cache(self, key_cache, result):
+        self.count_not_cache += 1
+        self.cache_data[key_cache] = result
+
+        # save cache when max_count_not_cache is exceeded
+        if self.count_not_cache > self.max_count_not_cache:
+            self.save_cache()
+            self.count_not_cache = 0
+            self.update_cache = False
         else:
-            result = self._get_distance(origin, destination)
-        return result['result']
+            self.update_cache = True
+
+    def calculate_many(self, pairs):
+        """
+        Batch version of calculate for a list of (origin, destination).
+        """
+        values, missing = self._calculate_many(pairs)
+        for k in missing:
+            values[k] = self._get_distance_vincenty(*pairs[k])
+        return [self._to_result(value) for value in values]
+
+    def _calculate_many(self, pairs):
+        """
+        Find the (distance, duration) of the pairs in the cache or in the
+        google api. The pairs that are not in the cache are requested in
+        batches of up to max_elements. It returns the list of values and the
+        indexes of the pairs without value, they should be calculated with
+        vincenty.
+        """
+        values = [None] * len(pairs)
+        missing = []
+        keys = [self._cache_key(origin, destination) for origin, destination in pairs]
+        for k, key_cache in enumerate(keys):
+            cached = self._get_cached(key_cache) if self.use_cache else None
+            if cached is not None:
+                values[k] = cached
+            else:
+                missing.append(k)
+        if self.use_cache:
+            metrics.count('walking_cache_hits', len(pairs) - len(missing))
+            metrics.count('walking_cache_misses', len(missing))
+
+        if missing and self.use_google_api:
+            google_values = {}
+            try:
+                for origins, destinations in self._google_batches([pairs[k] for k in missing]):
+                    batch_values = self._google_distancematrix_api_many(origins, destinations)
+                    google_values.update(batch_values)
+                    if self.use_cache:
+                        for key_cache, value in batch_values.iteritems():
+                            self._add_to_cache(key_cache, value)
+            except OverQueryLimit:
+                self.use_google_api = False
+            except ConnectionError:
+                pass
+
+            for k in missing:
+                if keys[k] in google_values:
+                    values[k] = google_values[keys[k]]
+            missing = [k for k in missing if keys[k] not in google_values]
+
+        metrics.count('walking_vincenty', len(missing))
+        return values, missing
 
     def _get_distance(self, *args, **kwargs):
         from_google = False
@@ -125,6 +278,8 @@ class WalkingTimes(object):
                 result = self._get_distance_vincenty(*args, **kwargs)
         else:
             result = self._get_distance_vincenty(*args, **kwargs)
+        if not from_google:
+            metrics.count('walking_vincenty')
 
         return {'from_google': from_google, 'result': result}
 
@@ -132,23 +287,21 @@ class WalkingTimes(object):
         origin_tuple = (origin['lat'], origin['lon'])
         destination_tuple = (destination['lat'], destination['lon'])
         raw_distance = vincenty(origin_tuple, destination_tuple).km
-        # TODO improve the factor using the google results as test set
-        aprox_distance = raw_distance * 1.22  # we have to add a factor to compensate curves in the way.
-        # acording wikipedia: average human walking speed is about 5.0 kilometres per hour
-        # https://en.wikipedia.org/?title=Walking
-        average_walking_speed = 5
-        aprox_duration = (aprox_distance / average_walking_speed) * 60  # aprox. duration in minutes
-        result = {
-            "distance": {
-                "text": "%2f km" % aprox_distance,
-                "value": aprox_distance * 1000  # distance in meters
-            },
-            "duration": {
-                "text": "%d min" % aprox_duration,
-                "value": aprox_duration * 60  # duration in seconds
-            }
-        }
-        return result
+        aprox_distance = raw_distance * self.detour_factor
+        aprox_duration = (aprox_distance / self.average_walking_speed) * 60  # aprox. duration in minutes
+        # (distance in meters, duration in seconds)
+        return aprox_distance * 1000, aprox_duration * 60
+
+    def get_distances_vincenty(self, origins_lat, origins_lon, destinations_lat, destinations_lon):
+        """
+        Batch version of _get_distance_vincenty. It takes arrays with the
+        coordinates of the origins and the destinations and returns the
+        arrays (distances in meters, durations in seconds) of every pair.
+        """
+        raw_distances = vincenty_km(origins_lat, origins_lon, destinations_lat, destinations_lon)
+        aprox_distances = raw_distances * self.detour_factor
+        aprox_durations = (aprox_distances / self.average_walking_speed) * 3600
+        return aprox_distances * 1000, aprox_durations
 
     def aproximate_bike_duration(self, walking_duration):
         bike_duration = walking_duration / self.bike_scale_factor
@@ -173,31 +326,126 @@ class WalkingTimes(object):
                 }
         return bike_results
 
+    def calculate_bike_many(self, origins, destinations):
+        """
+        Batch version of calculate_bike. origins and destinations are lists of
+        coordinates with the same length. It returns the arrays (min, value, max)
+        of the bike durations in seconds, with NaN if there is no result.
+        The pairs are searched in the cache and in the google api like in
+        calculate_many, and the vincenty durations of the rest are calculated
+        at once.
+        """
+        walking_durations = np.empty(len(origins))
+        walking_durations.fill(np.nan)
+        walking_values, pending = self._calculate_many(zip(origins, destinations))
+        for k, walking_value in enumerate(walking_values):
+            if walking_value is not None and walking_value[1] is not None:
+                walking_durations[k] = walking_value[1]
+
+        if pending:
+            distances, walking_durations[pending] = self.get_distances_vincenty(
+                [origins[k]['lat'] for k in pending], [origins[k]['lon'] for k in pending],
+                [destinations[k]['lat'] for k in pending], [destinations[k]['lon'] for k in pending])
+
+        bike_durations = self.aproximate_bike_duration(walking_durations)
+        return bike_durations["min"], bike_durations["value"], bike_durations["max"]
+
+    def _cache_key(self, origin, destination):
+        # the coordinates are quantized to integers with the same precision
+        # of the '%f' strings used in the api, (lat, lon, lat, lon) * 10^6
+        return (int(round(origin['lat'] * 1e6)), int(round(origin['lon'] * 1e6)),
+                int(round(destination['lat'] * 1e6)), int(round(destination['lon'] * 1e6)))
+
     def _coord_to_string(self, coord):
         return '%f,%f' % (coord['lat'], coord['lon'])
 
+    def _google_batches(self, pairs):
+        """
+        Group the pairs in requests of origins x destinations where all the
+        elements are needed. The destinations are split in blocks of
+        max_locations in the order they first appear in pairs, and the origins
+        with the same destinations in a block are requested together up to
+        max_elements. So the pairs of many origins to the same destinations
+        (a triangle of a matrix, or all the pairs but the origin itself) share
+        the requests of the complete blocks.
+        """
+        destinations_by_origin = {}
+        destination_positions = {}
+        origins = []
+        for origin, destination in pairs:
+            origin_key = self._coord_to_string(origin)
+            if origin_key not in destinations_by_origin:
+                destinations_by_origin[origin_key] = {}
+                origins.append((origin_key, origin))
+            destination_key = self._coord_to_string(destination)
+            if destination_key not in destination_positions:
+                destination_positions[destination_key] = len(destination_positions)
+            destinations_by_origin[origin_key][destination_key] = destination
+
+        max_destinations = min(self.max_locations, self.max_elements)
+        groups = {}
+        groups_order = []
+        for origin_key, origin in origins:
+            destinations = sorted(destinations_by_origin[origin_key].items(),
+                                  key=lambda item: destination_positions[item[0]])
+            for block, group in groupby(destinations, lambda item: destination_positions[item[0]] // max_destinations):
+                group = tuple(group)
+                group_key = tuple(destination_key for destination_key, destination in group)
+                if group_key not in groups:
+                    groups[group_key] = (group, [])
+                    groups_order.append(group_key)
+                groups[group_key][1].append(origin)
+
+        batches = []
+        for group_key in groups_order:
+            group, group_origins = groups[group_key]
+            max_origins = min(self.max_locations, self.max_elements // len(group))
+            destinations = [destination for destination_key, destination in group]
+            for i in xrange(0, len(group_origins), max_origins):
+                batches.append((group_origins[i:i + max_origins], destinations))
+        return batches
+
     def _google_distancematrix_api(self, origin, destination, mode="walking"):
+        results = self._google_distancematrix_api_many([origin], [destination], mode)
+        return results[self._cache_key(origin, destination)]
+
+    def _google_distancematrix_api_many(self, origins, destinations, mode="walking"):
+        """
+        Request all the elements origins x destinations in one call to the api.
+        It returns a dict with the cache keys of the pairs and the values
+        (distance in meters, duration in seconds). The pairs without a route
+        have the value NO_ROUTE.
+        """
         options = {
-            "origins": self._coord_to_string(origin),
-            "destinations": self._coord_to_string(destination),
+            "origins": "|".join(self._coord_to_string(origin) for origin in origins),
+            "destinations": "|".join(self._coord_to_string(destination) for destination in destinations),
             "mode": mode
             }
 
         if self.google_api_key:
             options["key"] = self.google_api_key
 
-        req = requests.get(self.google_distancematrix_api_url, params=options)
-        response = req.json()
+        metrics.count('walking_api_calls')
+        metrics.count('walking_api_elements', len(origins) * len(destinations))
+        with metrics.timer('walking_api'):
+            req = self.session.get(self.google_distancematrix_api_url, params=options)
+            response = req.json()
 
-        result = {}
+        results = {}
+        for origin in origins:
+            for destination in destinations:
+                results[self._cache_key(origin, destination)] = NO_ROUTE
 
         if response["status"] == "OK":
-            if response["rows"][0]["elements"][0]["status"] == "OK":
-                result = response["rows"][0]["elements"][0]
+            for origin, row in zip(origins, response["rows"]):
+                for destination, element in zip(destinations, row["elements"]):
+                    if element["status"] == "OK":
+                        results[self._cache_key(origin, destination)] = (element["distance"]["value"],
+                                                                         element["duration"]["value"])
         elif response["status"] == "OVER_QUERY_LIMIT":
             raise OverQueryLimit()
 
-        return result
+        return results
 
 if __name__ == "__main__":
     origin = {
@@ -218,8 +466,8 @@ if __name__ == "__main__":
     wtime.use_cache = False
     result_no_google = wtime.calculate(origin, destination)
 
-    print "distance: %s" % result["distance"]["text"]
-    print "duration: %s" % result["duration"]["text"]
-    print "distance no google: %s" % result_no_google["distance"]["text"]
-    print "duration no google: %s" % result_no_google["duration"]["text"]
+    print "distance: %.1f km" % (result["distance"]["value"] / 1000.)
+    print "duration: %d mins" % (result["duration"]["value"] / 60)
+    print "distance no google: %.1f km" % (result_no_google["distance"]["value"] / 1000.)
+    print "duration no google: %d mins" % (result_no_google["duration"]["value"] / 60)
     print "bike duration: (min, aprox, max) (%d mins, %d mins, %d mins)" % (bike_result['duration']['min']/60, bike_result['duration']['value']/60, bike_result['duration']['max']/60)
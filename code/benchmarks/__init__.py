@@ -0,0 +1,2 @@
+# Benchmarks of the pipeline. They are run from the code directory, e.g.:
+# python -m benchmarks.walking_times
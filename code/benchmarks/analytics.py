@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Compare computing the analytics of every timestamp from scratch, with
+networkx for the degrees and strengths, sorting all the edges for the top
+corridors and a new label propagation for the communities, with
+NetworkAnalytics updated with the edges changed. The edges are random edges
+found between the stations, counted by EdgeWeights.
+
+python -m benchmarks.analytics [num stations] [edges per tick] [ticks]
+"""
+
+import sys
+import time
+from collections import Counter, namedtuple
+
+import networkx as nx
+import numpy as np
+
+from EdgeWeights import EdgeWeights
+from NetworkAnalytics import NetworkAnalytics, WindowAnalytics
+
+Changes = namedtuple('Changes', ['edges', 'bikes'])
+
+
+def scratch_summary(G, keys, top=10):
+    summary = {}
+    for key in keys:
+        H = nx.Graph()
+        H.add_edges_from((u, v, d) for u, v, d in G.edges(data=True) if d[key])
+        strengths = H.degree(weight=key)
+        edges = sorted(((min(u, v), max(u, v)), d[key]) for u, v, d in H.edges(data=True))
+        edges.sort(key=lambda edge: -edge[1])
+        communities = WindowAnalytics(top)
+        for (u, v), weight in edges:
+            communities.set_weight(u, v, weight)
+        communities.propagate()
+        summary[key] = (Counter(H.degree().values()), Counter(s.bit_length() - 1 for s in strengths.values()),
+                        [[u, v, weight] for (u, v), weight in edges[:top]], communities.modularity())
+    return summary
+
+
+def main(num_stations=400, edges_per_tick=300, ticks=100):
+    num_stations, edges_per_tick, ticks = int(num_stations), int(edges_per_tick), int(ticks)
+    random = np.random.RandomState(0)
+    weights = EdgeWeights()
+    ticks_changes = []  # (EdgesChanges, weights of the edges added and updated)
+    for tick in xrange(ticks):
+        u = random.randint(0, num_stations, edges_per_tick)
+        v = random.randint(0, num_stations, edges_per_tick)
+        edges_changes = weights.update((a, b) for a, b in zip(u.tolist(), v.tolist()) if a != b)
+        ticks_changes.append((edges_changes, [(edge, weights.weights(edge))
+                                              for edge in edges_changes.added | edges_changes.updated]))
+
+    def iter_graphs():
+        G = nx.Graph()
+        for edges_changes, edges_weights in ticks_changes:
+            for edge in edges_changes.removed:
+                G.remove_edge(*edge)
+            for (u, v), edge_weights in edges_weights:
+                G.add_edge(u, v, edge_weights)
+            yield G, edges_changes
+
+    start = time.time()
+    scratch = [scratch_summary(G, weights.keys) for G, edges_changes in iter_graphs()]
+    scratch_time = time.time() - start
+
+    analytics = NetworkAnalytics()
+    incremental_time = 0
+    different = 0
+    modularity = [0, 0]
+    for tick, (G, edges_changes) in enumerate(iter_graphs()):
+        start = time.time()
+        analytics.update(G, Changes(edges_changes, {}))
+        summary = analytics.summary()
+        incremental_time += time.time() - start
+
+        for key, graph in zip(analytics.keys, analytics.graphs):
+            degrees, strengths, top, scratch_modularity = scratch[tick][key]
+            if degrees != graph.degrees or strengths != graph.strengths or top != summary[key]['top']:
+                different += 1
+            modularity[0] += scratch_modularity
+            modularity[1] += graph.modularity()
+
+    print "%d stations, %d edges found per tick, %d edges at the end" % (num_stations, edges_per_tick, len(weights))
+    if different:
+        print "Different analytics in %d windows" % different
+        return 1
+    windows = ticks * len(weights.keys)
+    print "mean modularity: scratch %.3f, incremental %.3f" % (modularity[0] / windows, modularity[1] / windows)
+    print "scratch: %.2f s (%.1f ms per tick)" % (scratch_time, scratch_time * 1000 / ticks)
+    print "incremental: %.2f s (%.1f ms per tick)" % (incremental_time, incremental_time * 1000 / ticks)
+    print "speedup: %.1fx" % (scratch_time / incremental_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the old scan of all the departures of the last 35 minutes for every
+arrival with DepartureWindow, with random departures and arrivals at rush
+hour. The durations are the vincenty approximations between random
+stations of Barcelona.
+
+python -m benchmarks.departure_window [num stations] [moves per minute] [minutes]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from BikeDurations import BikeDurations
+from DepartureWindow import DepartureWindow
+from WalkingTimes import WalkingTimes
+
+
+def scan_origins(durations, destination_id, departures, timestamp):
+    # the old _find_posible_origins, all the window is checked every time
+    departures_timestamps, departures_ids, departures_indexes = departures
+    destination = durations.index[destination_id]
+    posible_durations = timestamp - departures_timestamps
+    min_durations = durations.min[destination, departures_indexes]
+    max_durations = durations.max[destination, departures_indexes]
+    with np.errstate(invalid='ignore'):
+        is_origin = ((departures_ids != destination_id) & (max_durations >= posible_durations) &
+                     (min_durations <= posible_durations))
+    return departures_ids[is_origin].tolist()
+
+
+def main(num_stations=400, moves=300, minutes=120, max_time=35 * 60):
+    num_stations, moves, minutes = int(num_stations), int(moves), int(minutes)
+    random = np.random.RandomState(0)
+    durations = BikeDurations(WalkingTimes(use_cache=False, use_google_api=False))
+    durations.add_stations([(i, 41.35 + random.rand() * 0.11, 2.10 + random.rand() * 0.13)
+                            for i in xrange(num_stations)])
+
+    # every minute some stations have departures and some have arrivals
+    ticks = []
+    for tick in xrange(minutes):
+        stations = random.choice(num_stations, min(num_stations, moves * 2), replace=False)
+        ticks.append((tick * 60, stations[:len(stations) // 2].tolist(), stations[len(stations) // 2:].tolist()))
+    print "%d stations, %d departures and %d arrivals per minute, %d minutes" % (
+        num_stations, len(ticks[0][1]), len(ticks[0][2]), minutes)
+
+    start = time.time()
+    scan_edges = 0
+    station_less_bikes = []
+    for timestamp, departures_ids, arrivals_ids in ticks:
+        station_less_bikes.extend((timestamp, station_id) for station_id in departures_ids)
+        station_less_bikes = [(t, station_id) for t, station_id in station_less_bikes if timestamp - t < max_time]
+        departures = (np.array([t for t, station_id in station_less_bikes], dtype=np.int64),
+                      np.array([station_id for t, station_id in station_less_bikes], dtype=np.int64),
+                      durations.indexes([station_id for t, station_id in station_less_bikes]))
+        for station_id in arrivals_ids:
+            scan_edges += len(set(scan_origins(durations, station_id, departures, timestamp)))
+    scan_time = time.time() - start
+
+    start = time.time()
+    window_edges = 0
+    window = DepartureWindow(durations, max_time)
+    for timestamp, departures_ids, arrivals_ids in ticks:
+        for station_id in departures_ids:
+            window.add(timestamp, station_id)
+        window.expire(timestamp)
+        window_edges += sum(len(origins) for origins in window.origins(arrivals_ids, timestamp))
+    window_time = time.time() - start
+
+    if scan_edges != window_edges:
+        print "Different edges: scan %d, window %d" % (scan_edges, window_edges)
+        return 1
+    print "%d edges found" % window_edges
+    print "scan: %.2f s" % scan_time
+    print "window: %.2f s" % window_time
+    print "speedup: %.1fx" % (scan_time / window_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Compare one request per pair without connection reuse (the old client)
+with the batched client of WalkingTimes, against the local fake distance
+matrix server.
+
+python -m benchmarks.distance_matrix [num stations] [latency in ms]
+"""
+
+import sys
+import time
+
+import requests
+
+from WalkingTimes import WalkingTimes
+from benchmarks.fake_distancematrix import FakeDistanceMatrixServer
+from benchmarks.walking_times import read_stations
+
+
+def main(num_stations=40, latency_ms=5):
+    stations = read_stations('data.jsonl', 'walking_cache.json')[:int(num_stations)]
+    pairs = [(origin, destination) for origin in stations for destination in stations if origin != destination]
+    server = FakeDistanceMatrixServer(latency=float(latency_ms) / 1000).start()
+    print "%d stations, %d pairs, %s ms of latency" % (len(stations), len(pairs), latency_ms)
+
+    try:
+        wtime = WalkingTimes(use_cache=False, api_url=server.url)
+
+        # old client: one request per pair and a new connection every time
+        start = time.time()
+        for origin, destination in pairs:
+            requests.get(server.url, params={
+                "origins": wtime._coord_to_string(origin),
+                "destinations": wtime._coord_to_string(destination),
+                "mode": "walking"}).json()
+        single_time = time.time() - start
+        single_requests = server.num_requests
+
+        start = time.time()
+        results = wtime.calculate_many(pairs)
+        batch_time = time.time() - start
+        batch_requests = server.num_requests - single_requests
+
+        wtime.session.close()
+        if not all(result for result in results) or not wtime.use_google_api:
+            print "The batched client didn't get all the results"
+            return 1
+
+        print "single: %d requests in %.2f s (%.0f pairs/s)" % (single_requests, single_time, len(pairs) / single_time)
+        print "batch: %d requests in %.2f s (%.0f pairs/s)" % (batch_requests, batch_time, len(pairs) / batch_time)
+        print "speedup: %.1fx" % (single_time / batch_time)
+
+        # with a quota the api answers OVER_QUERY_LIMIT and the client uses vincenty
+        server.quota = 200
+        wtime = WalkingTimes(use_cache=False, api_url=server.url)
+        results = wtime.calculate_many(pairs)
+        wtime.session.close()
+        print "with a quota of %d elements/s: %d OVER_QUERY_LIMIT, google api enabled: %s" % (
+            server.quota, server.num_over_query_limit, wtime.use_google_api)
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Compare the old update of the edges, with lists of weights visited every
+tick, with EdgeWeights, for random edges found between the stations.
+
+python -m benchmarks.edge_weights [num stations] [edges per tick] [ticks]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from EdgeWeights import EdgeWeights
+
+
+def update_lists(edges, found_edges, max_window=15):
+    # the old "Update edges" loop of StationsNetworks._build_from_data
+    for edge in edges.keys():
+        weights = edges[edge]
+        if edge in found_edges:
+            for weight in weights:
+                weight.append(1)
+        elif sum(weights[-1]) == 0:
+            del edges[edge]
+            continue
+        else:
+            for weight in weights:
+                weight.append(0)
+        edges[edge] = [weights[0][-1:], weights[1][-5:], weights[2][-max_window:]]
+    for edge in found_edges:
+        if edge not in edges:
+            edges[edge] = [[1], [1], [1]]
+
+
+def main(num_stations=400, edges_per_tick=2000, ticks=100):
+    num_stations, edges_per_tick, ticks = int(num_stations), int(edges_per_tick), int(ticks)
+    random = np.random.RandomState(0)
+    found = []
+    for tick in xrange(ticks):
+        u = random.randint(0, num_stations, edges_per_tick)
+        v = random.randint(0, num_stations, edges_per_tick)
+        found.append(set((min(a, b), max(a, b)) for a, b in zip(u.tolist(), v.tolist()) if a != b))
+
+    start = time.time()
+    edges = {}
+    for found_edges in found:
+        update_lists(edges, found_edges)
+        sizes = [[sum(weight) for weight in weights] for weights in edges.itervalues()]
+    lists_time = time.time() - start
+
+    start = time.time()
+    weights = EdgeWeights()
+    for found_edges in found:
+        weights.update(found_edges)
+    rolling_time = time.time() - start
+
+    print "%d stations, %d edges found per tick, %d edges at the end" % (num_stations, edges_per_tick, len(weights))
+    if set(edges) != set(weights.counts):
+        print "Different edges"
+        return 1
+    print "lists: %.2f s (%.1f ms per tick)" % (lists_time, lists_time * 1000 / ticks)
+    print "rolling: %.2f s (%.1f ms per tick)" % (rolling_time, rolling_time * 1000 / ticks)
+    print "speedup: %.1fx" % (lists_time / rolling_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Local stand-in of the google distance matrix api. The elements are
+calculated with vincenty and the responses have the same form as the real
+ones, with OVER_QUERY_LIMIT when the quota of elements per second is
+exceeded. It can be started alone to use it with DISTANCEMATRIX_API_URL:
+
+python -m benchmarks.fake_distancematrix [port] [elements per second]
+"""
+
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+from geopy.distance import vincenty
+
+
+class DistanceMatrixHandler(BaseHTTPRequestHandler):
+    # keep-alive connections, like the real api
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent together, otherwise every keep-alive
+    # response waits for the delayed ack of the client
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != self.server.path:
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        origins = self._parse_locations(query.get('origins', [''])[0])
+        destinations = self._parse_locations(query.get('destinations', [''])[0])
+        response = self.server.respond(origins, destinations)
+
+        body = json.dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse_locations(self, locations):
+        return [tuple(float(coord) for coord in location.split(',')) for location in locations.split('|') if location]
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDistanceMatrixServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    path = '/maps/api/distancematrix/json'
+    max_elements = 100
+    max_locations = 25
+
+    def __init__(self, port=0, quota=None, latency=0.0):
+        """
+        quota is the number of elements per second allowed, None is no limit.
+        latency is the time in seconds added to every response.
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), DistanceMatrixHandler)
+        self.quota = quota
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_elements = 0
+        self.num_over_query_limit = 0
+        self._window_start = time.time()
+        self._window_elements = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], self.path)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _over_quota(self, num_elements):
+        with self.lock:
+            self.num_requests += 1
+            now = time.time()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_elements = 0
+            if self.quota is not None and self._window_elements + num_elements > self.quota:
+                self.num_over_query_limit += 1
+                return True
+            self._window_elements += num_elements
+            self.num_elements += num_elements
+            return False
+
+    def respond(self, origins, destinations):
+        if self.latency:
+            time.sleep(self.latency)
+
+        num_elements = len(origins) * len(destinations)
+        if not num_elements:
+            return {"status": "INVALID_REQUEST", "rows": []}
+        if num_elements > self.max_elements or max(len(origins), len(destinations)) > self.max_locations:
+            return {"status": "MAX_ELEMENTS_EXCEEDED", "rows": []}
+        if self._over_quota(num_elements):
+            return {"status": "OVER_QUERY_LIMIT", "rows": []}
+
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                distance = vincenty(origin, destination).km * 1.22
+                duration = distance / 5 * 3600
+                elements.append({
+                    "status": "OK",
+                    "distance": {"text": "%.1f km" % distance, "value": int(distance * 1000)},
+                    "duration": {"text": "%d mins" % (duration / 60), "value": int(duration)}
+                    })
+            rows.append({"elements": elements})
+
+        return {
+            "status": "OK",
+            "origin_addresses": ["%f,%f" % origin for origin in origins],
+            "destination_addresses": ["%f,%f" % destination for destination in destinations],
+            "rows": rows
+            }
+
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    quota = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    server = FakeDistanceMatrixServer(port, quota)
+    print "Serving %s" % server.url
+    server.serve_forever()
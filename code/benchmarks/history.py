@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Time of the queries of NetworkHistory against building the graph again
+from the start of the data until the time asked, with the synthetic
+snapshots of benchmarks.synthetic. The graph returned by every query is
+compared with the graph built, and the busiest edges and the flows with
+the edges found.
+
+python -m benchmarks.history [num stations] [hours] [queries]
+"""
+
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from os.path import join
+
+import numpy as np
+
+from NetworkHistory import NetworkHistory
+from benchmarks.suite import OfflineNetworks
+from benchmarks.synthetic import SyntheticBicing
+
+
+def graph_state(G, weight_keys):
+    nodes = [[node_id, G.node[node_id]['lon'], G.node[node_id]['lat'], G.node[node_id]['color'],
+              G.node[node_id]['size'], G.node[node_id]['bikes']] for node_id in sorted(G.nodes())]
+    edges = sorted([min(u, v), max(u, v)] + [weights[weight_key] for weight_key in weight_keys]
+                   for u, v, weights in G.edges(data=True))
+    return nodes, edges
+
+
+def main(num_stations=420, hours=2, num_queries=20):
+    num_stations, hours, num_queries = int(num_stations), float(hours), int(num_queries)
+    logging.getLogger('').setLevel(logging.WARNING)
+    bicing = SyntheticBicing(num_stations, hours)
+    random = np.random.RandomState(0)
+    timestamps = [timestamp for timestamp, stations in bicing.snapshots]
+    queries = set(random.choice(timestamps, num_queries).tolist())
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        data_file = join(tmp_dir, 'data.jsonl')
+        bicing.write_dataset(data_file)
+        net = OfflineNetworks(data_file)
+        weight_keys = net._weight_keys()
+        history = NetworkHistory(join(tmp_dir, 'history.db'), weight_keys)
+        history.discard_after(None)
+
+        # the graph is built once and the history written, the time to
+        # build the graph until every query is the time of replaying it
+        expected = {}
+        replay_time = {}
+        found = Counter()
+        build_time = write_time = 0
+        snapshots = net._build_from_data(net._read_data(data_file))
+        while True:
+            start = time.time()
+            try:
+                timestamp = next(snapshots)
+            except StopIteration:
+                break
+            build_time += time.time() - start
+            start = time.time()
+            history.add(timestamp, net.G, net.changes)
+            write_time += time.time() - start
+            found.update(net.changes.found)
+            if timestamp in queries:
+                expected[timestamp] = graph_state(net.G, weight_keys)
+                replay_time[timestamp] = build_time
+        history.close()
+
+        history = NetworkHistory(join(tmp_dir, 'history.db'))
+        different = 0
+        query_time = 0
+        for timestamp in sorted(expected):
+            start = time.time()
+            state = history.state(timestamp)
+            query_time += time.time() - start
+            different += (state['nodes'], state['edges']) != expected[timestamp]
+
+        undirected = Counter()
+        for (origin, destination), times in found.iteritems():
+            undirected[(min(origin, destination), max(origin, destination))] += times
+        start = time.time()
+        busiest = history.busiest_edges(top=10)
+        busiest_time = time.time() - start
+        different += [times for u, v, times in busiest] != sorted(undirected.values(), reverse=True)[:10]
+        u, v = busiest[0][:2]
+        start = time.time()
+        flows = history.flows(u, v)
+        flows_time = time.time() - start
+        different += len(flows['a_to_b']) + len(flows['b_to_a']) != undirected[(u, v)]
+        history.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print "%d snapshots, %d queries" % (len(timestamps), len(expected))
+    print "build the graph: %.2f s, write the history: %.2f s" % (build_time, write_time)
+    print "replay until the time asked: %.1f ms per query" % (sum(replay_time.values()) * 1000 / len(expected))
+    print "state from the history: %.1f ms per query" % (query_time * 1000 / len(expected))
+    print "busiest edges: %.1f ms, flows of an edge: %.1f ms" % (busiest_time * 1000, flows_time * 1000)
+    if different:
+        print "%d queries are different" % different
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Frames per second of FrameRenderer with random frames of the size of the
+network of Barcelona. First the old drawing with pyplot and networkx, a new
+figure for every png file and the figure reused for all the frames are
+compared in one process, and then the reused figure with several numbers
+of workers. At last the size of the png files is compared with the sprite
+sheets and the videos (when ffmpeg is installed). The files are written in
+a temporary directory.
+
+python -m benchmarks.render [num frames] [workers separated by commas]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+
+from FrameRenderer import AXIS, Frame, FrameRenderer, frame_filename, frame_title
+from FrameWriters import VideoWriter
+
+
+def random_frames(num_frames, num_nodes=420, num_edges=1500, weight_keys=('weight_1', 'weight_5', 'weight_15')):
+    random = np.random.RandomState(0)
+    positions = np.column_stack((random.uniform(AXIS[0], AXIS[1], num_nodes),
+                                 random.uniform(AXIS[2], AXIS[3], num_nodes)))
+    pairs = np.array([(u, v) for u in xrange(num_nodes) for v in xrange(u + 1, num_nodes)])
+    for index in xrange(num_frames):
+        edges = pairs[random.choice(len(pairs), num_edges, replace=False)]
+        yield Frame(1435000000 + index * 60, positions,
+                    random.uniform(10, 50, num_nodes).tolist(),
+                    [('g', 'y', 'b', 'r', 'm', 'c')[k] for k in random.randint(0, 6, num_nodes)],
+                    positions[edges],
+                    dict((weight_key, random.rand(num_edges)) for weight_key in weight_keys))
+
+
+def draw_pyplot(frame, output_dir, png=True, raster=False, axis=AXIS):
+    # the drawing of StationsNetworks._draw_timeseries before FrameRenderer
+    G = nx.Graph()
+    G.add_nodes_from(xrange(len(frame.positions)))
+    nodes_pos = dict(enumerate(frame.positions))
+    # the edges are found again from the positions of the nodes
+    nodes_index = dict((tuple(position), node) for node, position in nodes_pos.iteritems())
+    edges = [(nodes_index[tuple(u)], nodes_index[tuple(v)]) for u, v in frame.segments]
+    G.add_edges_from(edges)
+    for weight_key, widths in sorted(frame.widths.iteritems()):
+        plt.axis(axis)
+        plt.axis('off')
+        plt.title(frame_title(frame))
+        nx.draw_networkx_nodes(G, nodes_pos, node_size=frame.sizes, node_color=frame.colors, with_labels=False)
+        nx.draw_networkx_edges(G, nodes_pos, edgelist=edges, width=widths, edge_color='g')
+        plt.savefig(frame_filename(output_dir, weight_key, frame.timestamp))
+        plt.close()
+    return frame.timestamp, {}
+
+
+def directory_size(directory):
+    files = [os.path.join(path, name) for path, dirs, names in os.walk(directory) for name in names]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+
+def main(num_frames=30, workers=None):
+    num_frames = int(num_frames)
+    if workers:
+        workers = [int(w) for w in workers.split(',')]
+    else:
+        workers = sorted(set([1, cpu_count()]))
+    print "%d frames, %d cpus" % (num_frames, cpu_count())
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, draw in [('pyplot', draw_pyplot), ('new figure', None), ('reused figure', None)]:
+            renderer = FrameRenderer(tmp_dir, 1, reuse_figure=(name == 'reused figure'))
+            if draw:
+                renderer.draw = draw
+            start = time.time()
+            renderer.render(random_frames(num_frames))
+            elapsed = time.time() - start
+            print "%s: %.2f s (%.1f frames/s)" % (name, elapsed, num_frames / elapsed)
+
+        for num_workers in workers:
+            renderer = FrameRenderer(tmp_dir, num_workers)
+            start = time.time()
+            renderer.render(random_frames(num_frames))
+            elapsed = time.time() - start
+            print "%d workers: %.2f s (%.1f frames/s)" % (num_workers, elapsed, num_frames / elapsed)
+
+        outputs = ['png', 'sprites']
+        if VideoWriter.available():
+            outputs.append('videos')
+        for output in outputs:
+            output_dir = os.path.join(tmp_dir, output)
+            renderer = FrameRenderer(output_dir, 1, outputs=(output, ))
+            start = time.time()
+            renderer.render(random_frames(num_frames))
+            renderer.save_manifest()
+            elapsed = time.time() - start
+            num_files, size = directory_size(output_dir)
+            print "%s: %.2f s (%.1f frames/s), %d files, %.1f KB" % (output, elapsed, num_frames / elapsed,
+                                                                    num_files, size / 1024.0)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the whole pipeline with the synthetic snapshots of
+benchmarks.synthetic, offline and without the walking cache:
+
+- parse: xml files parsed per second by Stations
+- replay: snapshots per second processed by _build_from_data from a dataset
+- recall and precision: the edges found by the origin matching in every
+  snapshot compared with the trips that arrived. Every arrival gets all the
+  posible origins, so the precision is low by design.
+- render: frames per second drawn by FrameRenderer with one worker
+
+Every result is compared with a minimum in THRESHOLDS (or in the json file
+of --thresholds) and the exit status is 1 if some result is lower.
+
+python -m benchmarks.suite [--stations N] [--hours H] [--frames N] [--thresholds file] [--save file]
+"""
+
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from glob import glob
+from os.path import join
+
+from BikeDurations import BikeDurations
+from FrameRenderer import FrameRenderer
+from Metrics import metrics
+from Networks import StationsNetworks
+from Stations import parse_file
+from WalkingTimes import WalkingTimes
+from benchmarks.synthetic import SyntheticBicing
+
+# about a third of the speed of a laptop with one worker. The recall and
+# the precision don't depend on the machine, the snapshots are the same for
+# the same seed, so their minimums are near the results (0.92 and 0.016)
+THRESHOLDS = {
+    'parse_files_per_s': 30,
+    'replay_snapshots_per_s': 12,
+    'recall': 0.9,
+    'precision': 0.014,
+    'render_frames_per_s': 2
+    }
+
+
+class OfflineNetworks(StationsNetworks):
+    """
+    StationsNetworks with the vincenty durations, without the google api and
+    the files of the walking cache, the durations and the checkpoint. The
+    data is not read and drawn when it is created.
+    """
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.workers = 1
+        self.outputs = ()
+        self.wtime = WalkingTimes(use_cache=False, use_google_api=False)
+        self.durations = BikeDurations(self.wtime)
+        self._reset_state()
+
+
+def bench_parse(bicing, tmp_dir):
+    xml_dir = join(tmp_dir, 'xml')
+    bicing.write_xml(xml_dir)
+    files = sorted(glob(join(xml_dir, '*.xml')))
+    start = time.time()
+    parsed = [parse_file(file_path) for file_path in files]
+    elapsed = time.time() - start
+    # the xml should have the same stations of the generator
+    for (file_path, timestamp, stations), snapshot in zip(parsed, bicing.snapshots):
+        if (timestamp, stations) != snapshot:
+            raise ValueError("%s is not the snapshot %d" % (file_path, snapshot[0]))
+    return len(files) / elapsed
+
+
+def bench_replay(bicing, tmp_dir, num_frames):
+    """
+    Replay the dataset of the snapshots, it returns the snapshots per
+    second, the recall, the precision and num_frames frames to render
+    """
+    data_file = join(tmp_dir, 'data.jsonl')
+    bicing.write_dataset(data_file)
+    truth = bicing.ground_truth()
+
+    net = OfflineNetworks(data_file)
+    data = net._read_data(data_file)
+    elapsed = 0
+    num_snapshots = 0
+    found = true_found = expected = 0
+    frames = []
+    snapshots = net._build_from_data(data)
+    while True:
+        start = time.time()
+        try:
+            timestamp = next(snapshots)
+        except StopIteration:
+            break
+        elapsed += time.time() - start
+        num_snapshots += 1
+
+        # weight_1 is 1 in the edges found in this snapshot
+        edges = set((min(u, v), max(u, v)) for u, v, weights in net.G.edges(data=True) if weights['weight_1'])
+        trips = truth.get(timestamp, set())
+        found += len(edges)
+        true_found += len(edges & trips)
+        expected += len(trips)
+        if len(frames) < num_frames:
+            frames.append(net._get_frame(timestamp))
+    return num_snapshots / elapsed, float(true_found) / max(expected, 1), float(true_found) / max(found, 1), frames
+
+
+def bench_render(frames, tmp_dir):
+    renderer = FrameRenderer(join(tmp_dir, 'images'), 1)
+    start = time.time()
+    renderer.render(iter(frames))
+    return len(frames) / (time.time() - start)
+
+
+def main(num_stations=420, hours=2, num_frames=20, thresholds=None):
+    logging.getLogger('').setLevel(logging.WARNING)
+    metrics.reset()
+    start = time.time()
+    bicing = SyntheticBicing(num_stations, hours)
+    print "%d stations, %d snapshots, %d trips (%.1f s to generate)" % (
+        num_stations, len(bicing.snapshots), len(bicing.trips), time.time() - start)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        results = {'parse_files_per_s': bench_parse(bicing, tmp_dir)}
+        replay, recall, precision, frames = bench_replay(bicing, tmp_dir, num_frames)
+        results.update({'replay_snapshots_per_s': replay, 'recall': recall, 'precision': precision})
+        results['render_frames_per_s'] = bench_render(frames, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    thresholds = dict(THRESHOLDS, **(thresholds or {}))
+    failed = 0
+    for name in sorted(results):
+        ok = results[name] >= thresholds[name]
+        failed += not ok
+        print "%-24s %10.3f  (min %g) %s" % (name, results[name], thresholds[name], 'ok' if ok else 'FAILED')
+    print metrics.summary()
+    return results, failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline with synthetic snapshots")
+    parser.add_argument('--stations', type=int, default=420)
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--frames', type=int, default=20, help="frames rendered")
+    parser.add_argument('--thresholds', default=None, help="json file with the minimums of the results")
+    parser.add_argument('--save', default=None, help="json file where the results are saved")
+    args = parser.parse_args()
+
+    thresholds = None
+    if args.thresholds:
+        with open(args.thresholds, 'r') as f:
+            thresholds = json.load(f)
+    results, failed = main(args.stations, args.hours, args.frames, thresholds)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Synthetic snapshots of a bicing service with known trips, to measure the
+pipeline without the remote datasets and the google api. The stations are
+random points in the map of Barcelona and every trip takes a bike from a
+station with bikes to a station with free slots. The durations of the
+trips are the vincenty bike durations of BikeDurations with some noise, so
+they are the durations that StationsNetworks expects. The snapshots have
+the stations every interval seconds, like the xml files of the service.
+
+The trips are the ground truth of the origin matching: a trip is seen as
+an edge (origin, destination) in the first snapshot after its arrival.
+Two trips that leave and arrive to a station between two snapshots cancel
+each other, so not all the trips can be found.
+
+python -m benchmarks.synthetic output_dir [--trips trips.json] [--stations N] [--hours H] [--interval S]
+                               [--trips-per-hour T]
+"""
+
+import heapq
+import json
+import os
+from os.path import isdir, join
+
+import numpy as np
+
+from BikeDurations import BikeDurations
+from FrameRenderer import AXIS
+from Snapshots import Snapshots
+from WalkingTimes import WalkingTimes
+
+
+class SyntheticBicing(object):
+    """
+    The snapshots and the trips of num_stations stations during hours hours.
+    The trips start at random times with trips_per_hour trips per hour on
+    average, and their durations are between min_duration and max_duration
+    seconds (most bicing trips are shorter than 30 minutes).
+
+    snapshots: [(timestamp, stations), ...] like Stations.stations
+    trips: [(origin, destination, departure time, arrival time), ...]
+    """
+    def __init__(self, num_stations=420, hours=2, interval=60, trips_per_hour=1200, start=1435000000,
+                 min_duration=5 * 60, max_duration=30 * 60, noise=0.1, seed=0):
+        self.num_stations = num_stations
+        self.interval = interval
+        self.start = start
+        self.end = start + int(hours * 3600)
+        self.random = np.random.RandomState(seed)
+
+        # the stations are kept away from the borders of the map
+        margin_lon = (AXIS[1] - AXIS[0]) * 0.05
+        margin_lat = (AXIS[3] - AXIS[2]) * 0.05
+        self.ids = range(1, num_stations + 1)
+        self.lat = np.round(self.random.uniform(AXIS[2] + margin_lat, AXIS[3] - margin_lat, num_stations), 6)
+        self.lon = np.round(self.random.uniform(AXIS[0] + margin_lon, AXIS[1] - margin_lon, num_stations), 6)
+        self.capacity = self.random.randint(15, 31, num_stations)
+        initial_bikes = (self.capacity * self.random.uniform(0.2, 0.8, num_stations)).astype(int)
+
+        durations = BikeDurations(WalkingTimes(use_cache=False, use_google_api=False))
+        durations.add_stations(zip(self.ids, self.lat.tolist(), self.lon.tolist()))
+        self.durations = durations.value
+
+        self.trips = self._plan_trips(initial_bikes, trips_per_hour, min_duration, max_duration, noise)
+        self.snapshots = self._take_snapshots(initial_bikes)
+
+    def _plan_trips(self, initial_bikes, trips_per_hour, min_duration, max_duration, noise):
+        # the bikes and the slots are followed in time, a trip only starts
+        # in a station with bikes and goes to a station with a free slot
+        # when it arrives, reserved when it starts
+        bikes = initial_bikes.copy()
+        reserved = np.zeros(self.num_stations, dtype=int)
+        arrivals = []  # heap of (arrival time, destination)
+        num_trips = self.random.poisson(trips_per_hour * (self.end - self.start) / 3600.0)
+        departures = np.sort(self.random.uniform(self.start, self.end, num_trips))
+        trips = []
+        for departure in departures:
+            while arrivals and arrivals[0][0] <= departure:
+                arrival, destination = heapq.heappop(arrivals)
+                bikes[destination] += 1
+                reserved[destination] -= 1
+
+            origins = np.flatnonzero(bikes > 0)
+            if not len(origins):
+                continue
+            origin = origins[self.random.randint(len(origins))]
+            durations = self.durations[origin]
+            with np.errstate(invalid='ignore'):
+                destinations = np.flatnonzero((durations >= min_duration) & (durations <= max_duration) &
+                                              (bikes + reserved < self.capacity))
+            if not len(destinations):
+                continue
+            destination = destinations[self.random.randint(len(destinations))]
+
+            arrival = departure + durations[destination] * self.random.uniform(1 - noise, 1 + noise)
+            bikes[origin] -= 1
+            reserved[destination] += 1
+            heapq.heappush(arrivals, (arrival, destination))
+            trips.append((self.ids[origin], self.ids[destination], float(departure), float(arrival)))
+        return trips
+
+    def _take_snapshots(self, initial_bikes):
+        # a snapshot has the bikes after all the departures and arrivals
+        # until its timestamp
+        index = dict((station_id, i) for i, station_id in enumerate(self.ids))
+        events = sorted([(departure, index[origin], -1) for origin, destination, departure, arrival in self.trips] +
+                        [(arrival, index[destination], 1) for origin, destination, departure, arrival in self.trips])
+        bikes = initial_bikes.copy()
+        snapshots = []
+        k = 0
+        for timestamp in xrange(self.start, self.end + 1, self.interval):
+            while k < len(events) and events[k][0] <= timestamp:
+                bikes[events[k][1]] += events[k][2]
+                k += 1
+            snapshots.append((timestamp, self._stations(bikes)))
+        return snapshots
+
+    def _stations(self, bikes):
+        stations = []
+        for i, station_id in enumerate(self.ids):
+            stations.append({
+                'id': station_id,
+                'type': 'BIKE',
+                'lat': float(self.lat[i]),
+                'long': float(self.lon[i]),
+                'street': 'Carrer %d' % station_id,
+                'height': 20,
+                'streetNumber': station_id,
+                'nearbyStationList': [self.ids[(i + 1) % self.num_stations], self.ids[(i + 2) % self.num_stations]],
+                'status': 'OPN',
+                'slots': int(self.capacity[i] - bikes[i]),  # free slots
+                'bikes': int(bikes[i])
+                })
+        return stations
+
+    def snapshot_time(self, time):
+        """
+        Timestamp of the first snapshot that shows an event at time
+        """
+        return self.start + int(np.ceil((time - self.start) / float(self.interval))) * self.interval
+
+    def ground_truth(self):
+        """
+        The edges (origin, destination) with origin <= destination of the
+        trips that arrive before every snapshot, {timestamp: set of edges}
+        """
+        edges = {}
+        for origin, destination, departure, arrival in self.trips:
+            if arrival <= self.end:
+                edge = (min(origin, destination), max(origin, destination))
+                edges.setdefault(self.snapshot_time(arrival), set()).add(edge)
+        return edges
+
+    def write_xml(self, output_dir):
+        """
+        Write every snapshot in <output_dir>/<timestamp>.xml with the format
+        of the xml of the service, as Stations reads it
+        """
+        if not isdir(output_dir):
+            os.makedirs(output_dir)
+        fields = ('id', 'type', 'lat', 'long', 'street', 'height', 'streetNumber', 'nearbyStationList', 'status',
+                  'slots', 'bikes')
+        for timestamp, stations in self.snapshots:
+            parts = ['<?xml version="1.0" encoding="UTF-8"?><bicing_stations><updatetime>%d</updatetime>' % timestamp]
+            for station in stations:
+                parts.append('<station>')
+                for field in fields:
+                    value = station[field]
+                    if field == 'nearbyStationList':
+                        value = ','.join(str(station_id) for station_id in value)
+                    elif field in ('lat', 'long'):
+                        value = '%.6f' % value
+                    parts.append('<%s>%s</%s>' % (field, value, field))
+                parts.append('</station>')
+            parts.append('</bicing_stations>')
+            with open(join(output_dir, '%d.xml' % timestamp), 'w') as f:
+                f.write(''.join(parts))
+
+    def write_dataset(self, data_file):
+        """
+        Append the snapshots to the newline delimited dataset data_file
+        """
+        snapshots = Snapshots(data_file)
+        for timestamp, stations in self.snapshots:
+            snapshots.append(timestamp, stations)
+        snapshots.close()
+        snapshots.update_index()
+
+    def write_trips(self, trips_file):
+        with open(trips_file, 'w') as f:
+            json.dump({'interval': self.interval, 'trips': self.trips}, f)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic xml snapshots and their trips")
+    parser.add_argument('output_dir', help="directory of the xml files")
+    parser.add_argument('--trips', default='trips.json', help="json file with the trips")
+    parser.add_argument('--stations', type=int, default=420)
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--interval', type=int, default=60, help="seconds between snapshots")
+    parser.add_argument('--trips-per-hour', type=int, default=1200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bicing = SyntheticBicing(args.stations, args.hours, args.interval, args.trips_per_hour, seed=args.seed)
+    bicing.write_xml(args.output_dir)
+    bicing.write_trips(args.trips)
+    print "%d snapshots written in %s and %d trips in %s" % (len(bicing.snapshots), args.output_dir,
+                                                            len(bicing.trips), args.trips)
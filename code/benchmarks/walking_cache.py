@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Startup and flush times and file sizes of the walking cache backends while
+the cache grows. The caches are created in a temporary directory.
+
+python -m benchmarks.walking_cache [sizes separated by commas]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from WalkingCache import JsonCache, SqliteCache
+
+
+def value(k):
+    return k % 5000, k % 3600
+
+
+def key(k):
+    return (int(round((41.35 + k % 997 * 1e-4) * 1e6)), int(round((2.10 + k % 991 * 1e-4) * 1e6)),
+            int(round((41.35 + k % 983 * 1e-4) * 1e6)), int(round((2.10 + k * 1e-6) * 1e6)))
+
+
+def measure(cache_class, cache_file, size, new_results=50):
+    cache = cache_class(cache_file)
+    for k in xrange(len(cache), size):
+        cache[key(k)] = value(k)
+    cache.close()
+
+    start = time.time()
+    cache = cache_class(cache_file)
+    startup = time.time() - start
+
+    # the results of max_count_not_cache misses and one flush
+    start = time.time()
+    for k in xrange(size, size + new_results):
+        cache[key(k)] = value(k)
+    cache.flush()
+    flush = time.time() - start
+    cache.close()
+    return startup, flush, os.path.getsize(cache_file)
+
+
+def main(sizes="1000,10000,50000"):
+    tmp_dir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        print "%8s %14s %14s %10s %14s %14s %10s" % ("pairs", "json startup", "json flush", "json size",
+                                                    "sqlite startup", "sqlite flush", "sqlite size")
+        for size in [int(size) for size in sizes.split(',')]:
+            # the json backend prints its messages
+            sys.stdout = open(os.devnull, 'w')
+            json_times = measure(JsonCache, os.path.join(tmp_dir, 'cache.json'), size)
+            sqlite_times = measure(SqliteCache, os.path.join(tmp_dir, 'cache.db'), size)
+            sys.stdout = stdout
+            print "%8d %12.1fms %12.1fms %8dkB %12.1fms %12.1fms %8dkB" % (
+                (size, json_times[0] * 1000, json_times[1] * 1000, json_times[2] / 1024,
+                 sqlite_times[0] * 1000, sqlite_times[1] * 1000, sqlite_times[2] / 1024))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
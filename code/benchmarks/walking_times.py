@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Compare the scalar vincenty distances of WalkingTimes with the vectorized
+batch version for all the pairs of stations. The stations are read from the
+first snapshot of the dataset, or from the coordinates of the walking cache
+if there is no dataset.
+
+python -m benchmarks.walking_times [data.jsonl]
+"""
+
+import sys
+import time
+from os.path import isfile
+
+import numpy as np
+
+from Snapshots import Snapshots
+from WalkingCache import JsonCache
+from WalkingTimes import WalkingTimes
+
+
+def read_stations(data_file, cache_file):
+    if isfile(data_file):
+        for timestamp, stations in Snapshots(data_file):
+            return [{'lat': station['lat'], 'lon': station['long']} for station in stations]
+
+    coords = set()
+    for key in JsonCache(cache_file).data:
+        coords.update((key[:2], key[2:]))
+    return [{'lat': lat / 1e6, 'lon': lon / 1e6} for lat, lon in sorted(coords)]
+
+
+def main(data_file='data.jsonl', cache_file='walking_cache.json', tolerance=1e-9):
+    stations = read_stations(data_file, cache_file)
+    wtime = WalkingTimes(use_cache=False, use_google_api=False)
+    pairs = [(origin, destination) for origin in stations for destination in stations]
+    print "%d stations, %d pairs" % (len(stations), len(pairs))
+
+    start = time.time()
+    scalar = [wtime._get_distance_vincenty(origin, destination) for origin, destination in pairs]
+    scalar_time = time.time() - start
+    scalar_distances = np.array([distance for distance, duration in scalar])
+    scalar_durations = np.array([duration for distance, duration in scalar])
+
+    start = time.time()
+    distances, durations = wtime.get_distances_vincenty(
+        [origin['lat'] for origin, destination in pairs], [origin['lon'] for origin, destination in pairs],
+        [destination['lat'] for origin, destination in pairs], [destination['lon'] for origin, destination in pairs])
+    batch_time = time.time() - start
+
+    # the results should be the same apart from the rounding errors
+    distances_error = np.max(np.abs(distances - scalar_distances) / np.maximum(scalar_distances, 1))
+    durations_error = np.max(np.abs(durations - scalar_durations) / np.maximum(scalar_durations, 1))
+    print "max relative error: distance %g, duration %g" % (distances_error, durations_error)
+    print "scalar: %.3f s (%.0f pairs/s)" % (scalar_time, len(pairs) / scalar_time)
+    print "batch: %.3f s (%.0f pairs/s)" % (batch_time, len(pairs) / batch_time)
+    print "speedup: %.1fx" % (scalar_time / batch_time)
+
+    if distances_error > tolerance or durations_error > tolerance:
+        print "The batch results don't agree with the scalar ones"
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -7,7 +7,19 @@ var Main = (function() {
         timeInterval: 500,
         current_image: 0,
         num_images: 0,
+        frames: [],
+        format: 'png',
+        base_url: '',
+        segments: {},
+        png: {},
+        prefetched: {},
+        feed: null,
         intervalFunctionId: null,
+        // the colors of matplotlib used by the networks
+        colors: {
+            'g': '#008000', 'y': '#bfbf00', 'b': '#0000ff',
+            'r': '#ff0000', 'm': '#bf00bf', 'c': '#00bfbf'
+        },
 
         run: function() {
             if(!_private.intervalFunctionId) {
@@ -16,11 +28,15 @@ var Main = (function() {
                     _private.update_images(that.options.images_data, _private.current_image);
                     _private.current_image += 1;
                     _private.current_image %= _private.num_images;
+                    _private.prefetch(that.options.images_data, _private.current_image);
                 }, _private.timeInterval);
             }
         },
 
         update_images: function(images_data, current_image) {
+            if(!_private.num_images) {
+                return;
+            }
             for(var i = 0; i<images_data.length; i++) {
                 _private.image_handler(images_data[i], current_image);
             }
@@ -126,20 +142,329 @@ var Main = (function() {
         },
 
         image_handler: function(image_data, current_image) {
-            var str_num_image = ("000" + current_image).slice(-4);
-            var image_name = image_data.image_prefix + str_num_image + '.png';
-            var src_image = image_data.image_dir + '/' + image_name;
-            $('#'+image_data.id).attr('src', src_image);
+            if(_private.format === 'canvas') {
+                _private.canvas_handler(image_data, current_image);
+                return;
+            }
+            var timestamp = _private.frames[current_image];
+            var segments = _private.segments[image_data.weight_key] || {};
+            var entry = segments[timestamp];
+            if(entry && _private.format === 'sprites') {
+                _private.sprite_handler(image_data, entry);
+            }
+            else if(entry && _private.format === 'videos') {
+                _private.video_handler(image_data, entry);
+            }
+            else {
+                var src_image = _private.frame_url(image_data, current_image);
+                _private.show_element(image_data, $('#'+image_data.id).attr('src', src_image));
+            }
+        },
+
+        frame_url: function(image_data, current_image) {
+            // the image of the frame, the sprite sheet with it or the png
+            var timestamp = _private.frames[current_image];
+            var entry = (_private.segments[image_data.weight_key] || {})[timestamp];
+            if(entry && _private.format === 'sprites') {
+                return _private.base_url + entry.segment.file;
+            }
+            var files = _private.png[image_data.weight_key];
+            if(files && files[current_image]) {
+                // the png with the hash of its content, see Server.py
+                return _private.base_url + files[current_image];
+            }
+            // the images are named by the timestamp of the frame
+            return image_data.image_dir + '/' + image_data.image_prefix + timestamp + '.png';
+        },
+
+        prefetch: function(images_data, current_image) {
+            // the images of the frames shown in the next prefetch_time ms
+            // are loaded while playing, and the ones already shown are
+            // forgotten. The videos and the feed are loaded by the browser.
+            if(!_private.num_images || _private.format === 'canvas' || _private.format === 'videos') {
+                return;
+            }
+            var options = _private.options;
+            var num_frames = Math.min(Math.ceil((options.prefetch_time || 3000) / _private.timeInterval),
+                                      options.max_prefetch || 30, _private.num_images);
+            var prefetched = {};
+            for(var i = 0; i < num_frames; i++) {
+                var image = (current_image + i) % _private.num_images;
+                for(var j = 0; j < images_data.length; j++) {
+                    var url = _private.frame_url(images_data[j], image);
+                    if(!prefetched[url]) {
+                        prefetched[url] = _private.prefetched[url];
+                        if(!prefetched[url]) {
+                            prefetched[url] = new Image();
+                            prefetched[url].src = url;
+                        }
+                    }
+                }
+            }
+            _private.prefetched = prefetched;
+        },
+
+        show_element: function(image_data, $element) {
+            // only the element of the format used is visible in the panel
+            var id = '#' + image_data.id;
+            $(id + ', ' + id + '_sprite, ' + id + '_video, ' + id + '_canvas').addClass('hidden');
+            $element.removeClass('hidden');
+        },
+
+        sprite_handler: function(image_data, entry) {
+            // the frame is a cell of the sheet, the sheet is scaled so a
+            // cell fills the element and moved to the cell
+            var sheet = entry.segment;
+            var $sprite = $('#' + image_data.id + '_sprite');
+            if(!$sprite.length) {
+                $sprite = $('<div class="sprite img-thumbnail"></div>').attr('id', image_data.id + '_sprite');
+                $('#'+image_data.id).after($sprite);
+            }
+            var column = entry.index % sheet.columns;
+            var row = Math.floor(entry.index / sheet.columns);
+            $sprite.css({
+                'background-image': 'url(' + _private.base_url + sheet.file + ')',
+                'background-size': (sheet.columns * 100) + '% ' + (sheet.rows * 100) + '%',
+                'background-position': (sheet.columns > 1 ? column * 100 / (sheet.columns - 1) : 0) + '% ' +
+                                       (sheet.rows > 1 ? row * 100 / (sheet.rows - 1) : 0) + '%',
+                'padding-bottom': (sheet.height * 100 / sheet.width) + '%'
+            });
+            _private.show_element(image_data, $sprite);
+        },
+
+        video_handler: function(image_data, entry) {
+            // every frame lasts 1 / fps seconds, the middle of the frame is shown
+            var segment = entry.segment;
+            var $video = $('#' + image_data.id + '_video');
+            if(!$video.length) {
+                $video = $('<video muted preload="auto" class="img-responsive img-thumbnail"></video>')
+                    .attr('id', image_data.id + '_video');
+                $('#'+image_data.id).after($video);
+            }
+            var video = $video[0];
+            var src = _private.base_url + segment.file;
+            video.frame_time = (entry.index + 0.5) / segment.fps;
+            if(video.getAttribute('src') !== src) {
+                // the time can only be changed when the video is loaded
+                $video.one('loadedmetadata', function() {
+                    video.currentTime = video.frame_time;
+                });
+                video.setAttribute('src', src);
+            }
+            else if(video.readyState > 0) {
+                video.currentTime = video.frame_time;
+            }
+            _private.show_element(image_data, $video);
+        },
+
+        load_feed: function(text) {
+            // the header and a line for every timestamp, see FrameFeed.py
+            var lines = text.split('\n');
+            var feed = {
+                header: JSON.parse(lines[0]),
+                lines: [],
+                keyframes: [],  // the keyframe before every line
+                position: -1,
+                stations: {},
+                nodes: {},
+                edges: {}
+            };
+            var keyframe = 0;
+            for(var i = 1; i < lines.length; i++) {
+                if(lines[i]) {
+                    var line = JSON.parse(lines[i]);
+                    if(line.k) {
+                        keyframe = feed.lines.length;
+                    }
+                    feed.lines.push(line);
+                    feed.keyframes.push(keyframe);
+                }
+            }
+            _private.feed = feed;
+            _private.format = 'canvas';
+            _private.frames = $.map(feed.lines, function(line) { return line.t; });
+            _private.num_images = _private.frames.length;
+        },
+
+        apply_line: function(feed, line) {
+            if(line.k) {
+                feed.stations = {};
+                feed.nodes = {};
+                feed.edges = {};
+            }
+            $.each(line.s || [], function(i, station) {
+                feed.stations[station[0]] = [station[1], station[2]];
+            });
+            $.each(line.n || [], function(i, node) {
+                feed.nodes[node[0]] = node;
+            });
+            $.each(line.e || [], function(i, edge) {
+                feed.edges[edge[0] + ',' + edge[1]] = edge;
+            });
+            $.each(line.r || [], function(i, edge) {
+                delete feed.edges[edge[0] + ',' + edge[1]];
+            });
+        },
+
+        seek_feed: function(current_image) {
+            // the changes are applied from the last line shown, or from the
+            // keyframe before the line when going back or far away
+            var feed = _private.feed;
+            var start = feed.position + 1;
+            if(current_image < feed.position || feed.keyframes[current_image] > feed.position) {
+                start = feed.keyframes[current_image];
+            }
+            for(var i = start; i <= current_image; i++) {
+                _private.apply_line(feed, feed.lines[i]);
+            }
+            feed.position = current_image;
+        },
+
+        format_date: function(timestamp) {
+            // like the titles of the png files, dd-mm-yy HH:MM:SS
+            var date = new Date(timestamp * 1000);
+            var pad = function(value) { return (value < 10 ? '0' : '') + value; };
+            return pad(date.getDate()) + '-' + pad(date.getMonth() + 1) + '-' + pad(date.getFullYear() % 100) + ' ' +
+                   pad(date.getHours()) + ':' + pad(date.getMinutes()) + ':' + pad(date.getSeconds());
+        },
+
+        canvas_handler: function(image_data, current_image) {
+            var feed = _private.feed;
+            _private.seek_feed(current_image);
+            var $canvas = $('#' + image_data.id + '_canvas');
+            if(!$canvas.length) {
+                $canvas = $('<canvas width="640" height="480" class="img-responsive img-thumbnail"></canvas>')
+                    .attr('id', image_data.id + '_canvas');
+                $('#'+image_data.id).after($canvas);
+            }
+            _private.show_element(image_data, $canvas);
+            var canvas = $canvas[0];
+            var context = canvas.getContext('2d');
+            context.fillStyle = 'white';
+            context.fillRect(0, 0, canvas.width, canvas.height);
+
+            // the axes are placed like in the figures of matplotlib and the
+            // sizes are in points, 100 pixels per inch
+            var axis = feed.header.axis;
+            var left = 0.125 * canvas.width, width = 0.775 * canvas.width;
+            var top = 0.12 * canvas.height, height = 0.77 * canvas.height;
+            var point = 100 / 72;
+            var x = function(lon) { return left + (lon - axis[0]) / (axis[1] - axis[0]) * width; };
+            var y = function(lat) { return top + (axis[3] - lat) / (axis[3] - axis[2]) * height; };
+
+            context.fillStyle = 'black';
+            context.font = (12 * point) + 'px sans-serif';
+            context.textAlign = 'center';
+            context.fillText(_private.format_date(_private.frames[current_image]), canvas.width / 2, top - 8);
+
+            // the widths of the edges are divided by the max weight
+            var k = 2 + $.inArray(image_data.weight_key, feed.header.weight_keys);
+            var max_weight = 0;
+            $.each(feed.edges, function(key, edge) {
+                max_weight = Math.max(max_weight, edge[k]);
+            });
+            context.strokeStyle = _private.colors.g;
+            $.each(feed.edges, function(key, edge) {
+                var origin = feed.stations[edge[0]], destination = feed.stations[edge[1]];
+                if(max_weight && edge[k] && origin && destination) {
+                    context.lineWidth = edge[k] / max_weight * point;
+                    context.beginPath();
+                    context.moveTo(x(origin[0]), y(origin[1]));
+                    context.lineTo(x(destination[0]), y(destination[1]));
+                    context.stroke();
+                }
+            });
+
+            // the size of the nodes is the area of the marker
+            $.each(feed.nodes, function(id, node) {
+                var station = feed.stations[id];
+                if(station) {
+                    context.fillStyle = _private.colors[node[1]] || node[1];
+                    context.beginPath();
+                    context.arc(x(station[0]), y(station[1]), Math.sqrt(node[2]) / 2 * point, 0, 2 * Math.PI);
+                    context.fill();
+                }
+            });
+        },
+
+        load_manifest: function(manifest) {
+            _private.frames = manifest.frames;
+            _private.num_images = manifest.frames.length;
+            _private.png = manifest.png || {};
+            _private.prefetched = {};
+            _private.format = _private.options.format || 'auto';
+            if(_private.format === 'auto') {
+                // the sprites show exactly every frame, the videos are
+                // smaller but they need a browser that plays them
+                var video = document.createElement('video');
+                if(manifest.sprites) {
+                    _private.format = 'sprites';
+                }
+                else if(manifest.videos && video.canPlayType && video.canPlayType('video/mp4')) {
+                    _private.format = 'videos';
+                }
+                else {
+                    _private.format = 'png';
+                }
+            }
+
+            // timestamp -> sheet or segment and position of the frame in it
+            var segments = manifest[_private.format] || {};
+            _private.segments = {};
+            $.each(segments, function(weight_key, entries) {
+                var frames = _private.segments[weight_key] = {};
+                $.each(entries, function(i, segment) {
+                    $.each(segment.frames, function(index, timestamp) {
+                        frames[timestamp] = {segment: segment, index: index};
+                    });
+                });
+            });
         }
     };
 
     var _public = {
         init: function(options) {
             _private.options = options;
-            _private.num_images = options.num_images;
             _private.initEvents();
-            _private.fbackward();
             _private.initSpeed();
+            // the manifest has the timestamps of all the frames drawn and
+            // the sprite sheets and videos with them, relative to its url.
+            // The manifest of Server.py has the files with their hashes,
+            // without it the manifest of the networks is used.
+            var load_manifest = function(url) {
+                return $.getJSON(url, function(manifest) {
+                    _private.base_url = url.replace(/[^\/]*$/, '');
+                    _private.load_manifest(manifest);
+                    _private.fbackward();
+                });
+            };
+            var load_frames = function() {
+                if(options.hashed_frames_url) {
+                    load_manifest(options.hashed_frames_url).fail(function() {
+                        load_manifest(options.frames_url);
+                    });
+                }
+                else {
+                    load_manifest(options.frames_url);
+                }
+            };
+            // the feed is drawn in a canvas, without it the frames drawn
+            // by the networks are shown
+            if(options.feed_url && (options.format === 'canvas' || !options.format || options.format === 'auto')) {
+                $.ajax({url: options.feed_url, dataType: 'text'})
+                    .done(function(text) {
+                        _private.load_feed(text);
+                        _private.fbackward();
+                    })
+                    .fail(function() {
+                        if(options.format !== 'canvas') {
+                            load_frames();
+                        }
+                    });
+            }
+            else {
+                load_frames();
+            }
         }
     };
 
@@ -0,0 +1,2 @@
+# Tests of the modules with fixed data. They are run from the code directory:
+# python -m unittest discover tests
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+The index of Snapshots: the snapshots appended in order and out of order,
+the merge of the runs and the lines that are not complete.
+
+python -m unittest discover tests (from the code directory)
+"""
+
+import json
+import shutil
+import tempfile
+import unittest
+from os.path import getsize, join
+
+from Snapshots import Snapshots
+
+
+def stations(timestamp):
+    return [{'id': 1, 'bikes': timestamp % 7, 'slots': 3}]
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = join(self.tmp_dir, 'data.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, timestamps):
+        snapshots = Snapshots(self.data_file)
+        for timestamp in timestamps:
+            snapshots.append(timestamp, stations(timestamp))
+        snapshots.close()
+        return snapshots
+
+    def test_in_order(self):
+        snapshots = self.write([100, 200, 300])
+        self.assertEqual(list(snapshots), [(t, stations(t)) for t in (100, 200, 300)])
+        self.write([400, 500])
+        self.assertEqual(list(snapshots.timestamps()), [100, 200, 300, 400, 500])
+        self.assertEqual([t for t, s in snapshots.after(250)], [300, 400, 500])
+        self.assertEqual([t for t, s in snapshots.after(500)], [])
+        self.assertEqual(snapshots._indexed_size(), getsize(self.data_file))
+
+    def test_out_of_order(self):
+        snapshots = self.write([300, 100, 500])
+        snapshots.update_index()
+        # the new entries are sorted in runs of 2 and merged with the index
+        snapshots.chunk_entries = 2
+        self.write([200, 600, 400, 100, 0])
+        # with repeated timestamps the first one appended is returned
+        self.assertEqual(list(snapshots.timestamps()), [0, 100, 200, 300, 400, 500, 600])
+        self.assertEqual([t for t, s in snapshots.after(100)], [200, 300, 400, 500, 600])
+        self.assertEqual(list(snapshots), [(t, stations(t)) for t in (0, 100, 200, 300, 400, 500, 600)])
+
+    def test_partial_line(self):
+        self.write([100, 200])
+        complete_size = getsize(self.data_file)
+        # a write that didn't finish
+        with open(self.data_file, 'a') as f:
+            f.write(json.dumps([300, stations(300)])[:12])
+
+        snapshots = Snapshots(self.data_file)
+        self.assertEqual(list(snapshots.timestamps()), [100, 200])
+        self.assertEqual(snapshots._indexed_size(), complete_size)
+
+        # the line is removed before appending
+        snapshots.append(400, stations(400))
+        snapshots.append(300, stations(300))
+        snapshots.close()
+        self.assertEqual(list(snapshots), [(t, stations(t)) for t in (100, 200, 300, 400)])
+        with open(self.data_file, 'r') as f:
+            self.assertEqual([json.loads(line)[0] for line in f], [100, 200, 400, 300])
+
+
+if __name__ == "__main__":
+    unittest.main()
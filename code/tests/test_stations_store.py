@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+The build of StationsStore: the snapshots read back from the arrays and a
+rebuild that fails over an old store.
+
+python -m unittest discover tests (from the code directory)
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+from StationsStore import StationsStore
+
+
+def stations(timestamp, ids):
+    return [{'id': station_id, 'street': 'Street %d' % station_id, 'bikes': timestamp % 7, 'slots': 3,
+             'status': 'OPN' if station_id % 2 else 'CLS'} for station_id in ids]
+
+
+def snapshots(timestamps, ids):
+    return [(timestamp, stations(timestamp, ids)) for timestamp in timestamps]
+
+
+class TestStationsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = join(self.tmp_dir, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_build(self):
+        data = snapshots([100, 200, 300], [3, 1, 2])
+        store = StationsStore.build(data, self.store_dir)
+        self.assertEqual(store.ids, [1, 2, 3])
+        self.assertEqual([(t, sorted(s, key=lambda station: station['id'])) for t, s in store],
+                         snapshots([100, 200, 300], [1, 2, 3]))
+        self.assertEqual([t for t, bikes, slots, status in store.rows(after=100)], [200, 300])
+
+        # a rebuild replaces the old store
+        store = StationsStore.build(snapshots([400], [5]), self.store_dir)
+        self.assertEqual(list(store), snapshots([400], [5]))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['store'])
+
+    def test_failed_rebuild(self):
+        StationsStore.build(snapshots([100, 200], [1, 2]), self.store_dir)
+
+        class Changed(object):
+            # the snapshots have one more timestamp the second time
+            reads = 0
+
+            def __iter__(self):
+                self.reads += 1
+                return iter(snapshots(range(self.reads + 2), [1, 2, 3]))
+
+        self.assertRaises(ValueError, StationsStore.build, Changed(), self.store_dir)
+        self.assertEqual(list(StationsStore(self.store_dir)), snapshots([100, 200], [1, 2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
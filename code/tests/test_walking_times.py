@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+The vectorized vincenty distances of WalkingTimes against the scalar ones
+of geopy, with fixed coordinates.
+
+python -m unittest discover tests (from the code directory)
+"""
+
+import unittest
+
+import numpy as np
+from geopy.distance import vincenty
+
+from WalkingTimes import WalkingTimes, vincenty_km
+
+# stations of Bicing and some far points (lat, lon)
+COORDS = [
+    (41.397952, 2.180042),
+    (41.394778, 2.181164),
+    (41.393699, 2.181050),
+    (41.385011, 2.175727),
+    (41.376433, 2.168508),
+    (41.397952, 2.180042),  # the same of the first one
+    (41.416778, 2.147520),
+    (40.416775, -3.703790),  # Madrid
+    (0.0, 0.0),
+    (0.0, 10.0),  # on the equator
+    (-33.868820, 151.209290),  # Sydney
+    (89.9, 45.0)
+    ]
+
+
+class TestVincenty(unittest.TestCase):
+    tolerance = 1e-9
+
+    def setUp(self):
+        self.wtime = WalkingTimes(use_cache=False, use_google_api=False)
+        self.pairs = [(origin, destination) for origin in COORDS for destination in COORDS]
+
+    def assert_close(self, values, expected):
+        values, expected = np.asarray(values), np.asarray(expected)
+        self.assertEqual(values.shape, expected.shape)
+        error = np.abs(values - expected) / np.maximum(np.abs(expected), 1)
+        self.assertLessEqual(error.max(), self.tolerance)
+
+    def test_vincenty_km(self):
+        distances = vincenty_km(*zip(*[origin + destination for origin, destination in self.pairs]))
+        self.assert_close(distances, [vincenty(origin, destination).km for origin, destination in self.pairs])
+
+    def test_coincident_points(self):
+        lats, lons = zip(*COORDS)
+        self.assertTrue((vincenty_km(lats, lons, lats, lons) == 0).all())
+        # the first station is twice in the coordinates
+        self.assertEqual(vincenty_km(COORDS[0][0], COORDS[0][1], COORDS[5][0], COORDS[5][1]), 0)
+
+    def test_scalar_coordinates(self):
+        origin, destination = COORDS[0], COORDS[3]
+        distance = vincenty_km(origin[0], origin[1], destination[0], destination[1])
+        self.assertEqual(distance.shape, ())
+        self.assert_close(distance, vincenty(origin, destination).km)
+
+    def test_get_distances_vincenty(self):
+        origins = [{'lat': lat, 'lon': lon} for (lat, lon), destination in self.pairs]
+        destinations = [{'lat': lat, 'lon': lon} for origin, (lat, lon) in self.pairs]
+        scalar = [self.wtime._get_distance_vincenty(origin, destination)
+                  for origin, destination in zip(origins, destinations)]
+        distances, durations = self.wtime.get_distances_vincenty(
+            [origin['lat'] for origin in origins], [origin['lon'] for origin in origins],
+            [destination['lat'] for destination in destinations], [destination['lon'] for destination in destinations])
+        self.assert_close(distances, [distance for distance, duration in scalar])
+        self.assert_close(durations, [duration for distance, duration in scalar])
+
+
+if __name__ == "__main__":
+    unittest.main()